@@ -0,0 +1,63 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+
+# Ingests files through the local pipeline, then asks the retrieval handler questions
+# against the same LocalIndex and vault, printing the answer as it streams and the
+# per-step latency: question embedding, filtered search, ranged chunk fetches and
+# time to first token.
+#
+#   cd LAMBDA && python -m local.ask -q "What does the report conclude?" docs/report.pdf
+#   cd LAMBDA && python -m local.ask -q "..." -q "..." --repeat 3 --bedrock-latency 0.05 notes.txt
+
+USER_ID = 'local-user'
+SUBJECT_ID = 'local-subject'
+
+def main():
+    from local.run_pipeline import LocalPipeline
+
+    parser = argparse.ArgumentParser(description="Ask questions against locally ingested files")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('-q', '--question', action='append', required=True)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=1, help="ask each question this many times (warm runs)")
+    parser.add_argument('--workdir', help="ledger, caches and index (default: a fresh temp dir)")
+    parser.add_argument('--bedrock-latency', type=float, default=0.0, help="seconds per fake Bedrock call")
+    args = parser.parse_args()
+
+    pipeline = LocalPipeline(args.workdir or tempfile.mkdtemp(prefix='velocity-ask-'),
+                             bedrock_latency=args.bedrock_latency)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for path in args.files:
+            pipeline.upload(path, USER_ID, SUBJECT_ID)
+        pipeline.run()
+        retriever = pipeline.handler('retriever')
+
+    out = sys.stdout
+    results = []
+    for question in args.question:
+        for _ in range(args.repeat):
+            print(f"\nQ: {question}\nA: ", end='', flush=True)
+            request = {"question": question, "user_id": USER_ID, "subject_id": SUBJECT_ID, "top_k": args.top_k}
+            # The handler's own log lines go to stderr, the answer to stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                for item in retriever.stream_answer(request):
+                    if item['type'] == 'token':
+                        out.write(item['text'])
+                        out.flush()
+                    elif item['type'] == 'sources':
+                        sources = item['sources']
+                    else:
+                        metrics = item['metrics']
+            print()
+            for source in sources:
+                print(f"  [{source['score']}] {source['id']}")
+            results.append({"question": question, **metrics})
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
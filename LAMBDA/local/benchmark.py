@@ -0,0 +1,162 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from local import corpus
+
+# Ingestion benchmark: each corpus case runs through the local pipeline in a fresh
+# process (clean module state, honest peak RSS), `--repeat` times. Timings keep the
+# median; API calls and bytes are deterministic. Results are compared metric by
+# metric against a baseline JSON and any cost that grew past its threshold fails
+# the run. Timings are machine specific: record the baseline on the machine that
+# compares against it.
+#
+#   cd LAMBDA && python -m local.benchmark --update-baseline
+#   cd LAMBDA && python -m local.benchmark --output bench.json   # exits 1 on regression
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(LAMBDA_DIR, 'local', 'bench_baseline.json')
+
+# Relative growth allowed per metric family before it counts as a regression
+THRESHOLDS = {"seconds": 0.25, "calls": 0.05, "bytes": 0.10, "rss": 0.20}
+# Timing noise floor: differences below this many seconds never fail
+MIN_SECONDS_DELTA = 0.05
+# A single run swings well past the thresholds on short cases; timings only fail the
+# run when both it and the baseline are medians of at least this many repeats
+MIN_TIMING_REPEAT = 3
+
+def run_case(path, workdir, bedrock_latency):
+    from local import run_pipeline
+    sys.path.insert(0, LAMBDA_DIR)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return run_pipeline.run_files([path], workdir, bedrock_latency=bedrock_latency)
+
+def measure(path, workdir, bedrock_latency):
+    # A spawned process per run: no module state or forked RSS carried between cases
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(run_case, path, workdir, bedrock_latency).result()
+
+def metrics(report):
+    # Flat {family.name: value}, lower is better for every entry
+    out = {"seconds.total": report['elapsed_s'], "rss.peak_mb": report['peak_rss_mb']}
+    for stage, stats in report['stages'].items():
+        out[f"seconds.{stage}"] = stats.get('seconds', 0.0)
+        out[f"calls.{stage}_invocations"] = stats.get('invocations', stats.get('jobs', 0))
+    for service, stats in report['services'].items():
+        calls = stats['calls']
+        if isinstance(calls, dict):
+            for op, n in calls.items():
+                out[f"calls.{service}.{op}"] = n
+            for op, n in stats['bytes'].items():
+                if n:
+                    out[f"bytes.{service}.{op}"] = n
+        else:
+            out[f"calls.{service}"] = calls
+    return out
+
+def run_suite(cases, repeat, bedrock_latency, workroot):
+    results = {}
+    for name, path in cases.items():
+        runs = [measure(path, os.path.join(workroot, f"{name}-{i}"), bedrock_latency) for i in range(repeat)]
+        samples = [metrics(r) for r in runs]
+        merged = {}
+        for key in samples[0]:
+            values = [s.get(key, 0) for s in samples]
+            merged[key] = round(statistics.median(values), 4) if key.startswith('seconds.') else max(values)
+        results[name] = {
+            "input_bytes": runs[0]['input_bytes'], "vectors": runs[0]['vectors'],
+            "vault_files": runs[0]['vault_files'], "dead_letters": runs[0]['dead_letters'],
+            "metrics": merged
+        }
+        print(f"{name}: {merged['seconds.total']}s, {runs[0]['vectors']} vectors, "
+              f"{merged['rss.peak_mb']} MB peak", file=sys.stderr)
+    return results
+
+def compare(results, baseline, thresholds=THRESHOLDS, timings=True):
+    regressions, improvements = [], []
+    for case, result in results.items():
+        base = baseline.get('cases', {}).get(case)
+        if not base:
+            continue
+        for key, value in result['metrics'].items():
+            old = base['metrics'].get(key)
+            if old is None:
+                continue
+            limit = thresholds[key.split('.', 1)[0]]
+            delta = value - old
+            if key.startswith('seconds.') and (not timings or abs(delta) < MIN_SECONDS_DELTA):
+                continue
+            change = delta / old if old else (1.0 if delta else 0.0)
+            entry = {"case": case, "metric": key, "baseline": old, "current": value, "change": round(change, 4)}
+            if change > limit:
+                regressions.append(entry)
+            elif change < -limit:
+                improvements.append(entry)
+        if result['dead_letters'] > base.get('dead_letters', 0):
+            regressions.append({"case": case, "metric": "dead_letters", "baseline": base.get('dead_letters', 0),
+                                "current": result['dead_letters'], "change": None})
+    return regressions, improvements
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion pipeline against local stand-ins")
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'velocity-corpus'))
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--cases', help="comma separated subset of case names")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--bedrock-latency', type=float, default=0.0)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--output', help="write results JSON here")
+    for family, limit in THRESHOLDS.items():
+        parser.add_argument(f"--{family}-threshold", type=float, default=limit)
+    args = parser.parse_args()
+
+    cases = corpus.generate(args.corpus, args.scale)
+    if args.cases:
+        wanted = args.cases.split(',')
+        cases = {name: path for name, path in cases.items() if name in wanted}
+    workroot = tempfile.mkdtemp(prefix='velocity-bench-')
+    results = {"scale": args.scale, "repeat": args.repeat, "bedrock_latency": args.bedrock_latency,
+               "cases": run_suite(cases, args.repeat, args.bedrock_latency, workroot)}
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+
+    thresholds = {family: getattr(args, f"{family}_threshold") for family in THRESHOLDS}
+    regressions, improvements = [], []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline.get('scale'), baseline.get('bedrock_latency')) != (args.scale, args.bedrock_latency):
+            print("Baseline was recorded with a different --scale/--bedrock-latency, not comparing", file=sys.stderr)
+        else:
+            timings = min(args.repeat, baseline.get('repeat', 1)) >= MIN_TIMING_REPEAT
+            if not timings:
+                print(f"Timings not compared: needs --repeat >= {MIN_TIMING_REPEAT} here and in the baseline",
+                      file=sys.stderr)
+            regressions, improvements = compare(results['cases'], baseline, thresholds, timings)
+    else:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one", file=sys.stderr)
+    results.update({"regressions": regressions, "improvements": improvements})
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    for r in regressions:
+        print(f"REGRESSION {r['case']} {r['metric']}: {r['baseline']} -> {r['current']}", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import velocity_cache
+import velocity_chunker
+import velocity_codec
+import velocity_trace
+from local import corpus
+from local.fakes import FakeS3
+
+# Chunk message formats side by side: the original JSON bodies against velocity_codec
+# v1 records, on the chunks the manager would send for the corpus CSV and text files.
+# Reports bytes on the queue, encode time on the producer and decode time on the
+# worker (JSON parse included), per chunk.
+#
+#   cd LAMBDA && python -m local.codec_bench
+#   cd LAMBDA && python -m local.codec_bench --scale 4 --repeat 5
+
+CLAIM_BUCKET = 'velocity-claims'
+
+def chunk_bodies(directory, scale):
+    # Message bodies as send_to_worker builds them, manifest on
+    files = corpus.generate(directory, scale=scale)
+    bodies = []
+    for name, data_type in (('csv_long', 'csv'), ('csv_wide', 'csv'), ('txt_large', 'text')):
+        path = files[name]
+        with open(path, newline='', encoding='utf-8') as f:
+            if data_type == 'csv':
+                chunks = velocity_chunker.pack((velocity_chunker.csv_row_text(r) for r in csv.DictReader(f)),
+                                               overlap_tokens=0, joiner="\n")
+            else:
+                chunks = velocity_chunker.pack(velocity_chunker.stream_paragraphs(f))
+            chunks = list(chunks)
+        meta = {"user_id": 'bench-user', "subject_id": 'bench-subject',
+                "file_id": f"{uuid.uuid4().hex[:12]}_{os.path.basename(path)}"}
+        meta = {**velocity_trace.Span('manager', meta).carry(meta),
+                "source_file": f"uploads/bench-user/bench-subject/{os.path.basename(path)}"}
+        for i, content in enumerate(chunks):
+            bodies.append({"type": data_type, "content": content, "part_num": i + 1, "total_parts": len(chunks),
+                           "metadata": meta, "chunk_hash": velocity_cache.content_key(content)[:16],
+                           "embed": True, "revision": 1})
+    return bodies
+
+def measure(bodies, codec, repeat):
+    velocity_codec.CHUNK_CODEC = codec
+    s3 = FakeS3()
+    encode_s = decode_s = float('inf')
+    for _ in range(repeat):
+        encoder = velocity_codec.Encoder(s3, CLAIM_BUCKET)
+        decoder = velocity_codec.Decoder(s3, CLAIM_BUCKET)
+        started = time.perf_counter()
+        messages = [encoder.encode(body) for body in bodies]
+        encode_s = min(encode_s, time.perf_counter() - started)
+        started = time.perf_counter()
+        decoded = [decoder.decode(message) for message in messages]
+        decode_s = min(decode_s, time.perf_counter() - started)
+    for body, back in zip(bodies, decoded):
+        assert back['content'] == body['content'] and back['metadata'] == body['metadata'], "round trip differs"
+    queue_bytes = sum(len(m.encode('utf-8')) for m in messages)
+    return {"codec": codec, "messages": len(messages), "queue_bytes": queue_bytes,
+            "bytes_per_chunk": round(queue_bytes / len(messages), 1),
+            "header_bytes": sum(s3.stats()['bytes'].values()),
+            "encode_us_per_chunk": round(encode_s / len(messages) * 1e6, 2),
+            "decode_us_per_chunk": round(decode_s / len(messages) * 1e6, 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSON and binary chunk messages")
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help="best of N timings")
+    args = parser.parse_args()
+
+    bodies = chunk_bodies(tempfile.mkdtemp(prefix='velocity-codec-'), args.scale)
+    content_bytes = sum(len(b['content'].encode('utf-8')) for b in bodies)
+    results = [measure(bodies, codec, args.repeat) for codec in ('json', 'binary')]
+    json_bytes = results[0]['queue_bytes']
+    for result in results:
+        result['vs_json'] = round(result['queue_bytes'] / json_bytes, 3)
+    print(json.dumps({"chunks": len(bodies), "content_bytes": content_bytes, "results": results}, indent=2))
+
+if __name__ == '__main__':
+    main()
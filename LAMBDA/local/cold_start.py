@@ -0,0 +1,137 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+# Cold start of each ingestion handler, each in a fresh spawned interpreter like a
+# new Lambda container: module import time (the init phase), the first invocation
+# (lazy clients, caches and connections built on demand) and a warm invocation
+# doing the same kind of work on different input. Runs against the local fakes, so
+# AWS client construction shows up only when boto3 is installed and --boto3 is set.
+#
+#   cd LAMBDA && python -m local.cold_start
+#   cd LAMBDA && python -m local.cold_start --stages worker,vision --runs 5
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ('analyzer', 'manager', 'croper', 'vision', 'worker')
+
+def fixtures(directory):
+    # Built in the parent, so the children import nothing before the handler does
+    import fitz
+    from local import corpus
+    import random
+    pdf = os.path.join(directory, 'cold.pdf')
+    if not os.path.exists(pdf):
+        corpus.write_pdf(pdf, random.Random(1), pages=2, figures_per_page=1)
+    txt = os.path.join(directory, 'cold.txt')
+    if not os.path.exists(txt):
+        corpus.write_txt(txt, random.Random(2), paragraphs=200)
+    crops = []
+    doc = fitz.open(pdf)
+    for i, page in enumerate(doc):
+        path = os.path.join(directory, f"crop-{i}.jpg")
+        page.get_pixmap(clip=fitz.Rect(72, 600, 392, 700)).save(path)
+        crops.append(path)
+    doc.close()
+    return {"pdf": pdf, "txt": txt, "crops": crops}
+
+def events(pipeline, stage, files):
+    # Two events of the same shape on different input: cold, then warm
+    from local import run_pipeline as rp
+
+    def upload(bucket, path, key):
+        meta = {"user_id": 'cold-user', "subject_id": 'cold-subject', "file_id": uuid.uuid4().hex}
+        with open(path, 'rb') as f:
+            pipeline.s3.put_object(Bucket=bucket, Key=key, Body=f.read(), Metadata=meta)
+        return meta, {"Records": [{"eventName": 'ObjectCreated:Put',
+                                   "s3": {"bucket": {"name": bucket}, "object": {"key": key}}}]}
+
+    for i in range(2):
+        if stage == 'analyzer':
+            yield upload(rp.UPLOAD_BUCKET, files['pdf'], f"uploads/cold-{i}.pdf")[1]
+        elif stage == 'manager':
+            yield upload(rp.UPLOAD_BUCKET, files['txt'], f"uploads/cold-{i}.txt")[1]
+        elif stage == 'croper':
+            meta, _ = upload(rp.UPLOAD_BUCKET, files['pdf'], f"uploads/cold-{i}.pdf")
+            bbox = {"Left": 0.1, "Top": 0.7, "Width": 0.5, "Height": 0.15}
+            yield {"bucket": rp.UPLOAD_BUCKET, "key": f"uploads/cold-{i}.pdf", "metadata": meta,
+                   "figures": [{"page": p, "bbox": bbox, "id": f"fig{p}"} for p in (1, 2)]}
+        elif stage == 'vision':
+            yield upload(rp.IMAGE_BUCKET, files['crops'][i], f"crops/cold-{i}.jpg")[1]
+        elif stage == 'worker':
+            meta = {"user_id": 'cold-user', "subject_id": 'cold-subject', "file_id": uuid.uuid4().hex}
+            records = [{"messageId": f"m{i}-{n}", "attributes": {}, "body": json.dumps({
+                "type": "text", "content": f"cold start probe {i} chunk {n} " * 40, "part_num": n + 1,
+                "total_parts": 10, "metadata": meta})} for n in range(10)]
+            yield {"Records": records}
+
+def measure(stage, files, workdir, boto3_clients):
+    sys.path.insert(0, LAMBDA_DIR)
+    before = set(sys.modules)
+    from local.run_pipeline import LocalPipeline, peak_rss_mb
+    pipeline = LocalPipeline(workdir)
+    harness_modules = set(sys.modules) - before
+    stage_events = events(pipeline, stage, files)
+    out = {"stage": stage}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        pipeline.handler(stage)
+        out['import_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        out['modules_imported'] = len(set(sys.modules) - before - harness_modules)
+        for label in ('first_invoke_ms', 'warm_invoke_ms'):
+            event = next(stage_events)
+            started = time.perf_counter()
+            pipeline.invoke(stage, event)
+            out[label] = round((time.perf_counter() - started) * 1000, 1)
+    if boto3_clients:
+        out['boto3_client_ms'] = boto3_client_ms(stage)
+    out['peak_rss_mb'] = peak_rss_mb()
+    return out
+
+def boto3_client_ms(stage):
+    # What the first invoke would add in AWS: building each client the stage uses
+    services = {"analyzer": ['s3', 'textract', 'lambda'], "manager": ['s3', 'sqs', 'textract', 'lambda'],
+                "croper": ['s3'], "vision": ['s3', 'sqs', 'bedrock-runtime'],
+                "worker": ['s3', 'bedrock-runtime', 'dynamodb']}[stage]
+    import boto3
+    out = {}
+    for service in services:
+        started = time.perf_counter()
+        boto3.client(service, region_name=os.environ.get('AWS_REGION', 'us-east-1'))
+        out[service] = round((time.perf_counter() - started) * 1000, 1)
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure handler import time and first-invoke latency")
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--runs', type=int, default=3, help="fresh interpreters per stage; medians reported")
+    parser.add_argument('--boto3', action='store_true', help="also time real boto3 client construction")
+    args = parser.parse_args()
+
+    workroot = tempfile.mkdtemp(prefix='velocity-cold-')
+    files = fixtures(workroot)
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for stage in args.stages.split(','):
+        runs = []
+        for i in range(args.runs):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                runs.append(pool.submit(measure, stage, files, os.path.join(workroot, f"{stage}-{i}"),
+                                        args.boto3).result())
+        summary = dict(runs[0])
+        for key in ('import_ms', 'first_invoke_ms', 'warm_invoke_ms', 'peak_rss_mb'):
+            values = sorted(r[key] for r in runs)
+            summary[key] = values[len(values) // 2]
+        results.append(summary)
+        print(f"{stage}: import {summary['import_ms']} ms, first invoke {summary['first_invoke_ms']} ms, "
+              f"warm {summary['warm_invoke_ms']} ms", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
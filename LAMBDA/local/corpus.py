@@ -0,0 +1,94 @@
+import csv
+import os
+import random
+
+# Deterministic benchmark inputs: the same seed and scale always produce the same
+# bytes, so runs on one machine are comparable. Sizes grow linearly with scale.
+#
+#   cd LAMBDA && python -m local.corpus /tmp/velocity-corpus --scale 2
+
+WORDS = ("vector embedding retrieval chunk token layout figure page index query latency throughput "
+         "subject document manager worker vision model cache ledger assembly queue batch stream").split()
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def paragraph(rng, sentences=6):
+    return " ".join(sentence(rng, rng.randint(8, 18)) for _ in range(sentences))
+
+def write_pdf(path, rng, pages, figures_per_page, scan_every=0):
+    # scan_every=N replaces every Nth page with a rendered image of itself, like a scan
+    import fitz
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 60), f"Section {p + 1}: {sentence(rng, 4)}", fontsize=18)
+        y = 90
+        for _ in range(4):
+            page.insert_textbox(fitz.Rect(72, y, 540, y + 110), paragraph(rng), fontsize=10)
+            y += 120
+        for f in range(figures_per_page):
+            # Varied content, so figures do not all collapse onto one vision cache entry
+            pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 160, 100), False)
+            pix.clear_with(rng.randint(0, 255))
+            for _ in range(20):
+                x, y0 = rng.randrange(160), rng.randrange(100)
+                pix.set_rect(fitz.IRect(x, y0, x + rng.randint(5, 40), y0 + rng.randint(5, 30)),
+                             (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+            left = 72 + f * 170
+            page.insert_image(fitz.Rect(left, 600, left + 160, 700), pixmap=pix)
+        if scan_every and (p + 1) % scan_every == 0:
+            scan = page.get_pixmap(dpi=72)
+            doc.delete_page(p)
+            page = doc.new_page(p)
+            page.insert_image(page.rect, stream=scan.tobytes("jpeg"))
+    doc.save(path)
+    doc.close()
+
+def write_csv(path, rng, rows, columns):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([f"col_{c}" for c in range(columns)])
+        for r in range(rows):
+            row = [r] + [rng.choice(WORDS) if c % 3 else round(rng.random() * 1000, 3) for c in range(1, columns)]
+            if r % 50 == 0:
+                row[-1] = f"quoted, multi-line\n{sentence(rng, 6)}"
+            writer.writerow(row)
+
+def write_txt(path, rng, paragraphs):
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(paragraphs):
+            f.write(paragraph(rng, rng.randint(2, 10)) + "\n\n")
+
+def generate(directory, scale=1, seed=7):
+    # Returns {case name: path}; existing files are reused
+    os.makedirs(directory, exist_ok=True)
+    specs = {
+        "pdf_figures.pdf": lambda p, rng: write_pdf(p, rng, pages=12 * scale, figures_per_page=2),
+        "pdf_single.pdf": lambda p, rng: write_pdf(p, rng, pages=1, figures_per_page=1),
+        "pdf_mixed.pdf": lambda p, rng: write_pdf(p, rng, pages=16 * scale, figures_per_page=1, scan_every=4),
+        "csv_long.csv": lambda p, rng: write_csv(p, rng, rows=20000 * scale, columns=6),
+        "csv_wide.csv": lambda p, rng: write_csv(p, rng, rows=1000 * scale, columns=120),
+        "txt_large.txt": lambda p, rng: write_txt(p, rng, paragraphs=8000 * scale),
+    }
+    cases = {}
+    for name, write in specs.items():
+        path = os.path.join(directory, f"s{scale}-{seed}-{name}")
+        if not os.path.exists(path):
+            write(path + ".tmp", random.Random(f"{seed}:{name}"))
+            os.replace(path + ".tmp", path)
+        cases[name.rsplit('.', 1)[0]] = path
+    return cases
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate the benchmark corpus")
+    parser.add_argument('directory')
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    for name, path in generate(args.directory, args.scale, args.seed).items():
+        print(f"{name}\t{os.path.getsize(path)}\t{path}")
+
+if __name__ == '__main__':
+    main()
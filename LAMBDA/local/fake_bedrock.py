@@ -0,0 +1,112 @@
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+# In-process stand-in for bedrock-runtime that throttles like the real service:
+# calls beyond `capacity` in flight (or a random `throttle_rate` share) raise a
+# ClientError-shaped ThrottlingException. Embeddings are a deterministic hash of
+# the text, so equal texts embed equally and runs are reproducible.
+#
+#   cd LAMBDA && python -m local.fake_bedrock --requests 2000 --threads 32
+
+class FakeClientError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(f"{code}: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+def hash_embedding(text, dimensions=1024):
+    # Signed bytes from an extendable-output hash: cheap enough not to dominate profiles
+    values = array('b', hashlib.shake_256(" ".join(text.split()).encode('utf-8')).digest(dimensions))
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+class FakeBedrock:
+    def __init__(self, capacity=16, latency=0.02, throttle_rate=0.0, seed=0):
+        self.capacity, self.latency, self.throttle_rate = capacity, latency, throttle_rate
+        self.random = random.Random(seed)
+        self.inflight = 0
+        self.calls = self.throttles = 0
+        self.lock = threading.Lock()
+
+    def _enter(self):
+        with self.lock:
+            self.calls += 1
+            if self.inflight >= self.capacity or self.random.random() < self.throttle_rate:
+                self.throttles += 1
+                raise FakeClientError("ThrottlingException", "Too many requests, please wait before trying again.")
+            self.inflight += 1
+
+    def _exit(self):
+        with self.lock:
+            self.inflight -= 1
+
+    def invoke_model(self, body, modelId, **kwargs):
+        self._enter()
+        try:
+            time.sleep(self.latency)
+            request = json.loads(body)
+            if 'embed' in modelId:
+                payload = {"embedding": hash_embedding(request['inputText'], request.get('dimensions', 1024))}
+            else:
+                payload = {"content": [{"type": "text", "text": self._answer(request)}]}
+            return {"body": io.BytesIO(json.dumps(payload).encode('utf-8'))}
+        finally:
+            self._exit()
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        self._enter()
+        try:
+            words = self._answer(json.loads(body)).split(" ")
+        finally:
+            self._exit()
+        return {"body": self._stream(words)}
+
+    def _stream(self, words):
+        for i, word in enumerate(words):
+            time.sleep(self.latency / 10)
+            delta = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": word if i == 0 else " " + word}}
+            yield {"chunk": {"bytes": json.dumps(delta).encode('utf-8')}}
+
+    def _answer(self, request):
+        content = request['messages'][-1]['content']
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+        text = " ".join(p.get('text', '') for p in parts if p.get('type') == 'text')
+        images = sum(1 for p in parts if p.get('type') == 'image')
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:8]
+        return f"Fake answer {digest} covering {len(text.split())} prompt words and {images} images."
+
+def main():
+    import argparse
+    import velocity_bedrock
+
+    parser = argparse.ArgumentParser(description="Drive the Bedrock wrapper against a throttling fake")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--capacity', type=int, default=8)
+    parser.add_argument('--throttle-rate', type=float, default=0.02)
+    args = parser.parse_args()
+
+    fake = FakeBedrock(capacity=args.capacity, throttle_rate=args.throttle_rate)
+    client = velocity_bedrock.BedrockClient(fake, base_delay=0.01, max_delay=0.5)
+    body = json.dumps({"inputText": "throughput probe", "dimensions": 8})
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(lambda _: client.invoke_model(body=body, modelId='amazon.titan-embed-text-v2:0'),
+                      range(args.requests)))
+    elapsed = time.monotonic() - started
+    print(json.dumps({
+        "requests": args.requests, "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 1),
+        "service_calls": fake.calls, "service_throttles": fake.throttles,
+        "client": client.stats()
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
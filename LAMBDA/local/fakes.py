@@ -0,0 +1,453 @@
+import hashlib
+import io
+import itertools
+import json
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from array import array
+from collections import Counter, deque
+
+import velocity_pdftext
+from local.fake_bedrock import FakeClientError
+
+# In-memory stand-ins for the AWS services and the Pinecone index, shaped like the
+# boto3 calls the Lambdas actually make. Every call is counted per operation with
+# the bytes it moved, so a local run reports the API traffic a real one would cause.
+
+class FakeService:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.bytes = Counter()
+
+    def _record(self, op, nbytes=0):
+        with self.lock:
+            self.calls[op] += 1
+            self.bytes[op] += nbytes
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "bytes": dict(self.bytes)}
+
+class Paginator:
+    def __init__(self, method, token_in, token_out):
+        self.method, self.token_in, self.token_out = method, token_in, token_out
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            token = page.get(self.token_out)
+            if not token:
+                return
+            kwargs[self.token_in] = token
+
+class FakeS3(FakeService):
+    class exceptions:
+        class NoSuchKey(FakeClientError):
+            def __init__(self, key):
+                super().__init__('NoSuchKey', key)
+
+    def __init__(self):
+        super().__init__()
+        self.objects = {}
+        self.uploads = {}
+        # Called with (event_name, bucket, key) like an S3 event notification
+        self.listeners = []
+
+    def _notify(self, event_name, bucket, key):
+        for listener in self.listeners:
+            listener(event_name, bucket, key)
+
+    def _get(self, bucket, key):
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise self.exceptions.NoSuchKey(f"s3://{bucket}/{key}")
+
+    def _store(self, bucket, key, body, metadata, content_type, event_name):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        elif hasattr(body, 'read'):
+            body = body.read()
+        with self.lock:
+            self.objects[(bucket, key)] = {
+                "body": bytes(body), "metadata": {k.lower(): str(v) for k, v in (metadata or {}).items()},
+                "content_type": content_type or 'binary/octet-stream',
+                "etag": f'"{hashlib.md5(body).hexdigest()}"'
+            }
+        self._notify(event_name, bucket, key)
+
+    def put_object(self, Bucket, Key, Body=b"", Metadata=None, ContentType=None, **kwargs):
+        size = len(Body.encode('utf-8') if isinstance(Body, str) else Body)
+        self._record('put_object', size)
+        self._store(Bucket, Key, Body, Metadata, ContentType, 'ObjectCreated:Put')
+        return {"ETag": self.objects[(Bucket, Key)]['etag']}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._record('head_object')
+        obj = self._get(Bucket, Key)
+        return {"Metadata": dict(obj['metadata']), "ContentLength": len(obj['body']),
+                "ContentType": obj['content_type'], "ETag": obj['etag']}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        body = self._get(Bucket, Key)['body']
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            body = body[int(start):int(end) + 1 if end else None]
+        self._record('get_object', len(body))
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+    def copy_object(self, Bucket, Key, CopySource, Metadata=None, MetadataDirective='COPY',
+                    ContentType=None, **kwargs):
+        self._record('copy_object')
+        source = self._get(CopySource['Bucket'], CopySource['Key'])
+        if MetadataDirective != 'REPLACE':
+            Metadata, ContentType = source['metadata'], source['content_type']
+        self._store(Bucket, Key, source['body'], Metadata, ContentType, 'ObjectCreated:Copy')
+        return {}
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        body = self._get(Bucket, Key)['body']
+        self._record('download_file', len(body))
+        with open(Filename, 'wb') as f:
+            f.write(body)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._record('delete_object')
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._record('delete_objects')
+        with self.lock:
+            for obj in Delete['Objects']:
+                self.objects.pop((Bucket, obj['Key']), None)
+        return {"Errors": []}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self._record('list_objects_v2')
+        with self.lock:
+            keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        out = {"Contents": [{"Key": k, "Size": len(self.objects[(Bucket, k)]['body']),
+                             "ETag": self.objects[(Bucket, k)]['etag']} for k in page],
+               "KeyCount": len(page), "IsTruncated": start + MaxKeys < len(keys)}
+        if out['IsTruncated']:
+            out['NextContinuationToken'] = str(start + MaxKeys)
+        return out
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2', name
+        return Paginator(self.list_objects_v2, 'ContinuationToken', 'NextContinuationToken')
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, ContentType=None, **kwargs):
+        self._record('create_multipart_upload')
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {"parts": {}, "metadata": Metadata, "content_type": ContentType}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._record('upload_part', len(Body))
+        with self.lock:
+            self.uploads[UploadId]['parts'][PartNumber] = bytes(Body)
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._record('complete_multipart_upload')
+        with self.lock:
+            upload = self.uploads.pop(UploadId)
+        body = b"".join(upload['parts'][p['PartNumber']] for p in MultipartUpload['Parts'])
+        self._store(Bucket, Key, body, upload['metadata'], upload['content_type'],
+                    'ObjectCreated:CompleteMultipartUpload')
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._record('abort_multipart_upload')
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def keys(self, bucket, prefix=''):
+        with self.lock:
+            return sorted(k for b, k in self.objects if b == bucket and k.startswith(prefix))
+
+    def read(self, bucket, key):
+        return self._get(bucket, key)['body']
+
+class FairQueue:
+    # Standard queue with fair queuing: receives rotate over message groups, so one
+    # group's backlog never holds back another's. Without groups it is a plain FIFO.
+    # SQS weighs groups by messages in flight instead; rotation is the closest
+    # single-consumer equivalent.
+    def __init__(self):
+        self.groups = {}
+        self.rotation = deque()
+        self.size = 0
+
+    def append(self, message):
+        group = message.get('group')
+        if group not in self.groups:
+            self.groups[group] = deque()
+            self.rotation.append(group)
+        self.groups[group].append(message)
+        self.size += 1
+
+    def popleft(self):
+        group = self.rotation.popleft()
+        messages = self.groups[group]
+        message = messages.popleft()
+        if messages:
+            self.rotation.append(group)
+        else:
+            del self.groups[group]
+        self.size -= 1
+        return message
+
+    def __len__(self):
+        return self.size
+
+class FakeSQS(FakeService):
+    # Standard queues: messages wait until receive() hands them to a consumer.
+    # DelaySeconds is not simulated; delayed messages are visible at once.
+    def __init__(self):
+        super().__init__()
+        self.queues = {}
+        self.ids = itertools.count(1)
+
+    def _queue(self, url):
+        return self.queues.setdefault(url, FairQueue())
+
+    def send_message(self, QueueUrl, MessageBody, MessageGroupId=None, **kwargs):
+        self._record('send_message', len(MessageBody.encode('utf-8')))
+        message_id = f"msg-{next(self.ids)}"
+        with self.lock:
+            self._queue(QueueUrl).append({"messageId": message_id, "body": MessageBody, "receiveCount": 0,
+                                          "sentTimestamp": str(int(time.time() * 1000)), "group": MessageGroupId,
+                                          "attributes": kwargs.get('MessageAttributes', {})})
+        return {"MessageId": message_id}
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        self._record('send_message_batch', sum(len(e['MessageBody'].encode('utf-8')) for e in Entries))
+        successful = []
+        with self.lock:
+            for entry in Entries:
+                message_id = f"msg-{next(self.ids)}"
+                self._queue(QueueUrl).append({"messageId": message_id, "body": entry['MessageBody'],
+                                              "receiveCount": 0, "sentTimestamp": str(int(time.time() * 1000)),
+                                              "group": entry.get('MessageGroupId'),
+                                              "attributes": entry.get('MessageAttributes', {})})
+                successful.append({"Id": entry['Id'], "MessageId": message_id})
+        return {"Successful": successful, "Failed": []}
+
+    def receive(self, url, max_messages=10):
+        # Harness side: pops a batch shaped like the SQS event source records
+        with self.lock:
+            queue = self._queue(url)
+            batch = [queue.popleft() for _ in range(min(max_messages, len(queue)))]
+        for message in batch:
+            message['receiveCount'] += 1
+        return batch
+
+    def requeue(self, url, message):
+        with self.lock:
+            self._queue(url).append(message)
+
+    def depth(self, url):
+        with self.lock:
+            return len(self._queue(url))
+
+class FakeTextract(FakeService):
+    # LAYOUT analysis from the same PyMuPDF conversion as the born-digital fast path,
+    # so it reads text layers only and cannot OCR scans. Async jobs run when the
+    # harness calls run_job().
+
+    def __init__(self, s3, on_complete=None, schedule=None):
+        super().__init__()
+        self.s3 = s3
+        self.on_complete = on_complete
+        self.schedule = schedule
+        self.jobs = {}
+
+    def analyze_document(self, Document, FeatureTypes=None, **kwargs):
+        location = Document['S3Object']
+        blocks = self.analyze(location['Bucket'], location['Name'])
+        self._record('analyze_document')
+        for block in blocks:
+            block.pop('Page', None)
+        return {"DocumentMetadata": {"Pages": 1}, "Blocks": blocks}
+
+    def start_document_analysis(self, DocumentLocation, FeatureTypes=None, NotificationChannel=None, **kwargs):
+        self._record('start_document_analysis')
+        job_id = uuid.uuid4().hex
+        location = DocumentLocation['S3Object']
+        with self.lock:
+            self.jobs[job_id] = {"bucket": location['Bucket'], "key": location['Name'],
+                                 "status": 'IN_PROGRESS', "blocks": None}
+        if self.schedule:
+            self.schedule(job_id)
+        else:
+            self.run_job(job_id)
+        return {"JobId": job_id}
+
+    def run_job(self, job_id):
+        job = self.jobs[job_id]
+        try:
+            job['blocks'] = self.analyze(job['bucket'], job['key'])
+            job['status'] = 'SUCCEEDED'
+        except Exception as e:
+            print(f"Error: fake Textract job {job_id}: {e}")
+            job['status'] = 'FAILED'
+        if self.on_complete:
+            self.on_complete({"JobId": job_id, "Status": job['status'], "API": "StartDocumentAnalysis",
+                              "DocumentLocation": {"S3Bucket": job['bucket'], "S3ObjectName": job['key']}})
+
+    def get_document_analysis(self, JobId, MaxResults=1000, NextToken=None, **kwargs):
+        self._record('get_document_analysis')
+        job = self.jobs[JobId]
+        start = int(NextToken or 0)
+        blocks = job['blocks'] or []
+        out = {"JobStatus": job['status'], "Blocks": blocks[start:start + MaxResults]}
+        if start + MaxResults < len(blocks):
+            out['NextToken'] = str(start + MaxResults)
+        return out
+
+    def analyze(self, bucket, key):
+        import fitz
+        doc = fitz.open(stream=self.s3.read(bucket, key), filetype="pdf")
+        try:
+            blocks = []
+            for page in doc:
+                blocks += velocity_pdftext.page_blocks(page)
+            return blocks
+        finally:
+            doc.close()
+
+class FakeLambda(FakeService):
+    # invoke() hands the payload to the harness: Event is queued, RequestResponse runs inline
+    def __init__(self, dispatch):
+        super().__init__()
+        self.dispatch = dispatch
+
+    def invoke(self, FunctionName, Payload=b"{}", InvocationType='RequestResponse', **kwargs):
+        payload = Payload.encode('utf-8') if isinstance(Payload, str) else Payload
+        self._record('invoke', len(payload))
+        result = self.dispatch(FunctionName, json.loads(payload), InvocationType)
+        if InvocationType == 'Event':
+            return {"StatusCode": 202}
+        return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(result).encode('utf-8'))}
+
+class LocalIndex(FakeService):
+    # Pinecone Index stand-in over SQLite: exact cosine top-k on normalized vectors,
+    # namespaces, and the $eq/$ne/$in/$nin/$and/$or metadata filters
+    def __init__(self, path=':memory:'):
+        super().__init__()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS vectors (namespace TEXT, id TEXT, vals BLOB, metadata TEXT, "
+                        "PRIMARY KEY (namespace, id))")
+        self.db.commit()
+
+    def upsert(self, vectors, namespace='', **kwargs):
+        rows = []
+        for v in vectors:
+            if not isinstance(v, dict):
+                v = {"id": v[0], "values": v[1], "metadata": v[2] if len(v) > 2 else {}}
+            rows.append((namespace, v['id'], array('f', v['values']).tobytes(), json.dumps(v.get('metadata') or {})))
+        self._record('upsert', sum(len(r[2]) + len(r[3]) for r in rows))
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)", rows)
+            self.db.commit()
+        return {"upserted_count": len(rows)}
+
+    def query(self, vector, top_k=10, filter=None, namespace='', include_metadata=False, include_values=False,
+              **kwargs):
+        self._record('query')
+        with self.lock:
+            rows = self.db.execute("SELECT id, vals, metadata FROM vectors WHERE namespace = ?",
+                                   (namespace,)).fetchall()
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        scored = []
+        for vector_id, vals, metadata in rows:
+            metadata = json.loads(metadata)
+            if filter and not matches(metadata, filter):
+                continue
+            values = array('f', vals)
+            score = sum(a * b for a, b in zip(vector, values)) / norm
+            scored.append((score, vector_id, metadata, values))
+        scored.sort(key=lambda s: -s[0])
+        out = []
+        for score, vector_id, metadata, values in scored[:top_k]:
+            match = {"id": vector_id, "score": score}
+            if include_metadata:
+                match['metadata'] = metadata
+            if include_values:
+                match['values'] = values.tolist()
+            out.append(match)
+        return {"matches": out, "namespace": namespace}
+
+    def fetch(self, ids, namespace='', **kwargs):
+        self._record('fetch')
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT id, vals, metadata FROM vectors WHERE namespace = ? AND id IN ({','.join('?' * len(ids))})",
+                [namespace, *ids]).fetchall()
+        return {"vectors": {i: {"id": i, "values": array('f', v).tolist(), "metadata": json.loads(m)}
+                            for i, v, m in rows}, "namespace": namespace}
+
+    def delete(self, ids=None, delete_all=False, filter=None, namespace='', **kwargs):
+        self._record('delete')
+        with self.lock:
+            if delete_all:
+                self.db.execute("DELETE FROM vectors WHERE namespace = ?", (namespace,))
+            elif ids:
+                self.db.executemany("DELETE FROM vectors WHERE namespace = ? AND id = ?",
+                                    [(namespace, i) for i in ids])
+            elif filter:
+                rows = self.db.execute("SELECT id, metadata FROM vectors WHERE namespace = ?", (namespace,)).fetchall()
+                self.db.executemany("DELETE FROM vectors WHERE namespace = ? AND id = ?",
+                                    [(namespace, i) for i, m in rows if matches(json.loads(m), filter)])
+            self.db.commit()
+        return {}
+
+    def list(self, prefix='', namespace='', limit=100, **kwargs):
+        # Pages of ids in id order, like the serverless list endpoint
+        self._record('list')
+        with self.lock:
+            ids = [row[0] for row in self.db.execute(
+                "SELECT id FROM vectors WHERE namespace = ? AND substr(id, 1, ?) = ? ORDER BY id",
+                (namespace, len(prefix), prefix))]
+        for i in range(0, len(ids), limit):
+            yield ids[i:i + limit]
+
+    def describe_index_stats(self, **kwargs):
+        self._record('describe_index_stats')
+        with self.lock:
+            rows = self.db.execute("SELECT namespace, COUNT(*) FROM vectors GROUP BY namespace").fetchall()
+        return {"namespaces": {ns: {"vector_count": n} for ns, n in rows},
+                "total_vector_count": sum(n for _, n in rows)}
+
+def matches(metadata, condition):
+    for field, expected in condition.items():
+        if field == '$and':
+            if not all(matches(metadata, c) for c in expected):
+                return False
+        elif field == '$or':
+            if not any(matches(metadata, c) for c in expected):
+                return False
+        else:
+            ops = expected if isinstance(expected, dict) else {'$eq': expected}
+            value = metadata.get(field)
+            for op, arg in ops.items():
+                ok = {'$eq': lambda: value == arg, '$ne': lambda: value != arg,
+                      '$in': lambda: value in arg, '$nin': lambda: value not in arg}[op]()
+                if not ok:
+                    return False
+    return True
@@ -0,0 +1,284 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Runs analyzer -> manager -> (cropper -> vision) -> worker end to end with no network:
+# S3, SQS, Textract and Lambda are the in-memory fakes, Bedrock is the hash embedder
+# and Pinecone a SQLite-backed LocalIndex. One event loop delivers S3 notifications,
+# async invokes, Textract completions and SQS batches to the real handlers, then
+# reports per-stage wall time, API calls, throughput and peak RSS.
+#
+#   cd LAMBDA && python -m local.run_pipeline docs/*.pdf data.csv notes.txt
+#   cd LAMBDA && python -m local.run_pipeline --processes 4 docs/*.pdf
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+UPLOAD_BUCKET = 'velocity-uploads'
+VAULT_BUCKET = 'velocity-vault'
+METADATA_BUCKET = 'velocity-metadata'
+IMAGE_BUCKET = 'velocity-images'
+CLAIM_CHECK_BUCKET = 'velocity-claims'
+WORKER_QUEUE_URL = 'https://sqs.local/000000000000/velocity-worker'
+WORKER_PRIORITY_QUEUE_URL = 'https://sqs.local/000000000000/velocity-worker-priority'
+MANAGER_LAMBDA = 'velocity-manager'
+CROPPER_LAMBDA = 'velocity-croper'
+
+SQS_BATCH_SIZE = 10
+MAX_RECEIVES = 3
+ASYNC_RETRIES = 2
+
+class Context:
+    def __init__(self, name):
+        self.function_name = name
+        self.aws_request_id = uuid.uuid4().hex
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+class LocalPipeline:
+    def __init__(self, workdir, bedrock_latency=0.0, bedrock_capacity=64, throttle_rate=0.0):
+        import velocity_aws
+        from local import fakes
+        from local.fake_bedrock import FakeBedrock
+
+        self.workdir = workdir
+        os.makedirs(workdir, exist_ok=True)
+        self.tasks = deque()
+        self.stages = {}
+        self.dead_letters = []
+
+        self.s3 = fakes.FakeS3()
+        self.s3.listeners.append(self.on_s3_event)
+        self.sqs = fakes.FakeSQS()
+        self.textract = fakes.FakeTextract(self.s3, on_complete=self.on_textract_complete,
+                                           schedule=lambda job_id: self.tasks.append(('textract', job_id)))
+        self.lambda_client = fakes.FakeLambda(self.on_invoke)
+        self.bedrock = FakeBedrock(capacity=bedrock_capacity, latency=bedrock_latency, throttle_rate=throttle_rate)
+        self.index = fakes.LocalIndex(os.path.join(workdir, 'index.db'))
+        self.services = {"s3": self.s3, "sqs": self.sqs, "textract": self.textract,
+                         "lambda": self.lambda_client, "bedrock-runtime": self.bedrock}
+        for name, service in self.services.items():
+            velocity_aws.override(name, service)
+        velocity_aws.override('pinecone', self.index)
+
+        os.environ.update({
+            "VAULT_BUCKET": VAULT_BUCKET, "METADATA_BUCKET": METADATA_BUCKET, "IMAGE_BUCKET": IMAGE_BUCKET,
+            "CLAIM_CHECK_BUCKET": CLAIM_CHECK_BUCKET, "WORKER_SQS_URL": WORKER_QUEUE_URL,
+            "MANAGER_LAMBDA_NAME": MANAGER_LAMBDA, "CROPPER_LAMBDA_NAME": CROPPER_LAMBDA,
+            "TEXTRACT_SNS_TOPIC": 'arn:aws:sns:local:000000000000:textract',
+            "TEXTRACT_ROLE_ARN": 'arn:aws:iam::000000000000:role/textract',
+        })
+        for name, kind in (("COMPLETION_LEDGER", 'ledger'), ("EMBED_CACHE", 'embed-cache'),
+                           ("VISION_CACHE", 'vision-cache'), ("CHUNK_MANIFEST", 'manifests'),
+                           ("ANSWER_CACHE", 'answer-cache')):
+            os.environ.setdefault(name, f"sqlite:{os.path.join(workdir, kind + '.db')}")
+        os.environ.setdefault("SEGMENT_DIR", os.path.join(workdir, 'lexical'))
+        # Set to '' for a single worker queue
+        os.environ.setdefault("WORKER_PRIORITY_SQS_URL", WORKER_PRIORITY_QUEUE_URL)
+
+        # Loaded on first event, like a Lambda container; env and overrides must come first
+        self.handlers = {}
+
+    def handler(self, stage):
+        if stage not in self.handlers:
+            self.handlers[stage] = load_handler(stage)
+        return self.handlers[stage]
+
+    def upload(self, path, user_id='local-user', subject_id='local-subject', file_id=None):
+        # Passing the file_id of an earlier upload re-ingests that file
+        file_id = file_id or f"{uuid.uuid4().hex[:12]}_{os.path.basename(path)}"
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.s3.put_object(Bucket=UPLOAD_BUCKET, Key=f"uploads/{user_id}/{subject_id}/{os.path.basename(path)}",
+                           Body=body, Metadata={"user_id": user_id, "subject_id": subject_id, "file_id": file_id})
+        return file_id, len(body)
+
+    def on_s3_event(self, event_name, bucket, key):
+        # Bucket notifications as configured in AWS: uploads by extension, crops to vision
+        ext = key.rsplit('.', 1)[-1].lower()
+        if bucket == UPLOAD_BUCKET:
+            stage = 'analyzer' if ext == 'pdf' else 'manager' if ext in ('csv', 'txt') else None
+        elif bucket == IMAGE_BUCKET and key.startswith('crops/'):
+            stage = 'vision'
+        else:
+            stage = None
+        if stage:
+            record = {"eventName": event_name, "s3": {"bucket": {"name": bucket}, "object": {"key": key}}}
+            self.tasks.append((stage, {"Records": [record]}))
+
+    def on_invoke(self, function_name, payload, invocation_type):
+        stage = {MANAGER_LAMBDA: 'manager', CROPPER_LAMBDA: 'croper'}[function_name]
+        if invocation_type == 'Event':
+            self.tasks.append((stage, payload))
+            return None
+        return self.invoke(stage, payload)
+
+    def on_textract_complete(self, message):
+        self.tasks.append(('manager', {"Records": [{"Sns": {"Message": json.dumps(message)}}]}))
+
+    def invoke(self, stage, event):
+        stats = self.stages.setdefault(stage, Counter())
+        started = time.perf_counter()
+        try:
+            return self.handler(stage).lambda_handler(event, Context(stage))
+        finally:
+            stats['invocations'] += 1
+            stats['seconds'] += time.perf_counter() - started
+
+    def invoke_async(self, stage, event):
+        # Lambda retries failed async invocations twice before giving up
+        for attempt in range(ASYNC_RETRIES + 1):
+            try:
+                return self.invoke(stage, event)
+            except Exception as e:
+                self.stages[stage]['errors'] += 1
+                print(f"Error: {stage} attempt {attempt + 1}: {e!r}")
+        self.dead_letters.append((stage, event))
+
+    def poll_worker(self):
+        # The priority lane drains first, like an event source with concurrency kept free for it
+        for url in (WORKER_PRIORITY_QUEUE_URL, WORKER_QUEUE_URL):
+            messages = self.sqs.receive(url, SQS_BATCH_SIZE)
+            if messages:
+                self.process_worker_batch(url, messages)
+                return True
+        return False
+
+    def process_worker_batch(self, url, messages):
+        records = [{"messageId": m['messageId'], "body": m['body'], "eventSource": 'aws:sqs',
+                    "attributes": {"ApproximateReceiveCount": str(m['receiveCount']),
+                                   "SentTimestamp": m['sentTimestamp']}} for m in messages]
+        try:
+            failed = {f['itemIdentifier'] for f in self.invoke('worker', {"Records": records})['batchItemFailures']}
+        except Exception as e:
+            print(f"Error: worker batch: {e!r}")
+            failed = {m['messageId'] for m in messages}
+        for message in messages:
+            if message['messageId'] not in failed:
+                continue
+            self.stages['worker']['redeliveries'] += 1
+            if message['receiveCount'] >= MAX_RECEIVES:
+                self.dead_letters.append(('worker', message))
+            else:
+                self.sqs.requeue(url, message)
+
+    def run(self):
+        # Async events first, so the queue fills the way concurrent producers would fill it
+        while True:
+            if self.tasks:
+                stage, payload = self.tasks.popleft()
+                if stage == 'textract':
+                    started = time.perf_counter()
+                    self.textract.run_job(payload)
+                    stats = self.stages.setdefault('textract', Counter())
+                    stats['jobs'] += 1
+                    stats['seconds'] += time.perf_counter() - started
+                else:
+                    self.invoke_async(stage, payload)
+            elif not self.poll_worker():
+                return
+
+    def report(self):
+        vault = self.s3.keys(VAULT_BUCKET, 'vault/')
+        vectors = self.index.describe_index_stats()['total_vector_count']
+        return {
+            "stages": {stage: {k: round(v, 4) if isinstance(v, float) else v for k, v in stats.items()}
+                       for stage, stats in self.stages.items()},
+            "services": {**{name: s.stats() for name, s in self.services.items() if name != 'bedrock-runtime'},
+                         "bedrock-runtime": {"calls": self.bedrock.calls, "throttles": self.bedrock.throttles},
+                         "pinecone": self.index.stats()},
+            "vault_files": len(vault), "vectors": vectors,
+            "leftover_temp_parts": len(self.s3.keys(VAULT_BUCKET, 'temp/')),
+            "dead_letters": len(self.dead_letters)
+        }
+
+def load_handler(stage):
+    # The Lambda files have hyphenated names, so they are loaded by path
+    path = os.path.join(LAMBDA_DIR, f"velocity-{stage}.py")
+    spec = importlib.util.spec_from_file_location(f"velocity_{stage}_handler", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def run_files(paths, workdir, bedrock_latency=0.0, throttle_rate=0.0, profile=None, trace_log=None):
+    pipeline = LocalPipeline(workdir, bedrock_latency=bedrock_latency, throttle_rate=throttle_rate)
+    started = time.perf_counter()
+    total_bytes = sum(pipeline.upload(path)[1] for path in paths)
+    # Handler logs (spans included) go to trace_log, for local.trace_report
+    with contextlib.ExitStack() as stack:
+        if trace_log:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(trace_log, 'a'))))
+        if profile:
+            import cProfile
+            cProfile.runctx('pipeline.run()', globals(), {"pipeline": pipeline}, profile)
+        else:
+            pipeline.run()
+    elapsed = time.perf_counter() - started
+    out = pipeline.report()
+    out.update({"files": len(paths), "input_bytes": total_bytes, "elapsed_s": round(elapsed, 3),
+                "peak_rss_mb": peak_rss_mb()})
+    return out
+
+def run_shard(args):
+    paths, workdir, bedrock_latency, throttle_rate = args
+    return run_files(paths, workdir, bedrock_latency, throttle_rate)
+
+def merge(reports):
+    # Process pool: counts add up, memory is reported per process
+    out = {"files": 0, "input_bytes": 0, "vault_files": 0, "vectors": 0, "leftover_temp_parts": 0,
+           "dead_letters": 0, "stages": {}, "peak_rss_mb": 0.0, "processes": len(reports)}
+    for report in reports:
+        for key in ("files", "input_bytes", "vault_files", "vectors", "leftover_temp_parts", "dead_letters"):
+            out[key] += report[key]
+        out['peak_rss_mb'] = max(out['peak_rss_mb'], report['peak_rss_mb'])
+        for stage, stats in report['stages'].items():
+            merged = out['stages'].setdefault(stage, Counter())
+            merged.update(stats)
+    out['stages'] = {stage: {k: round(v, 4) if isinstance(v, float) else v for k, v in stats.items()}
+                     for stage, stats in out['stages'].items()}
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ingestion Lambdas locally against in-memory AWS fakes")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--processes', type=int, default=1, help="shard files across worker processes")
+    parser.add_argument('--workdir', help="ledger, caches and index (default: a fresh temp dir)")
+    parser.add_argument('--bedrock-latency', type=float, default=0.0, help="seconds per fake Bedrock call")
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--profile', help="write cProfile stats of the event loop here (single process)")
+    parser.add_argument('--trace-log', help="append handler logs and spans here (single process)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, LAMBDA_DIR)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='velocity-local-')
+    started = time.perf_counter()
+    if args.processes <= 1:
+        report = run_files(args.files, workdir, args.bedrock_latency, args.throttle_rate, args.profile,
+                           args.trace_log)
+    else:
+        # Each process gets its own fakes and workdir, like separate Lambda containers
+        shards = [(args.files[i::args.processes], os.path.join(workdir, f"shard-{i}"),
+                   args.bedrock_latency, args.throttle_rate) for i in range(args.processes)]
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            report = merge(list(pool.map(run_shard, [s for s in shards if s[0]])))
+    elapsed = time.perf_counter() - started
+    report.update({"elapsed_s": round(elapsed, 3), "workdir": workdir,
+                   "vectors_per_s": round(report['vectors'] / elapsed, 1),
+                   "input_mb_per_s": round(report['input_bytes'] / 1024 ** 2 / elapsed, 3)})
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
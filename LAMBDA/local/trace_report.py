@@ -0,0 +1,109 @@
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+# Rebuilds where one document's ingest spent its time from velocity_trace span lines
+# (CloudWatch exports or a local --trace-log). The critical path starts at the span
+# that finished the document (vault assembly, else the last span to end) and walks
+# back through parent links; hops without a parent, like the Textract callback, link
+# to the latest span of the trace that ended before they started.
+#
+#   cd LAMBDA && python -m local.run_pipeline --trace-log /tmp/spans.log doc.pdf
+#   cd LAMBDA && python -m local.trace_report /tmp/spans.log [--file-id ID]
+
+def read_spans(lines):
+    for line in lines:
+        start = line.find('{"span"')
+        if start < 0:
+            continue
+        try:
+            yield json.loads(line[start:])['span']
+        except ValueError:
+            continue
+
+def critical_path(spans):
+    by_id = {s['span_id']: s for s in spans}
+    ends = sorted(spans, key=end_of)
+    finals = [s for s in spans if s['name'] == 'worker.assemble'] or ends
+    step = max(finals, key=end_of)
+    path = [step]
+    while True:
+        parent = by_id.get(step.get('parent_id'))
+        if parent is None:
+            before = [s for s in ends if end_of(s) <= step['start'] and s is not step and s not in path]
+            parent = before[-1] if before else None
+        if parent is None or parent in path:
+            break
+        path.append(parent)
+        step = parent
+    return list(reversed(path))
+
+def end_of(span):
+    return span['start'] + span['duration_ms'] / 1000
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+def report(spans):
+    origin = min(s['start'] for s in spans)
+    path = critical_path(spans)
+    steps, previous = [], None
+    for span in path:
+        steps.append({
+            "span": span['name'], "part_num": span.get('part_num'),
+            "at_ms": round((span['start'] - origin) * 1000, 1),
+            "duration_ms": span['duration_ms'],
+            # Time between the previous step ending and this one starting: queues, Textract, async invoke
+            "wait_ms": round((span['start'] - end_of(previous)) * 1000, 1) if previous else 0.0,
+            "queue_ms": span.get('queue_ms'), "error": span.get('error')
+        })
+        previous = span
+
+    stages = defaultdict(list)
+    for span in spans:
+        stages[span['name']].append(span['duration_ms'])
+    return {
+        "trace_id": spans[0]['trace_id'], "file_id": next((s['file_id'] for s in spans if s.get('file_id')), None),
+        "wall_ms": round((max(end_of(s) for s in spans) - origin) * 1000, 1),
+        "critical_path": steps,
+        "stages": {name: {"spans": len(d), "total_ms": round(sum(d), 1), "p50_ms": percentile(d, 50),
+                          "max_ms": max(d)} for name, d in stages.items()},
+        "errors": sum(1 for s in spans if s.get('error'))
+    }
+
+def external_calls(spans):
+    # Invocation spans carry the per-operation breakdown; summed per stage
+    out = defaultdict(lambda: defaultdict(lambda: {"calls": 0, "total_ms": 0.0, "bytes": 0}))
+    for span in spans:
+        for op, stats in (span.get('external') or {}).items():
+            entry = out[span['name']][op]
+            entry['calls'] += stats['calls']
+            entry['total_ms'] = round(entry['total_ms'] + stats['total_ms'], 3)
+            entry['bytes'] += stats['bytes']
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description="Critical path of document ingests from span logs")
+    parser.add_argument('logs', nargs='*', help="log files (default: stdin)")
+    parser.add_argument('--file-id')
+    parser.add_argument('--trace-id')
+    args = parser.parse_args()
+
+    lines = (line for path in args.logs for line in open(path)) if args.logs else sys.stdin
+    spans = list(read_spans(lines))
+    traces = defaultdict(list)
+    for span in spans:
+        if span.get('trace_id'):
+            traces[span['trace_id']].append(span)
+    if args.trace_id:
+        traces = {k: v for k, v in traces.items() if k == args.trace_id}
+    if args.file_id:
+        traces = {k: v for k, v in traces.items() if any(s.get('file_id') == args.file_id for s in v)}
+
+    documents = sorted((report(v) for v in traces.values()), key=lambda r: -r['wall_ms'])
+    print(json.dumps({"documents": documents, "external_calls": external_calls(spans)}, indent=2))
+
+if __name__ == '__main__':
+    main()
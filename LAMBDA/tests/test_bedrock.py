@@ -0,0 +1,65 @@
+import unittest
+
+import velocity_bedrock
+from local.fake_bedrock import FakeClientError
+
+# Which Bedrock errors the wrapper retries. Run from LAMBDA/:
+#
+#   python -m unittest discover -s tests -t .
+
+class ServerError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = {"Error": {"Code": 'Unknown'}, "ResponseMetadata": {"HTTPStatusCode": status}}
+
+class FlakyClient:
+    # Raises the queued errors in turn, then answers
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"body": None}
+
+def wrap(client, max_retries=6):
+    return velocity_bedrock.BedrockClient(client, limiter=velocity_bedrock.AIMDLimiter(initial=8),
+                                          max_retries=max_retries, base_delay=0.0)
+
+class RetryTest(unittest.TestCase):
+    def test_throttle_retries_and_backs_off(self):
+        bedrock = wrap(FlakyClient(FakeClientError('ThrottlingException')))
+        bedrock.invoke_model()
+        stats = bedrock.stats()
+        self.assertEqual((stats['calls'], stats['throttles'], stats['failures']), (2, 1, 0))
+        self.assertEqual(stats['concurrency_limit'], 4)
+
+    def test_transient_errors_retry_without_backing_off(self):
+        client = FlakyClient(FakeClientError('InternalServerException'), FakeClientError('ModelTimeoutException'),
+                             ServerError(503), ConnectionResetError(), TimeoutError())
+        bedrock = wrap(client)
+        bedrock.invoke_model()
+        stats = bedrock.stats()
+        self.assertEqual(client.calls, 6)
+        self.assertEqual((stats['transient_errors'], stats['throttles'], stats['failures']), (5, 0, 0))
+        self.assertEqual(stats['concurrency_limit'], 8)
+
+    def test_client_errors_are_final(self):
+        client = FlakyClient(FakeClientError('ValidationException'), ServerError(400))
+        bedrock = wrap(client)
+        with self.assertRaises(FakeClientError):
+            bedrock.invoke_model()
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(bedrock.stats()['failures'], 1)
+
+    def test_retries_run_out(self):
+        client = FlakyClient(*[FakeClientError('InternalServerException')] * 3)
+        bedrock = wrap(client, max_retries=2)
+        with self.assertRaises(FakeClientError):
+            bedrock.invoke_model()
+        self.assertEqual(client.calls, 3)
+
+if __name__ == '__main__':
+    unittest.main()
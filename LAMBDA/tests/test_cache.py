@@ -0,0 +1,61 @@
+import contextlib
+import io
+import unittest
+
+import velocity_cache
+
+# The persistent store behind Cache is best-effort. Run from LAMBDA/:
+#
+#   python -m unittest discover -s tests -t .
+
+class FailingStore:
+    def __init__(self):
+        self.values = {}
+        self.failing = True
+
+    def get(self, key):
+        if self.failing:
+            raise RuntimeError("SlowDown")
+        return self.values.get(key)
+
+    def put(self, key, value):
+        if self.failing:
+            raise RuntimeError("database is locked")
+        self.values[key] = value
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.store = FailingStore()
+        self.cache = velocity_cache.Cache(self.store, max_items=2)
+        self.log = io.StringIO()
+        stack = contextlib.ExitStack()
+        stack.enter_context(contextlib.redirect_stdout(self.log))
+        self.addCleanup(stack.close)
+
+    def test_failed_get_is_a_miss(self):
+        self.assertIsNone(self.cache.get('k'))
+        self.assertEqual(self.cache.stats(), {"hits": 0, "misses": 1, "errors": 1})
+        self.assertIn("Error: cache get k", self.log.getvalue())
+
+    def test_failed_put_keeps_the_value_in_memory(self):
+        self.cache.put('k', b'v')
+        self.assertEqual(self.cache.get('k'), b'v')
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 0, "errors": 1})
+
+    def test_store_serves_after_recovery(self):
+        self.store.failing = False
+        self.cache.put('k', b'v')
+        fresh = velocity_cache.Cache(self.store)
+        self.assertEqual(fresh.get('k'), b'v')
+        self.assertEqual(fresh.stats(reset=True), {"hits": 1, "misses": 0, "errors": 0})
+        self.assertEqual(fresh.stats(), {"hits": 0, "misses": 0, "errors": 0})
+
+    def test_lru_only(self):
+        cache = velocity_cache.Cache(max_items=1)
+        cache.put('a', b'1')
+        cache.put('b', b'2')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), b'2')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import base64
+import json
+import unittest
+
+import velocity_codec
+import velocity_sqs
+from local.fakes import FakeS3
+
+# Round trips of the chunk message format. Run from LAMBDA/:
+#
+#   python -m unittest discover -s tests -t .
+
+BUCKET = 'velocity-claims'
+META = {"user_id": 'u1', "subject_id": 's1', "file_id": 'abc_notes.txt', "source_file": 'uploads/u1/s1/notes.txt'}
+LONG_TEXT = "Chunk text that repeats so zlib shrinks it. " * 40
+
+def body(**fields):
+    out = {"type": 'text', "content": LONG_TEXT, "part_num": 3, "total_parts": None,
+           "metadata": dict(META), "chunk_hash": '0123456789abcdef', "embed": True, "revision": 2}
+    out.update(fields)
+    return out
+
+class CodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = velocity_codec.CHUNK_CODEC
+        velocity_codec.CHUNK_CODEC = 'binary'
+        self.s3 = FakeS3()
+        self.encoder = velocity_codec.Encoder(self.s3, BUCKET)
+
+    def tearDown(self):
+        velocity_codec.CHUNK_CODEC = self.codec
+
+    def decode(self, text):
+        # A fresh decoder, as on another worker: the header comes from S3
+        return velocity_codec.Decoder(self.s3, BUCKET).decode(text)
+
+    def assertRoundTrip(self, sent):
+        text = self.encoder.encode(sent)
+        received = self.decode(text)
+        received.pop('compressed', None)
+        expected = {k: v for k, v in sent.items() if not (k == 'embed' and v)}
+        if not expected.get('revision'):
+            expected.pop('revision', None)
+        self.assertEqual(received, expected)
+        return text
+
+    def flags(self, text):
+        return base64.b64decode(text)[1]
+
+    def test_compressed_hashed(self):
+        text = self.assertRoundTrip(body())
+        self.assertEqual(self.flags(text), velocity_codec.COMPRESSED | velocity_codec.HASHED)
+
+    def test_short_content_stays_uncompressed(self):
+        text = self.assertRoundTrip(body(content="x"))
+        self.assertFalse(self.flags(text) & velocity_codec.COMPRESSED)
+
+    def test_compressed_bytes_are_kept(self):
+        received = self.decode(self.encoder.encode(body()))
+        self.assertIn('compressed', received)
+
+    def test_no_embed(self):
+        text = self.assertRoundTrip(body(embed=False))
+        self.assertTrue(self.flags(text) & velocity_codec.NO_EMBED)
+
+    def test_unhashed_without_parts_or_revision(self):
+        sent = body(part_num=None, chunk_hash=None, revision=None)
+        del sent['chunk_hash']
+        text = self.assertRoundTrip(sent)
+        self.assertFalse(self.flags(text) & velocity_codec.HASHED)
+
+    def test_odd_length_hash_goes_to_extra(self):
+        text = self.assertRoundTrip(body(chunk_hash='abc123'))
+        self.assertEqual(self.flags(text) & (velocity_codec.HASHED | velocity_codec.EXTRA), velocity_codec.EXTRA)
+
+    def test_extra_fields_and_per_message_metadata(self):
+        sent = body(type='image_description', part_num=None, image_url='s3://images/crops/f/1.jpg',
+                    metadata={**META, "parent_span": 'span-1'})
+        del sent['chunk_hash']
+        text = self.assertRoundTrip(sent)
+        self.assertTrue(self.flags(text) & velocity_codec.EXTRA)
+
+    def test_every_flag_together(self):
+        sent = body(embed=False, chunk_hash='abc', image_url='s3://x/y', metadata={**META, "parent_span": 's'})
+        self.assertRoundTrip(sent)
+
+    def test_unicode_content(self):
+        self.assertRoundTrip(body(content="Größe ≤ 5 µm — 東京 " * 20))
+
+    def test_header_written_once_outside_claim_checks(self):
+        for part in range(1, 4):
+            self.encoder.encode(body(part_num=part))
+        keys = self.s3.keys(BUCKET)
+        self.assertEqual(len(keys), 1)
+        self.assertTrue(keys[0].startswith(velocity_codec.HEADER_PREFIX + '/'))
+        self.assertFalse(keys[0].startswith('claim-check/'))
+
+    def test_claim_checked_content(self):
+        sender = velocity_sqs.BatchSender(None, 'queue', self.s3, BUCKET)
+        sent = sender._claim_check(body())
+        received = self.decode(self.encoder.encode(sent))
+        self.assertIsNone(received['content'])
+        self.assertEqual(received['content_ref'], sent['content_ref'])
+        self.assertEqual(velocity_sqs.load_content(self.s3, received), LONG_TEXT)
+
+    def test_control_messages_stay_json(self):
+        sent = {"type": 'delete', "chunk_hashes": ['0123456789abcdef'], "metadata": META}
+        text = self.encoder.encode(sent)
+        self.assertEqual(json.loads(text), sent)
+        self.assertEqual(self.decode(text), sent)
+
+    def test_json_codec(self):
+        velocity_codec.CHUNK_CODEC = 'json'
+        sent = body()
+        text = self.encoder.encode(sent)
+        self.assertEqual(json.loads(text), sent)
+        self.assertEqual(self.decode(text), sent)
+        self.assertEqual(self.s3.keys(BUCKET), [])
+
+    def test_unknown_version(self):
+        raw = bytearray(base64.b64decode(self.encoder.encode(body())))
+        raw[0] = velocity_codec.VERSION + 1
+        with self.assertRaises(ValueError):
+            self.decode(base64.b64encode(bytes(raw)).decode('ascii'))
+
+if __name__ == '__main__':
+    unittest.main()
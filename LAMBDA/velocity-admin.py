@@ -0,0 +1,105 @@
+import json
+import os
+import velocity_aws
+import velocity_cache
+import velocity_keys
+import velocity_trace
+import velocity_vectors
+
+s3 = velocity_aws.client('s3')
+index = velocity_aws.pinecone_index()
+
+VAULT_BUCKET = os.environ['VAULT_BUCKET']
+METADATA_BUCKET = os.environ['METADATA_BUCKET']
+
+# Same stores the manager and worker use
+CHUNK_MANIFEST = os.environ.get('CHUNK_MANIFEST', 's3')
+ANSWER_CACHE = os.environ.get('ANSWER_CACHE', 's3')
+
+def build_answer_cache():
+    store = velocity_cache.open_store('answers', ANSWER_CACHE, s3, METADATA_BUCKET)
+    return velocity_cache.SemanticCache(store) if store else None
+
+manifests = velocity_cache.open_store('manifests', CHUNK_MANIFEST, s3, METADATA_BUCKET)
+answer_cache = build_answer_cache()
+
+@velocity_trace.handler('admin')
+def lambda_handler(event, context):
+    # {"action": "delete_file" | "delete_subject" | "reindex", "user_id", "subject_id",
+    #  "file_id" (delete_file, optional for reindex), "from_namespaces" (reindex, default 'off')}
+    action = event['action']
+    meta = {"user_id": event['user_id'], "subject_id": event['subject_id']}
+    if event.get('file_id'):
+        meta['file_id'] = event['file_id']
+    velocity_trace.current().bind(meta).set(action=action)
+
+    if action == 'delete_file':
+        result = delete_file(meta)
+    elif action == 'delete_subject':
+        result = delete_subject(meta)
+    elif action == 'reindex':
+        result = reindex(meta, event.get('from_namespaces', 'off'))
+    else:
+        raise ValueError(f"unknown action {action!r}")
+
+    if action != 'reindex' and answer_cache:
+        # Cached answers may quote the deleted documents
+        answer_cache.invalidate(f"{meta['user_id']}/{meta['subject_id']}")
+    print(json.dumps({"admin": {"action": action, **meta, **result}}))
+    return {"status": "success", **result}
+
+def delete_file(meta):
+    vectors = velocity_vectors.delete_file(index, meta)
+    keys = [velocity_keys.derived_key(kind, meta) for kind in velocity_keys.DERIVED]
+    delete_keys(keys)
+    reset_manifest(meta['file_id'])
+    return {"vectors": vectors, "objects": len(keys)}
+
+def delete_subject(meta):
+    # One namespace delete; the vault listing names the files whose manifests go too
+    velocity_vectors.delete_subject(index, meta)
+    file_ids = subject_files(meta)
+    keys = [key for kind in velocity_keys.DERIVED for key in list_keys(velocity_keys.subject_prefix(kind, meta))]
+    delete_keys(keys)
+    for file_id in file_ids:
+        reset_manifest(file_id)
+    return {"files": len(file_ids), "objects": len(keys)}
+
+def reindex(meta, from_namespaces):
+    # Moves a file's or subject's vectors from another namespace layout into the current one
+    source = velocity_vectors.namespace(meta, from_namespaces)
+    target = velocity_vectors.namespace(meta)
+    if source == target:
+        return {"vectors": 0, "files": 0}
+    file_ids = [meta['file_id']] if 'file_id' in meta else subject_files(meta)
+    moved = sum(velocity_vectors.move_file(index, {**meta, "file_id": file_id}, source, target)
+                for file_id in file_ids)
+    return {"vectors": moved, "files": len(file_ids)}
+
+def subject_files(meta):
+    return [velocity_keys.file_id('vault', meta, key) for key in list_keys(velocity_keys.subject_prefix('vault', meta))]
+
+def list_keys(prefix):
+    keys = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=VAULT_BUCKET, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return keys
+
+def delete_keys(keys):
+    # 1000 keys per request
+    for i in range(0, len(keys), 1000):
+        res = s3.delete_objects(Bucket=VAULT_BUCKET, Delete={
+            "Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": True
+        })
+        for err in res.get('Errors', []):
+            print(f"Error: delete {err['Key']}: {err.get('Message')}")
+
+def reset_manifest(file_id):
+    # Keeps the revision: a later upload of the same file_id must not reuse an old
+    # revision's ledger entry, and with no known chunks it embeds everything again
+    if manifests is None:
+        return
+    raw = manifests.get(file_id)
+    if raw:
+        revision = json.loads(raw)['revision']
+        manifests.put(file_id, json.dumps({"revision": revision, "chunks": []}).encode('utf-8'))
@@ -1,27 +1,50 @@
-import boto3, os, fitz, json
+import os, json
+import velocity_aws
+import velocity_pdfinfo
+import velocity_trace
 
-textract = boto3.client('textract')
-s3 = boto3.client('s3')
+textract = velocity_aws.client('textract')
+s3 = velocity_aws.client('s3')
 
 # Environment variables for SNS and Role
 SNS_TOPIC_ARN = os.environ['TEXTRACT_SNS_TOPIC']
 ROLE_ARN = os.environ['TEXTRACT_ROLE_ARN']
 MANAGER_LAMBDA = os.environ['MANAGER_LAMBDA_NAME']
+# Hands PDFs to the manager's local extraction, which keeps Textract for scanned pages
+PDF_FAST_PATH = os.environ.get('PDF_FAST_PATH', 'on') == 'on'
 
+@velocity_trace.handler('analyzer')
 def lambda_handler(event, context):
-    bucket = event['Records'][0]['s3']['bucket']['name']
-    key = event['Records'][0]['s3']['object']['key']
+    record = event['Records'][0]
+    bucket = record['s3']['bucket']['name']
+    key = record['s3']['object']['key']
     
     # 1. Fetch Passport Metadata (user_id, subject_id, file_id)
     head = s3.head_object(Bucket=bucket, Key=key)
     meta = head['Metadata'] 
 
-    # 2. Check page count
-    local_path = f"/tmp/{os.path.basename(key)}"
-    s3.download_file(bucket, key, local_path)
-    doc = fitz.open(local_path)
-    page_count = len(doc)
-    doc.close()
+    # Our own metadata rewrite below fires ObjectCreated:Copy, nothing to do for it
+    if record.get('eventName') == 'ObjectCreated:Copy' and 'page_count' in meta:
+        return {"status": "skipped"}
+    # Minted here for new uploads; store_page_count persists it for the Textract callback
+    span = velocity_trace.current().bind(meta)
+
+    # 2. Check page count (ranged GETs, no download), counted once per object
+    if 'page_count' in meta:
+        page_count = int(meta['page_count'])
+    else:
+        page_count = count_pages(bucket, key, head)
+        store_page_count(bucket, key, head, page_count)
+    span.set(page_count=page_count, bytes=head['ContentLength'])
+
+    if PDF_FAST_PATH:
+        velocity_aws.client('lambda').invoke(
+            FunctionName=MANAGER_LAMBDA,
+            InvocationType='Event',
+            Payload=json.dumps({"pdf_fast_path": True, "bucket": bucket, "key": key,
+                                "page_count": page_count, "metadata": span.carry(meta)})
+        )
+        return {"status": "success", "mode": "fast"}
 
     if page_count == 1:
         # Sync Path: Call Textract and pass result directly to Manager
@@ -29,10 +52,10 @@ def lambda_handler(event, context):
             Document={'S3Object': {'Bucket': bucket, 'Name': key}},
             FeatureTypes=["LAYOUT"]
         )
-        boto3.client('lambda').invoke(
+        velocity_aws.client('lambda').invoke(
             FunctionName=MANAGER_LAMBDA,
             InvocationType='Event',
-            Payload=json.dumps({"sync_result": response, "bucket": bucket, "key": key, "metadata": meta})
+            Payload=json.dumps({"sync_result": response, "bucket": bucket, "key": key, "metadata": span.carry(meta)})
         )
     else:
         # Async Path: Textract will notify SNS when finished
@@ -42,4 +65,27 @@ def lambda_handler(event, context):
             NotificationChannel={'SNSTopicArn': SNS_TOPIC_ARN, 'RoleArn': ROLE_ARN}
         )
     
-    return {"status": "success", "mode": "async" if page_count > 1 else "sync"}
\ No newline at end of file
+    return {"status": "success", "mode": "async" if page_count > 1 else "sync"}
+
+def count_pages(bucket, key, head):
+    reader = velocity_pdfinfo.S3RangeReader(s3, bucket, key, head['ContentLength'])
+    try:
+        return velocity_pdfinfo.count_pages(reader)
+    except velocity_pdfinfo.PDFInfoError as e:
+        # Fallback: open from a streamed body in memory, never /tmp
+        print(f"Range count failed for {key} after {reader.requests} reads: {e}")
+        import fitz
+        doc = fitz.open(stream=s3.get_object(Bucket=bucket, Key=key)['Body'].read(), filetype="pdf")
+        page_count = len(doc)
+        doc.close()
+        return page_count
+
+def store_page_count(bucket, key, head, page_count):
+    # Later stages read page_count from the object metadata instead of counting again
+    if head['ContentLength'] > 5 * 1024 ** 3:
+        return  # copy_object limit; such files are simply recounted
+    s3.copy_object(
+        Bucket=bucket, Key=key, CopySource={'Bucket': bucket, 'Key': key},
+        Metadata={**head['Metadata'], "page_count": str(page_count)},
+        MetadataDirective='REPLACE', ContentType=head.get('ContentType', 'application/pdf')
+    )
@@ -1,30 +1,56 @@
-import boto3, fitz, os
+import fitz, os
+from concurrent.futures import ThreadPoolExecutor
+import velocity_aws
+import velocity_trace
 
-s3 = boto3.client('s3')
+s3 = velocity_aws.client('s3')
 IMAGE_BUCKET = os.environ['IMAGE_BUCKET']
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', '16'))
 
+@velocity_trace.handler('croper')
 def lambda_handler(event, context):
-    # 1. Download PDF
-    local_pdf = f"/tmp/input.pdf"
+    # Batch of figures for one document; single-figure events still accepted
+    figures = event.get('figures') or [{"page": event['page'], "bbox": event['bbox'], "id": event['id']}]
+    span = velocity_trace.current().bind(event['metadata']).set(figures=len(figures))
+    metadata = span.carry(event['metadata'])
+    if event.get('revision'):
+        # Object metadata is all strings; vision hands it back to the worker as a number
+        metadata['revision'] = str(event['revision'])
+
+    # 1. Download PDF (once per batch)
+    local_pdf = f"/tmp/input-{os.getpid()}.pdf"
     s3.download_file(event['bucket'], event['key'], local_pdf)
-    
-    # 2. Crop logic
+
+    # 2. Crop logic, page by page; uploads run while the next clips render
     doc = fitz.open(local_pdf)
-    page = doc[event['page'] - 1]
-    bbox = event['bbox']
-    rect = page.rect
-    
-    crop_rect = fitz.Rect(
-        bbox['Left'] * rect.width, bbox['Top'] * rect.height,
-        (bbox['Left'] + bbox['Width']) * rect.width, (bbox['Top'] + bbox['Height']) * rect.height
-    )
-    
-    pix = page.get_pixmap(clip=crop_rect)
-    img_key = f"crops/{event['id']}_{os.path.basename(event['key'])}.jpg"
-    
+    by_page = {}
+    for fig in figures:
+        by_page.setdefault(fig['page'], []).append(fig)
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        uploads = []
+        for page_num in sorted(by_page):
+            page = doc[page_num - 1]
+            rect = page.rect
+            for fig in by_page[page_num]:
+                bbox = fig['bbox']
+                crop_rect = fitz.Rect(
+                    bbox['Left'] * rect.width, bbox['Top'] * rect.height,
+                    (bbox['Left'] + bbox['Width']) * rect.width, (bbox['Top'] + bbox['Height']) * rect.height
+                )
+                pix = page.get_pixmap(clip=crop_rect)
+                # Figure ids are only unique within a file (p1-22 on the fast path)
+                img_key = f"crops/{metadata['file_id']}/{fig['id']}.jpg"
+                uploads.append(pool.submit(upload_crop, img_key, pix.tobytes("jpg"), metadata))
+        for upload in uploads:
+            upload.result()
+    doc.close()
+    os.remove(local_pdf)
+    return {"status": "success", "crops": len(uploads)}
+
+def upload_crop(img_key, body, metadata):
     # 3. Save Image (This triggers Vision Lambda automatically)
     s3.put_object(
-        Bucket=IMAGE_BUCKET, Key=img_key, Body=pix.tobytes("jpg"),
-        Metadata=event['metadata'] # Carry user_id, subject_id, etc.
+        Bucket=IMAGE_BUCKET, Key=img_key, Body=body,
+        Metadata=metadata # Carry user_id, subject_id, etc.
     )
-    doc.close()
\ No newline at end of file
@@ -1,23 +1,68 @@
-import boto3
 import json
 import os
 import csv
+import heapq
 import io
+import time
+import uuid
+import velocity_aws
+import velocity_cache
+import velocity_chunker
+import velocity_pdftext
+import velocity_scheduler
+import velocity_trace
+import velocity_vectors
 
-s3 = boto3.client('s3')
-sqs = boto3.client('sqs')
-textract = boto3.client('textract')
-lambda_client = boto3.client('lambda')
+s3 = velocity_aws.client('s3')
+sqs = velocity_aws.client('sqs')
+textract = velocity_aws.client('textract')
+lambda_client = velocity_aws.client('lambda')
+# Connects on first use: only re-uploads read it, to confirm which vectors exist
+index = velocity_aws.pinecone_index()
 
 CROPPER_LAMBDA = os.environ['CROPPER_LAMBDA_NAME']
 WORKER_QUEUE_URL = os.environ['WORKER_SQS_URL']
 SNS_TOPIC_ARN = os.environ['TEXTRACT_SNS_TOPIC']
 ROLE_ARN = os.environ['TEXTRACT_ROLE_ARN']
+CLAIM_CHECK_BUCKET = os.environ['CLAIM_CHECK_BUCKET']
+# Figures per cropper invocation, keeps the async payload well under 256 KB
+CROP_BATCH_SIZE = int(os.environ.get('CROP_BATCH_SIZE', '500'))
 
+# Born-digital PDFs are read locally; only their scanned pages go to Textract
+PDF_FAST_PATH = os.environ.get('PDF_FAST_PATH', 'on') == 'on'
+# Extraction processes; Lambda gives one vCPU per 1769 MB of memory
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', '0')) or os.cpu_count() or 1
+# Scanned pages and the digital pages' blocks wait here for Textract
+PARTIAL_PREFIX = 'textract-partial'
+
+# Optional; small files' parts go here ahead of bulk work, see velocity_scheduler
+WORKER_PRIORITY_QUEUE_URL = os.environ.get('WORKER_PRIORITY_SQS_URL')
+
+worker_queue = velocity_scheduler.Scheduler(sqs, WORKER_QUEUE_URL, s3, CLAIM_CHECK_BUCKET, WORKER_PRIORITY_QUEUE_URL)
+
+# 's3' keeps chunk manifests under METADATA_BUCKET, 'sqlite:<path>' for local runs,
+# 'off' re-embeds every chunk on every upload
+CHUNK_MANIFEST = os.environ.get('CHUNK_MANIFEST', 's3')
+# Pinecone deletes at most 1000 ids per request
+DELETE_BATCH_SIZE = 1000
+
+manifests = velocity_cache.open_store('manifests', CHUNK_MANIFEST, s3, os.environ.get('METADATA_BUCKET'))
+
+@velocity_trace.handler('manager')
 def lambda_handler(event, context):
     # 1. Handle Textract Callback
     if 'Records' in event and 'Sns' in event['Records'][0]:
         return handle_textract_callback(event)
+
+    # 1b. Handle single-page Sync Result from the Analyzer
+    if 'sync_result' in event:
+        return handle_sync_result(event)
+
+    # 1c. Handle a PDF routed to the local extraction by the Analyzer
+    if 'pdf_fast_path' in event:
+        meta = event['metadata']
+        velocity_trace.current().bind(meta).set(source='pdf_fast_path')
+        return handle_pdf_fast_path(event['bucket'], event['key'], meta, event.get('page_count'))
     
     # 2. Handle Direct S3 Uploads
     bucket = event['Records'][0]['s3']['bucket']['name']
@@ -25,7 +70,15 @@ def lambda_handler(event, context):
     ext = key.split('.')[-1].lower()
     meta = s3.head_object(Bucket=bucket, Key=key)['Metadata']
 
-    if ext == 'pdf':
+    # The analyzer's page_count metadata rewrite is not a new upload
+    if event['Records'][0].get('eventName') == 'ObjectCreated:Copy' and 'page_count' in meta:
+        return {"status": "skipped"}
+    velocity_trace.current().bind(meta).set(source=ext)
+
+    if ext == 'pdf' and PDF_FAST_PATH:
+        return handle_pdf_fast_path(bucket, key, meta, meta.get('page_count'))
+
+    elif ext == 'pdf':
         textract.start_document_analysis(
             DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}},
             FeatureTypes=["LAYOUT"],
@@ -33,56 +86,325 @@ def lambda_handler(event, context):
         )
 
     elif ext == 'csv':
+        # Stream: rows are parsed and sent as chunks fill, memory stays flat
         obj = s3.get_object(Bucket=bucket, Key=key)
-        content = obj['Body'].read().decode('utf-8')
-        reader = list(csv.DictReader(io.StringIO(content)))
-        
-        chunk_size = 20
-        chunks = [reader[i:i + chunk_size] for i in range(0, len(reader), chunk_size)]
-        total_parts = len(chunks)
-        
-        for idx, chunk in enumerate(chunks):
-            row_texts = [" | ".join([f"{col}: {val}" for col, val in r.items() if val]) for r in chunk]
-            send_to_worker(row_texts, meta, key, "csv", idx + 1, total_parts)
-            
+        worker_queue.route(meta['file_id'], size=obj['ContentLength'])
+        rows = (velocity_chunker.csv_row_text(r) for r in csv.DictReader(open_text(obj['Body'])))
+
+        # Row groups sized by tokens, no overlap so rows are never embedded twice
+        chunks = velocity_chunker.pack(rows, overlap_tokens=0, joiner="\n")
+        send_chunks(chunks, meta, key, "csv")
+
     elif ext == 'txt':
         obj = s3.get_object(Bucket=bucket, Key=key)
-        text = obj['Body'].read().decode('utf-8')
-        send_to_worker([text], meta, key, "text", 1, 1)
+        worker_queue.route(meta['file_id'], size=obj['ContentLength'])
+        paragraphs = velocity_chunker.stream_paragraphs(open_text(obj['Body']))
+        send_chunks(velocity_chunker.pack(paragraphs), meta, key, "text")
 
     return {"status": "success"}
 
-def send_to_worker(content_list, meta, source_key, data_type, part_num, total_parts):
-    combined_content = "\n".join(content_list)
-    sqs.send_message(
-        QueueUrl=WORKER_QUEUE_URL,
-        MessageBody=json.dumps({
-            "type": data_type,
-            "content": combined_content,
-            "part_num": part_num,
-            "total_parts": total_parts,
-            "metadata": {**meta, "source_file": source_key}
-        })
-    )
+class S3RawStream(io.RawIOBase):
+    # Lets io.TextIOWrapper decode an S3 StreamingBody incrementally
+    def __init__(self, body):
+        self.body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.body.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+def open_text(body):
+    # newline='' keeps quoted CSV newlines intact
+    return io.TextIOWrapper(io.BufferedReader(S3RawStream(body), 1024 * 1024), encoding='utf-8', newline='')
+
+def send_chunks(chunks, meta, source_key, data_type, manifest=None, part_num=0):
+    # Sends as chunks are produced; only the last message knows total_parts. A file
+    # sent in two goes passes the first go's manifest and part count on.
+    manifest = manifest or Manifest(meta)
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            send_to_worker(pending, meta, source_key, data_type, part_num, None, manifest)
+        part_num, pending = part_num + 1, chunk
+    if pending is not None:
+        send_to_worker(pending, meta, source_key, data_type, part_num, part_num, manifest)
+
+    # Chunks that left the file take their vectors with them
+    removed = manifest.removed()
+    for i in range(0, len(removed), DELETE_BATCH_SIZE):
+        worker_queue.send({"type": "delete", "chunk_hashes": removed[i:i + DELETE_BATCH_SIZE],
+                           "metadata": velocity_trace.current().carry(meta)})
+    worker_queue.flush()
+    manifest.save()
+    velocity_trace.current().set(parts=part_num, unchanged=manifest.unchanged, removed=len(removed),
+                                 lane=worker_queue.lane(meta['file_id']))
+    return part_num
+
+def send_leading_chunks(chunks, meta, source_key, data_type, manifest):
+    # The first go of a file sent in two: every chunk but the last, which is held back
+    # so that the second go always has a part to carry total_parts
+    part_num, pending = 0, None
+    for chunk in chunks:
+        if pending is not None:
+            send_to_worker(pending, meta, source_key, data_type, part_num, None, manifest)
+        part_num, pending = part_num + 1, chunk
+    worker_queue.flush()
+    if pending is None:
+        return 0, None
+    return part_num - 1, pending
+
+def send_to_worker(chunk, meta, source_key, data_type, part_num, total_parts, manifest=None):
+    # Buffered; goes out in send_message_batch calls of up to 10
+    body = {
+        "type": data_type,
+        "content": str(chunk),
+        "part_num": part_num,
+        "total_parts": total_parts,
+        "metadata": {**velocity_trace.current().carry(meta), "source_file": source_key}
+    }
+    if getattr(chunk, 'overlap', 0):
+        # Embedded whole, assembled without the text the previous part already holds
+        body['overlap'] = chunk.overlap
+    if manifest:
+        body['revision'] = manifest.revision
+    if manifest and manifest.enabled:
+        # Unchanged chunks are only persisted for vault assembly, never re-embedded
+        chunk_hash, fresh = manifest.add(body['content'])
+        body.update(chunk_hash=chunk_hash, embed=fresh)
+    worker_queue.send(body)
+
+class Manifest:
+    # Content hashes of one file's chunks in part order, kept between uploads of the
+    # same file_id. Vector ids follow the hash, so moved chunks keep their vectors.
+    # Chunks are packed greedily, so an inserted or deleted paragraph shifts every
+    # later boundary in its section and those chunks embed again.
+    def __init__(self, meta, state=None):
+        self.file_id = meta['file_id']
+        self.enabled = manifests is not None
+        if state is not None:
+            # Continues a revision whose first parts another invocation sent
+            self.known, self.stale = set(state['known']), set(state['stale'])
+            self.revision, self.chunks, self.unchanged = state['revision'], state['chunks'], state['unchanged']
+            return
+        raw = manifests.get(self.file_id) if self.enabled else None
+        previous = json.loads(raw) if raw else {"revision": 0, "chunks": []}
+        # The manifest records what was sent, not what was upserted: only hashes whose
+        # vectors exist count as known, so a dead-lettered embed or upsert runs again
+        stored = stored_hashes(meta) if previous['chunks'] else set()
+        self.known = set(previous['chunks']) & stored
+        # Vectors of chunks no longer in the file, whether or not the manifest listed them
+        self.stale = set(previous['chunks']) | stored
+        # Each upload assembles under its own revision, apart from the last one's parts
+        self.revision = previous['revision'] + 1 if self.enabled else upload_revision()
+        self.chunks = []
+        self.unchanged = 0
+
+    def add(self, content):
+        chunk_hash = velocity_cache.content_key(content)[:16]
+        self.chunks.append(chunk_hash)
+        fresh = chunk_hash not in self.known
+        self.unchanged += not fresh
+        return chunk_hash, fresh
+
+    def removed(self):
+        return sorted(self.stale - set(self.chunks))
+
+    def state(self):
+        return {"known": sorted(self.known), "stale": sorted(self.stale), "revision": self.revision,
+                "chunks": self.chunks, "unchanged": self.unchanged}
+
+    def save(self):
+        if self.enabled:
+            manifests.put(self.file_id, json.dumps({"revision": self.revision, "chunks": self.chunks}).encode('utf-8'))
+
+def upload_revision():
+    # Without manifests nothing counts uploads, so the upload time stands in. In u32
+    # milliseconds it repeats only every 49 days, long after the ledger forgets an ingest.
+    return int(time.time() * 1000) % 0xFFFFFFFF + 1
+
+def stored_hashes(meta):
+    # Chunk hashes of the file's vectors in its namespace; figure vectors are left out
+    prefix = velocity_vectors.file_prefix(meta['file_id'])
+    ids = velocity_vectors.list_ids(index, prefix, velocity_vectors.namespace(meta))
+    return {vector_id[len(prefix):] for vector_id in ids if not vector_id.startswith(prefix + 'fig#')}
 
 def handle_textract_callback(event):
     msg = json.loads(event['Records'][0]['Sns']['Message'])
     job_id, bucket, key = msg['JobId'], msg['DocumentLocation']['S3Bucket'], msg['DocumentLocation']['S3ObjectName']
+    partial = bucket == CLAIM_CHECK_BUCKET and key.startswith(PARTIAL_PREFIX + '/')
+    if msg.get('Status', 'SUCCEEDED') != 'SUCCEEDED':
+        print(f"Error: Textract job {job_id} for {key} ended {msg['Status']}")
+        if partial:
+            # Parts already went out for this revision: finish the file without the
+            # scanned pages rather than leave it unassembled
+            finish_partial(key, [])
+        return {"status": "failed"}
+    if partial:
+        return finish_partial(key, textract_blocks(job_id))
     meta = s3.head_object(Bucket=bucket, Key=key)['Metadata']
-    response = textract.get_document_analysis(JobId=job_id)
-    
-    # Aggregate LINEs by Page
-    pages = {}
-    for block in response['Blocks']:
+    velocity_trace.current().bind(meta).set(source='textract')
+    worker_queue.route(meta['file_id'], pages=meta.get('page_count'))
+
+    # Chunks are sent while later result pages are still being fetched
+    manifest = Manifest(meta)
+    send_chunks(chunk_blocks(textract_blocks(job_id), bucket, key, meta, manifest.revision), meta, key, "pdf", manifest)
+    return {"status": "success"}
+
+def textract_blocks(job_id):
+    # Follows NextToken to the end of the result set
+    next_token = None
+    while True:
+        kwargs = {"JobId": job_id, "MaxResults": 1000}
+        if next_token:
+            kwargs["NextToken"] = next_token
+        response = textract.get_document_analysis(**kwargs)
+        yield from response['Blocks']
+        next_token = response.get('NextToken')
+        if not next_token:
+            return
+
+def handle_sync_result(event):
+    bucket, key, meta = event['bucket'], event['key'], event['metadata']
+    velocity_trace.current().bind(meta).set(source='textract_sync')
+    worker_queue.route(meta['file_id'], pages=1)
+    manifest = Manifest(meta)
+    send_chunks(chunk_blocks(event['sync_result']['Blocks'], bucket, key, meta, manifest.revision),
+                meta, key, "pdf", manifest)
+    return {"status": "success"}
+
+def handle_pdf_fast_path(bucket, key, meta, page_count=None):
+    # Pages with a text layer become Textract-shaped blocks in page-parallel processes.
+    # Digital pages are chunked and sent as they arrive, up to the first scanned page;
+    # only the pages from there on wait for Textract.
+    path = f"/tmp/fast-{os.getpid()}-{uuid.uuid4().hex}.pdf"
+    s3.download_file(bucket, key, path)
+    try:
+        if page_count is None:
+            import fitz
+            with fitz.open(path) as doc:
+                page_count = len(doc)
+        page_count = int(page_count)
+        worker_queue.route(meta['file_id'], pages=page_count)
+        pages = velocity_pdftext.extract_parallel(path, page_count, PDF_WORKERS)
+        held = []
+
+        def leading_blocks():
+            for page in pages:
+                if not page['digital']:
+                    held.append(page)
+                    return
+                yield from page['blocks']
+
+        manifest = Manifest(meta)
+        sent, pending = send_leading_chunks(chunk_blocks(leading_blocks(), bucket, key, meta, manifest.revision),
+                                            meta, key, "pdf", manifest)
+        held.extend(pages)
+        scanned = [p['page'] for p in held if not p['digital']]
+        velocity_trace.current().set(page_count=page_count, scanned_pages=len(scanned), streamed_parts=sent)
+        if scanned:
+            blocks = [b for p in held if p['digital'] for b in p['blocks']]
+            return analyze_scanned(path, page_count, scanned, blocks, bucket, key, meta, manifest, sent, pending)
+    finally:
+        os.remove(path)
+    send_chunks(leading(pending, []), meta, key, "pdf", manifest, sent)
+    return {"status": "success", "mode": "fast"}
+
+def leading(pending, chunks):
+    # The chunk held back by send_leading_chunks goes out first in the second go
+    if pending is not None:
+        yield pending
+    yield from chunks
+
+def analyze_scanned(path, page_count, scanned, blocks, bucket, key, meta, manifest, sent, pending):
+    # Textract sees only the scanned pages, cut into their own PDF; the digital pages
+    # after the first scanned one wait beside it and both are merged back in page order
+    import fitz
+    with fitz.open(path) as doc, fitz.open() as subset:
+        for page in scanned:
+            subset.insert_pdf(doc, from_page=page - 1, to_page=page - 1)
+        pdf = subset.tobytes()
+    base = f"{PARTIAL_PREFIX}/{meta['file_id']}-{uuid.uuid4().hex[:8]}"
+    s3.put_object(Bucket=CLAIM_CHECK_BUCKET, Key=f"{base}.pdf", Body=pdf, ContentType='application/pdf')
+
+    if len(scanned) == 1:
+        # Single page: the sync API answers in seconds
+        response = textract.analyze_document(Document={'S3Object': {'Bucket': CLAIM_CHECK_BUCKET, 'Name': f"{base}.pdf"}},
+                                             FeatureTypes=["LAYOUT"])
+        s3.delete_object(Bucket=CLAIM_CHECK_BUCKET, Key=f"{base}.pdf")
+        ocr = [{**b, "Page": scanned[0]} for b in response['Blocks']]
+        merged = heapq.merge(blocks, ocr, key=lambda b: b['Page'])
+        chunks = chunk_blocks(merged, bucket, key, meta, manifest.revision)
+        send_chunks(leading(pending, chunks), meta, key, "pdf", manifest, sent)
+        return {"status": "success", "mode": "fast+sync"}
+
+    # The callback continues the parts already sent: same revision, next part number
+    partial = {"bucket": bucket, "key": key, "metadata": velocity_trace.current().carry(meta),
+               "page_count": page_count, "pages": scanned, "blocks": blocks,
+               "manifest": manifest.state(), "sent": sent, "pending": pending,
+               "pending_overlap": getattr(pending, 'overlap', 0)}
+    s3.put_object(Bucket=CLAIM_CHECK_BUCKET, Key=f"{base}.json", Body=json.dumps(partial).encode('utf-8'),
+                  ContentType='application/json')
+    textract.start_document_analysis(
+        DocumentLocation={'S3Object': {'Bucket': CLAIM_CHECK_BUCKET, 'Name': f"{base}.pdf"}},
+        FeatureTypes=["LAYOUT"],
+        NotificationChannel={'SNSTopicArn': SNS_TOPIC_ARN, 'RoleArn': ROLE_ARN}
+    )
+    return {"status": "success", "mode": "fast+async"}
+
+def finish_partial(pdf_key, ocr_blocks):
+    # Textract pages of the scanned subset map back to the original page numbers
+    base = pdf_key[:-len('.pdf')]
+    partial = json.loads(s3.get_object(Bucket=CLAIM_CHECK_BUCKET, Key=f"{base}.json")['Body'].read())
+    bucket, key, meta, pages = partial['bucket'], partial['key'], partial['metadata'], partial['pages']
+    velocity_trace.current().bind(meta).set(source='textract_partial', scanned_pages=len(pages))
+    worker_queue.route(meta['file_id'], pages=partial['page_count'])
+
+    ocr = ({**b, "Page": pages[b.get('Page', 1) - 1]} for b in ocr_blocks)
+    merged = heapq.merge(partial['blocks'], ocr, key=lambda b: b['Page'])
+    manifest = Manifest(meta, partial['manifest'])
+    chunks = chunk_blocks(merged, bucket, key, meta, manifest.revision)
+    pending = partial['pending']
+    if pending is not None:
+        pending = velocity_chunker.Chunk(pending, partial['pending_overlap'])
+    send_chunks(leading(pending, chunks), meta, key, "pdf", manifest, partial['sent'])
+    s3.delete_objects(Bucket=CLAIM_CHECK_BUCKET, Delete={
+        "Objects": [{"Key": f"{base}.pdf"}, {"Key": f"{base}.json"}], "Quiet": True
+    })
+    return {"status": "success"}
+
+def chunk_blocks(blocks, bucket, key, meta, revision):
+    # Results are ordered by page: a block from a later page means the current one is complete
+    chunker = velocity_chunker.Chunker()
+    page_num, page_blocks, figures = None, [], []
+    for block in blocks:
+        p_num = block.get('Page', 1)
+        if p_num != page_num and page_blocks:
+            yield from chunk_page(chunker, page_blocks)
+            page_blocks = []
+        page_num = p_num
         if block['BlockType'] == 'LAYOUT_FIGURE':
-            lambda_client.invoke(FunctionName=CROPPER_LAMBDA, InvocationType='Event',
-                                Payload=json.dumps({"bucket": bucket, "key": key, "metadata": meta, 
-                                                   "bbox": block['Geometry']['BoundingBox'], "page": block.get('Page', 1), "id": block['Id']}))
-        
-        elif block['BlockType'] == 'LINE':
-            p_num = block.get('Page', 1)
-            pages.setdefault(p_num, []).append(block['Text'])
-
-    total_pages = len(pages)
-    for p_num, lines in pages.items():
-        send_to_worker(lines, meta, key, "pdf_page", p_num, total_pages)
\ No newline at end of file
+            figures.append({"page": p_num, "bbox": block['Geometry']['BoundingBox'], "id": block['Id']})
+            if len(figures) >= CROP_BATCH_SIZE:
+                invoke_cropper(figures, bucket, key, meta, revision)
+                figures = []
+        page_blocks.append(block)
+    if page_blocks:
+        yield from chunk_page(chunker, page_blocks)
+    yield from chunker.finish()
+    if figures:
+        invoke_cropper(figures, bucket, key, meta, revision)
+
+def invoke_cropper(figures, bucket, key, meta, revision):
+    # One cropper run per batch: the PDF is downloaded and opened once for all of them.
+    # The revision rides along to the figure descriptions, keying their worker stages.
+    lambda_client.invoke(FunctionName=CROPPER_LAMBDA, InvocationType='Event',
+                        Payload=json.dumps({"bucket": bucket, "key": key, "figures": figures, "revision": revision,
+                                            "metadata": velocity_trace.current().carry(meta)}))
+
+def chunk_page(chunker, page_blocks):
+    # Chunk along Layout boundaries; sparse pages merge, dense ones split
+    for text, heading in velocity_chunker.textract_units(page_blocks):
+        yield from chunker.add(text, boundary=heading)
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import velocity_aws
+import velocity_bedrock
+import velocity_cache
+import velocity_keys
+import velocity_lexical
+import velocity_trace
+import velocity_vectors
+
+bedrock = velocity_bedrock.client()
+s3 = velocity_aws.client('s3')
+index = velocity_aws.pinecone_index()
+
+VAULT_BUCKET = os.environ['VAULT_BUCKET']
+
+ANSWER_MODEL_ID = os.environ.get('ANSWER_MODEL_ID', "anthropic.claude-3-haiku-20240307-v1:0")
+ANSWER_MAX_TOKENS = int(os.environ.get('ANSWER_MAX_TOKENS', '1024'))
+TOP_K = int(os.environ.get('TOP_K', '5'))
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', '8'))
+
+# Hybrid search: each side returns top_k * CANDIDATE_FACTOR, reciprocal rank fusion keeps top_k
+LEXICAL_SEARCH = os.environ.get('LEXICAL_SEARCH', 'on') != 'off'
+CANDIDATE_FACTOR = int(os.environ.get('CANDIDATE_FACTOR', '4'))
+RRF_K = int(os.environ.get('RRF_K', '60'))
+# Per-file BM25 segments written by the worker, mirrored to local disk and mmapped
+SEGMENT_DIR = os.environ.get('SEGMENT_DIR', '/tmp/lexical')
+SEGMENT_CACHE_ITEMS = int(os.environ.get('SEGMENT_CACHE_ITEMS', '1024'))
+SEGMENT_LIST_TTL_SECONDS = int(os.environ.get('SEGMENT_LIST_TTL_SECONDS', '30'))
+
+# Offsets indexes of recently hit files stay warm across invocations; the TTL bounds
+# how long a re-assembled file can be read through its previous offsets
+OFFSETS_TTL_SECONDS = int(os.environ.get('OFFSETS_TTL_SECONDS', '300'))
+offsets_cache = velocity_cache.Cache(max_items=int(os.environ.get('OFFSETS_CACHE_ITEMS', '256')))
+
+# Lexical search runs beside question embedding; it does not need the vector
+lexical_pool = ThreadPoolExecutor(max_workers=2)
+# Answer cache writes run after the stream ends, off the response path. A write
+# still pending when Lambda freezes the container finishes on the next thaw.
+cache_writer = ThreadPoolExecutor(max_workers=1)
+
+# 's3' caches under METADATA_BUCKET, 'sqlite:<path>' for local runs, 'off' disables.
+# The worker invalidates a subject's answers whenever a file finishes ingesting into it.
+ANSWER_CACHE = os.environ.get('ANSWER_CACHE', 's3')
+
+def build_answer_cache():
+    store = velocity_cache.open_store('answers', ANSWER_CACHE, s3, os.environ.get('METADATA_BUCKET'))
+    if store is None:
+        return None
+    return velocity_cache.SemanticCache(
+        store, threshold=float(os.environ.get('ANSWER_CACHE_THRESHOLD', '0.92')),
+        ttl_seconds=int(os.environ.get('ANSWER_CACHE_TTL_SECONDS', '86400')),
+        max_entries=int(os.environ.get('ANSWER_CACHE_ITEMS', '256')))
+
+answer_cache = build_answer_cache()
+
+SYSTEM_PROMPT = ("Answer the question using only the numbered context passages. "
+                 "If they do not contain the answer, say that you could not find it.")
+NO_CONTEXT_ANSWER = "I could not find anything about that in this subject's documents."
+
+@velocity_trace.handler('retriever')
+def lambda_handler(event, context):
+    # Python Lambdas cannot stream responses natively, so this entry point buffers for
+    # API Gateway; stream_answer() is the token stream for a streaming front end
+    request = json.loads(event['body']) if isinstance(event.get('body'), str) else event
+    missing = [field for field in ('question', 'user_id', 'subject_id') if not request.get(field)]
+    if missing:
+        return response(400, {"error": f"missing {', '.join(missing)}"})
+
+    answer, result = [], {}
+    for item in stream_answer(request):
+        if item['type'] == 'token':
+            answer.append(item['text'])
+        else:
+            result[item['type']] = item[item['type']]
+    return response(200, {"answer": "".join(answer), "sources": result['sources'], "metrics": result['metrics']})
+
+def response(status, body):
+    return {"statusCode": status, "headers": {"Content-Type": "application/json"}, "body": json.dumps(body)}
+
+def stream_answer(request):
+    # Yields {"type": "sources"}, then {"type": "token"} as the model writes, then {"type": "metrics"}
+    started = time.perf_counter()
+    metrics = {}
+    top_k = int(request.get('top_k') or TOP_K)
+    candidates = top_k * CANDIDATE_FACTOR
+    lexical = lexical_pool.submit(lexical_search, request['question'], request['user_id'],
+                                  request['subject_id'], candidates) if LEXICAL_SEARCH else None
+
+    # 1. Embed the question once
+    step = time.perf_counter()
+    vector = velocity_bedrock.embed(bedrock, request['question'])
+    metrics['embed_ms'] = velocity_trace.ms_since(step)
+
+    # 1b. A near-identical question already answered in this subject
+    scope = f"{request['user_id']}/{request['subject_id']}"
+    if answer_cache:
+        cached, similarity = answer_cache.lookup(scope, vector)
+        metrics.update(cache='hit' if cached else 'miss', cache_similarity=round(similarity, 4))
+        if cached:
+            if lexical:
+                lexical.cancel()
+            yield from replay(cached, metrics, started)
+            return
+
+    # 2. Dense and lexical candidates scoped to the caller's subject, fused by rank
+    step = time.perf_counter()
+    dense = search(vector, request['user_id'], request['subject_id'], candidates)
+    lexical_hits, metrics['lexical_ms'] = lexical_result(lexical)
+    matches = fuse(dense, lexical_hits, top_k)
+    metrics['search_ms'] = velocity_trace.ms_since(step)
+
+    # 3. Full chunk text for the hits only
+    step = time.perf_counter()
+    passages = fetch_passages(matches)
+    metrics['fetch_ms'] = velocity_trace.ms_since(step)
+    sources = [{"id": p['id'], "score": round(p['score'], 4), "file_id": p['file_id'],
+                "source_file": p['source_file']} for p in passages]
+    yield {"type": "sources", "sources": sources}
+
+    # 4. Stream the answer
+    answer = []
+    tokens = generate(request['question'], passages) if passages else iter([NO_CONTEXT_ANSWER])
+    for text in tokens:
+        if 'ttft_ms' not in metrics:
+            metrics['ttft_ms'] = velocity_trace.ms_since(started)
+        answer.append(text)
+        yield {"type": "token", "text": text}
+    metrics.update(total_ms=velocity_trace.ms_since(started), hits=len(passages))
+    yield finish(metrics)
+    if answer_cache and passages:
+        cache_writer.submit(cache_answer, scope, vector, {"answer": "".join(answer), "sources": sources,
+                                                          "total_ms": metrics['total_ms']})
+
+def cache_answer(scope, vector, value):
+    try:
+        answer_cache.add(scope, vector, value)
+    except Exception as e:
+        print(f"Error: answer cache write for {scope}: {e}")
+
+def replay(cached, metrics, started):
+    # Same events as a generated answer, so clients cannot tell a hit apart except by speed
+    yield {"type": "sources", "sources": cached['sources']}
+    for text in re.findall(r"\s*\S+", cached['answer']):
+        if 'ttft_ms' not in metrics:
+            metrics['ttft_ms'] = velocity_trace.ms_since(started)
+        yield {"type": "token", "text": text}
+    metrics.update(total_ms=velocity_trace.ms_since(started), hits=len(cached['sources']))
+    metrics['saved_ms'] = round(max(0.0, cached['total_ms'] - metrics['total_ms']), 3)
+    yield finish(metrics)
+
+def finish(metrics):
+    log = {"retrieval": metrics, "bedrock": bedrock.stats(reset=True)}
+    if answer_cache:
+        log['answer_cache'] = answer_cache.stats(reset=True)
+    print(json.dumps(log))
+    velocity_trace.current().set(**metrics)
+    return {"type": "metrics", "metrics": metrics}
+
+def search(vector, user_id, subject_id, top_k):
+    tenant = {"user_id": user_id, "subject_id": subject_id}
+    res = index.query(vector=vector, top_k=top_k, include_metadata=True,
+                      namespace=velocity_vectors.namespace(tenant), filter=velocity_vectors.query_filter(tenant))
+    return [{"id": m['id'], "score": m['score'], "metadata": m['metadata']} for m in res['matches']]
+
+def lexical_search(question, user_id, subject_id, top_k):
+    started = time.perf_counter()
+    hits = [{"id": f"{segment.info['file_id']}#{doc_id}", "score": score, "metadata": segment.info}
+            for score, segment, doc_id in velocity_lexical.search(segments.load(user_id, subject_id), question, top_k)]
+    return hits, velocity_trace.ms_since(started)
+
+def lexical_result(lexical):
+    # Lexical hits only sharpen the ranking: a bad segment or S3 error leaves dense search alone
+    if lexical is None:
+        return [], 0.0
+    try:
+        return lexical.result()
+    except Exception as e:
+        print(f"Error: lexical search: {e}")
+        return [], 0.0
+
+def fuse(dense, lexical, top_k):
+    # Dense matches win the merge: their metadata carries the chunk text fallback
+    by_id = {m['id']: m for m in lexical}
+    by_id.update((m['id'], m) for m in dense)
+    ranked = velocity_lexical.fuse([m['id'] for m in dense], [m['id'] for m in lexical], k=RRF_K)
+    return [{**by_id[item_id], "score": score} for item_id, score in ranked[:top_k]]
+
+class SegmentCache:
+    # The subject's segment listing is reused for a few seconds; segments are keyed by
+    # ETag, so only new or re-ingested files are downloaded again
+    def __init__(self, directory, max_items):
+        self.directory = directory
+        self.max_items = max_items
+        self.listings = {}
+        self.segments = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, user_id, subject_id):
+        prefix = velocity_keys.subject_prefix('lexical', {"user_id": user_id, "subject_id": subject_id})
+        listed = self.listings.get(prefix)
+        if not listed or time.monotonic() - listed[0] > SEGMENT_LIST_TTL_SECONDS:
+            objects = []
+            for page in s3.get_paginator('list_objects_v2').paginate(Bucket=VAULT_BUCKET, Prefix=prefix):
+                objects.extend((obj['Key'], obj['ETag']) for obj in page.get('Contents', []))
+            listed = self.listings[prefix] = (time.monotonic(), objects)
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            return [segment for segment in pool.map(self.get, listed[1]) if segment]
+
+    def get(self, entry):
+        key, etag = entry
+        with self.lock:
+            cached = self.segments.get(key)
+            if cached and cached[0] == etag:
+                self.segments.move_to_end(key)
+                return cached[1]
+        try:
+            body = s3.get_object(Bucket=VAULT_BUCKET, Key=key)['Body'].read()
+        except s3.exceptions.NoSuchKey:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.seg')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(body)
+        # A segment still referenced keeps the replaced or removed file's pages mapped
+        os.replace(path + '.tmp', path)
+        segment = velocity_lexical.Segment.open(path)
+        with self.lock:
+            self.segments.pop(key, None)
+            self.segments[key] = (etag, segment, path)
+            while len(self.segments) > self.max_items:
+                _, (_, _, evicted_path) = self.segments.popitem(last=False)
+                os.remove(evicted_path)
+        return segment
+
+segments = SegmentCache(SEGMENT_DIR, SEGMENT_CACHE_ITEMS)
+
+def fetch_passages(matches):
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        return list(pool.map(fetch_passage, matches))
+
+def fetch_passage(match):
+    meta = match['metadata']
+    text = meta.get('text', '')
+    # Vector ids are {file_id}#{suffix}; figures (#fig#) only ever have their description
+    suffix = match['id'].split('#', 1)[1]
+    offsets = load_offsets(meta) if not suffix.startswith('fig#') else None
+    span = offsets and offsets['chunks'].get(suffix)
+    if span:
+        start, length = span
+        text = s3.get_object(Bucket=VAULT_BUCKET, Key=offsets['vault_key'],
+                             Range=f"bytes={start}-{start + length - 1}")['Body'].read().decode('utf-8')
+    return {"id": match['id'], "score": match['score'], "file_id": meta.get('file_id'),
+            "source_file": meta.get('source_file'), "text": text}
+
+def load_offsets(meta):
+    key = velocity_keys.offsets_key(meta)
+    cached = offsets_cache.get(key)
+    if cached and time.monotonic() - cached[0] < OFFSETS_TTL_SECONDS:
+        return cached[1]
+    try:
+        offsets = json.loads(s3.get_object(Bucket=VAULT_BUCKET, Key=key)['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        # Not assembled yet, or ingested before offsets existed: metadata text only
+        return None
+    offsets_cache.put(key, (time.monotonic(), offsets))
+    return offsets
+
+def generate(question, passages):
+    context = "\n\n".join(f"[{i + 1}] {p['text']}" for i, p in enumerate(passages))
+    body = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31", "max_tokens": ANSWER_MAX_TOKENS,
+        "system": SYSTEM_PROMPT,
+        "messages": [{"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"}]
+    })
+    res = bedrock.invoke_model_with_response_stream(modelId=ANSWER_MODEL_ID, body=body)
+    for event in res['body']:
+        chunk = json.loads(event['chunk']['bytes'])
+        if chunk['type'] == 'content_block_delta' and chunk['delta'].get('type') == 'text_delta':
+            yield chunk['delta']['text']
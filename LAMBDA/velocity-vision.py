@@ -1,33 +1,118 @@
-import boto3, base64, json, os
+import base64, fitz, hashlib, json, os
+from concurrent.futures import ThreadPoolExecutor
+import velocity_aws
+import velocity_bedrock
+import velocity_cache
+import velocity_scheduler
+import velocity_trace
 
-bedrock = boto3.client('bedrock-runtime')
-sqs = boto3.client('sqs')
-s3 = boto3.client('s3')
+bedrock = velocity_bedrock.client()
+sqs = velocity_aws.client('sqs')
+s3 = velocity_aws.client('s3')
 QUEUE_URL = os.environ['WORKER_SQS_URL']
+CLAIM_CHECK_BUCKET = os.environ['CLAIM_CHECK_BUCKET']
 
+worker_queue = velocity_scheduler.Scheduler(sqs, QUEUE_URL, s3, CLAIM_CHECK_BUCKET)
+
+VISION_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+VISION_PROMPT = "Describe this diagram or figure concisely for a knowledge database."
+VISION_WORKERS = int(os.environ.get('VISION_WORKERS', '4'))
+# Longest edge sent to Bedrock; image tokens grow with width * height
+MAX_IMAGE_EDGE = int(os.environ.get('MAX_IMAGE_EDGE', '768'))
+# 's3' caches under METADATA_BUCKET, 'sqlite:<path>' for local runs, 'off' disables.
+# Not IMAGE_BUCKET: its notifications invoke this Lambda.
+VISION_CACHE = os.environ.get('VISION_CACHE', 's3')
+
+def build_vision_cache():
+    store = velocity_cache.open_store('descriptions', VISION_CACHE, s3, os.environ.get('METADATA_BUCKET'))
+    if store is None:
+        return None
+    return velocity_cache.Cache(store, max_items=int(os.environ.get('VISION_CACHE_ITEMS', '1024')))
+
+vision_cache = build_vision_cache()
+
+@velocity_trace.handler('vision')
 def lambda_handler(event, context):
-    bucket = event['Records'][0]['s3']['bucket']['name']
-    key = event['Records'][0]['s3']['object']['key']
+    records = event['Records']
+    with ThreadPoolExecutor(max_workers=VISION_WORKERS) as pool:
+        results = list(pool.map(safe_describe, records))
+    if vision_cache:
+        print(json.dumps({"vision_cache": vision_cache.stats(reset=True)}))
+    print(json.dumps({"bedrock": bedrock.stats(reset=True)}))
+
+    # 3. Send to SQS
+    failed = 0
+    with worker_queue:
+        for result in results:
+            if result is None:
+                failed += 1
+                continue
+            bucket, key, meta, desc = result
+            # The upload's revision keys the worker's stages, so a re-upload upserts again
+            revision = meta.pop('revision', None)
+            worker_queue.send({
+                "type": "image_description", "content": desc, "revision": int(revision) if revision else None,
+                "image_url": f"s3://{bucket}/{key}", "metadata": meta
+            })
+    if failed:
+        # Async invoke retries the event; described figures come back from the cache
+        raise RuntimeError(f"{failed} of {len(records)} figures failed")
+
+def safe_describe(record):
+    span = velocity_trace.Span('vision.figure')
+    try:
+        result = describe(record, span)
+        span.end()
+        return result
+    except Exception as e:
+        print(f"Error: {record['s3']['object']['key']}: {e}")
+        span.end(e)
+        return None
+
+def describe(record, span):
+    bucket = record['s3']['bucket']['name']
+    key = record['s3']['object']['key']
     meta = s3.head_object(Bucket=bucket, Key=key)['Metadata']
+    span.bind(meta)
+    meta = span.carry(meta)
 
-    # 1. Image to Base64
-    img_bytes = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
-    encoded = base64.b64encode(img_bytes).decode('utf-8')
+    # 1. Downscale, then look the figure up by its pixels
+    pix = downscale(fitz.Pixmap(s3.get_object(Bucket=bucket, Key=key)['Body'].read()))
+    cache_key = velocity_cache.content_key(VISION_MODEL_ID, VISION_PROMPT, pixel_hash(pix))
+    if vision_cache:
+        hit = vision_cache.get(cache_key)
+        if hit is not None:
+            span.set(cached=True)
+            return bucket, key, meta, hit.decode('utf-8')
+    encoded = base64.b64encode(pix.tobytes("jpg", jpg_quality=85)).decode('utf-8')
 
     # 2. Call Bedrock
     body = json.dumps({
         "anthropic_version": "bedrock-2023-05-31", "max_tokens": 300,
         "messages": [{"role": "user", "content": [
             {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": encoded}},
-            {"type": "text", "text": "Describe this diagram or figure concisely for a knowledge database."}
+            {"type": "text", "text": VISION_PROMPT}
         ]}]
     })
-    
-    response = bedrock.invoke_model(modelId="anthropic.claude-3-haiku-20240307-v1:0", body=body)
+
+    response = bedrock.invoke_model(modelId=VISION_MODEL_ID, body=body)
     desc = json.loads(response.get('body').read())['content'][0]['text']
+    if vision_cache:
+        vision_cache.put(cache_key, desc.encode('utf-8'))
+    return bucket, key, meta, desc
 
-    # 3. Send to SQS
-    sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=json.dumps({
-        "type": "image_description", "content": desc, 
-        "image_url": f"s3://{bucket}/{key}", "metadata": meta
-    }))
\ No newline at end of file
+def downscale(pix):
+    if pix.alpha or pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    scale = MAX_IMAGE_EDGE / max(pix.width, pix.height)
+    if scale < 1:
+        pix = fitz.Pixmap(pix, max(1, int(pix.width * scale)), max(1, int(pix.height * scale)), None)
+    return pix
+
+def pixel_hash(pix):
+    # Exact over the decoded, downscaled pixels: the cropper renders a figure the same
+    # way every time, so repeats still hit, while figures that differ in a digit do not.
+    # A hash of the JPEG bytes would miss on encoder differences alone.
+    digest = hashlib.sha256(f"{pix.width}x{pix.height}x{pix.n}".encode('ascii'))
+    digest.update(pix.samples)
+    return digest.hexdigest()
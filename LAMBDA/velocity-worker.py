@@ -1,66 +1,420 @@
 import json
 import os
-import boto3
-from pinecone import Pinecone
+import time
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import velocity_aws
+import velocity_bedrock
+import velocity_cache
+import velocity_codec
+import velocity_keys
+import velocity_ledger
+import velocity_lexical
+import velocity_scheduler
+import velocity_sqs
+import velocity_trace
+import velocity_vectors
 
-bedrock = boto3.client('bedrock-runtime')
-s3 = boto3.client('s3')
-pc = Pinecone(api_key=os.environ['PINECONE_API_KEY'])
-index = pc.Index(os.environ['PINECONE_INDEX_NAME'])
+bedrock = velocity_bedrock.client()
+s3 = velocity_aws.client('s3')
+sqs = velocity_aws.client('sqs')
+index = velocity_aws.pinecone_index()
 
 VAULT_BUCKET = os.environ['VAULT_BUCKET']
 METADATA_BUCKET = os.environ['METADATA_BUCKET']
+# Holds the metadata headers that v1 chunk messages refer to
+CLAIM_CHECK_BUCKET = os.environ['CLAIM_CHECK_BUCKET']
 
+decoder = velocity_codec.Decoder(s3, CLAIM_CHECK_BUCKET)
+# Records over their file's in-flight cap go back here; only needed with FILE_INFLIGHT_CAP
+WORKER_QUEUE_URL = os.environ.get('WORKER_SQS_URL')
+
+# Bounded fan-out for Bedrock and size caps for one Pinecone upsert request
+EMBED_WORKERS = int(os.environ.get('EMBED_WORKERS', '8'))
+UPSERT_BATCH_SIZE = int(os.environ.get('UPSERT_BATCH_SIZE', '100'))
+UPSERT_MAX_BYTES = int(os.environ.get('UPSERT_MAX_BYTES', str(2 * 1024 * 1024)))
+# Chunk text kept in vector metadata is a preview; the retriever reads full chunks from the vault
+VECTOR_TEXT_CHARS = int(os.environ.get('VECTOR_TEXT_CHARS', '256'))
+
+# Final file assembly: parallel part downloads, multipart vault upload (S3 minimum part is 5 MB)
+ASSEMBLY_WORKERS = int(os.environ.get('ASSEMBLY_WORKERS', '16'))
+ASSEMBLY_WINDOW = ASSEMBLY_WORKERS * 4
+MULTIPART_CHUNK_BYTES = int(os.environ.get('MULTIPART_CHUNK_BYTES', str(8 * 1024 * 1024)))
+
+# 'off' skips the per-file BM25 segment the retriever fuses with vector search
+LEXICAL_INDEX = os.environ.get('LEXICAL_INDEX', 'on') != 'off'
+
+# 's3' caches under METADATA_BUCKET, 'sqlite:<path>' for local runs, 'off' disables
+EMBED_CACHE = os.environ.get('EMBED_CACHE', 's3')
+
+def build_embed_cache():
+    store = velocity_cache.open_store('embeddings', EMBED_CACHE, s3, METADATA_BUCKET)
+    if store is None:
+        return None
+    return velocity_cache.Cache(store, max_items=int(os.environ.get('EMBED_CACHE_ITEMS', '4096')))
+
+embed_cache = build_embed_cache()
+
+# Same store as the retriever's answer cache; only used to invalidate a subject's answers
+ANSWER_CACHE = os.environ.get('ANSWER_CACHE', 's3')
+
+def build_answer_cache():
+    store = velocity_cache.open_store('answers', ANSWER_CACHE, s3, METADATA_BUCKET)
+    return velocity_cache.SemanticCache(store) if store else None
+
+answer_cache = build_answer_cache()
+
+# 'dynamodb:<table>' in AWS, 'sqlite:<path>' for local runs
+COMPLETION_LEDGER = os.environ['COMPLETION_LEDGER']
+
+def build_ledger():
+    kind, _, target = COMPLETION_LEDGER.partition(':')
+    if kind == 'sqlite':
+        return velocity_ledger.SQLiteLedger(target)
+    return velocity_ledger.DynamoLedger(velocity_aws.client('dynamodb'), target)
+
+ledger = build_ledger()
+
+@velocity_trace.handler('worker')
 def lambda_handler(event, context):
+    # Requires ReportBatchItemFailures on the SQS event source mapping
+    failed = set()
+
+    # 1. Parse every record of the invocation
+    chunks, deletes = [], []
     for record in event['Records']:
         try:
-            body = json.loads(record['body'])
-            content = body['content']
-            meta = body['metadata']
-            file_id = meta['file_id']
-            part_num = body['part_num']
-            total_parts = body['total_parts']
-
-            # 1. Pinecone Vector
-            res = bedrock.invoke_model(
-                body=json.dumps({"inputText": content, "dimensions": 1024, "normalize": True}),
-                modelId='amazon.titan-embed-text-v2:0', accept='application/json', contentType='application/json'
-            )
-            embedding = json.loads(res.get('body').read()).get('embedding')
-            
-            index.upsert(vectors=[{
-                "id": f"{file_id}#{part_num}",
-                "values": embedding,
-                "metadata": {**meta, "text": content[:1000]}
-            }])
-
-            # 2. Save Part to Temp Folder (Zero overwrite)
-            temp_key = f"temp/{file_id}/part_{part_num:05}.txt"
-            s3.put_object(Bucket=VAULT_BUCKET, Key=temp_key, Body=content)
-
-            # 3. If Last Part, Assemble File
-            if part_num == total_parts:
-                assemble_final_file(file_id, meta)
+            body = decoder.decode(record['body'])
+            if body['type'] == 'delete':
+                deletes.append((record['messageId'], body))
+            else:
+                chunks.append(parse_record(record, body))
+        except Exception as e:
+            print(f"Error: {record['messageId']}: {e}")
+            failed.add(record['messageId'])
+
+    # 1a. Per-file in-flight cap; records over it wait in the queue and count as handled
+    chunks, deferred, slots = velocity_scheduler.admit(ledger, chunks)
+    for chunk in deferred:
+        try:
+            velocity_scheduler.defer(sqs, WORKER_QUEUE_URL, chunk)
+            chunk['span'].set(deferred=True).end()
+        except Exception as e:
+            print(f"Error: {chunk['message_id']}: defer: {e}")
+            failed.add(chunk['message_id'])
+            chunk['span'].end(RuntimeError("redelivered"))
+
+    # 1b. Stages a redelivered message already finished
+    load_stages(chunks)
+
+    # 2. Embed concurrently, once per distinct text; unchanged chunks of a re-upload skip this
+    groups = {}
+    for chunk in chunks:
+        if needs_upsert(chunk):
+            groups.setdefault(chunk['cache_key'], []).append(chunk)
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as pool:
+        embedded = dict(zip(groups, pool.map(safe_embed, [group[0] for group in groups.values()])))
+    if embed_cache:
+        print(json.dumps({"embed_cache": {**embed_cache.stats(reset=True), "deduped": len(chunks) - len(groups)}}))
+    print(json.dumps({"bedrock": bedrock.stats(reset=True)}))
+
+    vectors = []
+    for chunk in chunks:
+        if not needs_upsert(chunk):
+            continue
+        embedding = embedded[chunk['cache_key']]
+        if embedding is None:
+            failed.add(chunk['message_id'])
+            continue
+        chunk['stages'].add('embedded')
+        vectors.append((chunk, {
+            "id": chunk['vector_id'],
+            "values": embedding,
+            "metadata": {**velocity_trace.strip(chunk['meta']), "text": chunk['content'][:vector_text_chars(chunk)]}
+        }))
+
+    # 3. Pinecone Vectors, several per request, into each chunk's tenant namespace
+    by_namespace = {}
+    for chunk, vector in vectors:
+        by_namespace.setdefault(velocity_vectors.namespace(chunk['meta']), []).append((chunk, vector))
+    batches = [(ns, batch) for ns, group in by_namespace.items() for batch in upsert_batches(group)]
+    for namespace, batch in batches:
+        started = time.perf_counter()
+        try:
+            index.upsert(vectors=[vector for _, vector in batch], namespace=namespace)
+            for chunk, _ in batch:
+                chunk['stages'].add('upserted')
+        except Exception as e:
+            print(f"Error: upsert of {len(batch)} vectors: {e}")
+            failed.update(chunk['message_id'] for chunk, _ in batch)
+        for chunk, _ in batch:
+            chunk['span'].set(upsert_ms=velocity_trace.ms_since(started))
+
+    # 3b. Vectors of chunks that left a re-uploaded file
+    for message_id, body in deletes:
+        file_id = body['metadata']['file_id']
+        try:
+            velocity_vectors.delete_ids(index, [vector_id(file_id, chunk_hash) for chunk_hash in body['chunk_hashes']],
+                                        velocity_vectors.namespace(body['metadata']))
+        except Exception as e:
+            print(f"Error: {message_id}: delete of {len(body['chunk_hashes'])} vectors: {e}")
+            failed.add(message_id)
 
+    # 4. Save Parts to Temp Folder, Assemble once every part is in
+    for chunk in chunks:
+        if chunk['message_id'] in failed or chunk['part_num'] is None:
+            continue
+        started = time.perf_counter()
+        try:
+            persist_part(chunk)
         except Exception as e:
-            print(f"Error: {e}")
-
-def assemble_final_file(file_id, meta):
-    # 1. List and sort all parts
-    prefix = f"temp/{file_id}/"
-    objs = s3.list_objects_v2(Bucket=VAULT_BUCKET, Prefix=prefix)['Contents']
-    sorted_objs = sorted(objs, key=lambda x: x['Key'])
-    
-    # 2. Join text
-    full_text = []
-    for obj in sorted_objs:
-        txt = s3.get_object(Bucket=VAULT_BUCKET, Key=obj['Key'])['Body'].read().decode('utf-8')
-        full_text.append(txt)
-    
-    # 3. Final Vault Write (ONE write only)
-    vault_key = f"vault/{meta['user_id']}/{meta['subject_id']}/{file_id}.txt"
-    s3.put_object(Bucket=VAULT_BUCKET, Key=vault_key, Body="\n\n".join(full_text))
-    
-    # 4. Cleanup Temp
-    for obj in sorted_objs:
-        s3.delete_object(Bucket=VAULT_BUCKET, Key=obj['Key'])
\ No newline at end of file
+            print(f"Error: {chunk['message_id']}: {e}")
+            failed.add(chunk['message_id'])
+        chunk['span'].set(persist_ms=velocity_trace.ms_since(started))
+
+    # 5. Finished stages, including those of messages going back to SQS
+    save_stages(chunks)
+    # Slots still held after a crash lapse with their lease
+    velocity_scheduler.release(ledger, slots)
+
+    for chunk in chunks:
+        chunk['span'].end(RuntimeError("redelivered") if chunk['message_id'] in failed else None)
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in sorted(failed)]}
+
+def parse_record(record, body):
+    content = velocity_sqs.load_content(s3, body)
+    meta = body['metadata']
+    file_id = meta['file_id']
+    part_num = body.get('part_num')
+    revision = body.get('revision')
+    # SQS stamps SentTimestamp (epoch ms); the difference is time spent queued
+    sent = record.get('attributes', {}).get('SentTimestamp')
+    queue_ms = round(time.time() * 1000 - int(sent), 3) if sent else None
+    vector = chunk_vector_id(file_id, body)
+    return {
+        "message_id": record['messageId'],
+        # Sent back as is when the file is over its in-flight cap
+        "raw": record['body'],
+        "content": content,
+        # zlib bytes straight from the message, reused for the temp part
+        "compressed": body.get('compressed'),
+        # Leading characters that repeat the previous part; embedded, but not assembled twice
+        "overlap": body.get('overlap', 0),
+        "meta": meta,
+        "file_id": file_id,
+        # Ledger and temp parts are per upload, so a re-upload never meets the last one's parts
+        "ingest_id": ingest_id(file_id, revision),
+        "part_num": part_num,
+        "total_parts": body.get('total_parts'),
+        "vector_id": vector,
+        "embed": body.get('embed', True),
+        "chunk_hash": body.get('chunk_hash'),
+        "cache_key": velocity_cache.content_key(velocity_bedrock.EMBED_MODEL_ID, velocity_bedrock.EMBED_DIMENSIONS, content),
+        # Idempotency key: per ingest, so a re-upload persists its parts again under its own prefix
+        "stage_key": f"{ingest_id(file_id, revision)}/{part_num if part_num is not None else vector}"
+                     f"/{velocity_cache.content_key(content)[:16]}",
+        "stages": set(),
+        "span": velocity_trace.Span('worker.part', meta, part_num=part_num, queue_ms=queue_ms, bytes=len(content))
+    }
+
+def ingest_id(file_id, revision):
+    return f"{file_id}.r{revision}" if revision else file_id
+
+def load_stages(chunks):
+    # A ledger outage only costs repeated work, never a failed message
+    try:
+        done = ledger.stages({chunk['stage_key'] for chunk in chunks})
+    except Exception as e:
+        print(f"Error: stage lookup: {e}")
+        done = {}
+    # Duplicates within one batch share a set, so only the first persists
+    shared = {}
+    for chunk in chunks:
+        chunk['stages'] = shared.setdefault(chunk['stage_key'], set(done.get(chunk['stage_key'], ())))
+        chunk['done'] = frozenset(chunk['stages'])
+        if chunk['done']:
+            chunk['span'].set(skipped=sorted(chunk['done']))
+
+def save_stages(chunks):
+    changed = {}
+    for chunk in chunks:
+        if chunk['stages'] != chunk['done']:
+            changed.setdefault(chunk['stage_key'], set()).update(chunk['stages'])
+    if not changed:
+        return
+    try:
+        ledger.record_stages(changed)
+    except Exception as e:
+        print(f"Error: recording stages of {len(changed)} chunks: {e}")
+
+def vector_text_chars(chunk):
+    # Figure descriptions never reach the vault, so the vector keeps their text
+    return VECTOR_TEXT_CHARS if chunk['part_num'] is not None else 1000
+
+def needs_upsert(chunk):
+    return chunk['embed'] and 'upserted' not in chunk['stages']
+
+def chunk_vector_id(file_id, body):
+    if body.get('part_num') is None:
+        # Figure descriptions from vision carry no part number
+        return f"{file_id}#fig#{os.path.basename(body['image_url'])}"
+    if body.get('chunk_hash'):
+        return vector_id(file_id, body['chunk_hash'])
+    return f"{file_id}#{body['part_num']}"
+
+def vector_id(file_id, chunk_hash):
+    # Content-addressed: a chunk that only moved keeps its vector across uploads
+    return f"{file_id}#{chunk_hash}"
+
+def safe_embed(chunk):
+    started = time.perf_counter()
+    try:
+        return cached_embed(chunk['cache_key'], chunk['content'])
+    except Exception as e:
+        print(f"Error: {chunk['message_id']}: {e}")
+        return None
+    finally:
+        chunk['span'].set(embed_ms=velocity_trace.ms_since(started))
+
+def cached_embed(key, text):
+    if embed_cache:
+        hit = embed_cache.get(key)
+        if hit is not None:
+            return array('f', hit).tolist()
+    embedding = velocity_bedrock.embed(bedrock, text)
+    if embed_cache:
+        embed_cache.put(key, array('f', embedding).tobytes())
+    return embedding
+
+def upsert_batches(vectors):
+    batch, batch_bytes = [], 0
+    for item in vectors:
+        size = len(json.dumps(item[1]))
+        if batch and (len(batch) >= UPSERT_BATCH_SIZE or batch_bytes + size > UPSERT_MAX_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+def persist_part(chunk):
+    # Zero overwrite: one temp object per part; the hash in the name feeds the offsets index
+    temp_key = velocity_keys.temp_part_key(chunk['ingest_id'], chunk['part_num'], chunk['chunk_hash'])
+    if 'persisted' not in chunk['stages']:
+        if chunk['overlap']:
+            body = zlib.compress(chunk['content'][chunk['overlap']:].encode('utf-8'), velocity_codec.COMPRESS_LEVEL)
+        else:
+            body = chunk['compressed'] or zlib.compress(chunk['content'].encode('utf-8'), velocity_codec.COMPRESS_LEVEL)
+        s3.put_object(Bucket=VAULT_BUCKET, Key=temp_key, Body=body)
+        chunk['stages'].add('persisted')
+
+    # Parts arrive in any order; only the call that completes the set assembles
+    if ledger.mark_part(chunk['ingest_id'], chunk['part_num'], chunk['total_parts']):
+        try:
+            with velocity_trace.Span('worker.assemble', chunk['meta'], parent_id=chunk['span'].span_id) as span:
+                span.set(parts=assemble_final_file(chunk['ingest_id'], chunk['meta']))
+            # Answers cached for this subject were generated without the new document
+            if answer_cache:
+                answer_cache.invalidate(f"{chunk['meta']['user_id']}/{chunk['meta']['subject_id']}")
+        except Exception:
+            # Let the SQS redelivery of this part claim assembly again
+            ledger.release(chunk['ingest_id'])
+            raise
+
+def assemble_final_file(ingest_id, meta):
+    # 1. List all parts, every page of the listing
+    prefix = velocity_keys.temp_prefix(ingest_id)
+    keys = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=VAULT_BUCKET, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    keys.sort()
+
+    # 2. Download concurrently, write in order as parts arrive
+    vault_key = velocity_keys.vault_key(meta)
+    writer = VaultWriter(vault_key)
+    segment = velocity_lexical.SegmentBuilder(velocity_trace.strip(meta)) if LEXICAL_INDEX else None
+    offsets, position = {}, 0
+    try:
+        for i, body in enumerate(fetch_in_order(keys)):
+            if i:
+                writer.write(b"\n\n")
+                position += 2
+            writer.write(body)
+            offsets[velocity_keys.chunk_suffix(keys[i])] = [position, len(body)]
+            position += len(body)
+            if segment:
+                segment.add(velocity_keys.chunk_suffix(keys[i]), body.decode('utf-8', errors='replace'))
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    # 2b. Byte range of every chunk's own text (overlap excluded), keyed like the vector ids,
+    # for ranged reads at query time
+    s3.put_object(Bucket=VAULT_BUCKET, Key=velocity_keys.offsets_key(meta), ContentType='application/json',
+                  Body=json.dumps({"vault_key": vault_key, "chunks": offsets}).encode('utf-8'))
+    # 2c. BM25 segment of this file, one object per file so ingests in a subject never contend
+    if segment:
+        s3.put_object(Bucket=VAULT_BUCKET, Key=velocity_keys.lexical_key(meta), Body=segment.to_bytes())
+
+    # 3. Cleanup Temp, 1000 keys per request
+    for i in range(0, len(keys), 1000):
+        res = s3.delete_objects(Bucket=VAULT_BUCKET, Delete={
+            "Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": True
+        })
+        for err in res.get('Errors', []):
+            print(f"Error: delete {err['Key']}: {err.get('Message')}")
+    return len(keys)
+
+def fetch_in_order(keys):
+    # Sliding window keeps at most ASSEMBLY_WINDOW parts in memory
+    def fetch(key):
+        body = s3.get_object(Bucket=VAULT_BUCKET, Key=key)['Body'].read()
+        # Parts persisted before compression are plain .txt
+        return zlib.decompress(body) if key.endswith('.z') else body
+    with ThreadPoolExecutor(max_workers=ASSEMBLY_WORKERS) as pool:
+        pending = deque()
+        for key in keys:
+            pending.append(pool.submit(fetch, key))
+            if len(pending) >= ASSEMBLY_WINDOW:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+class VaultWriter:
+    # Buffers into multipart chunks; small files fall back to a single put_object
+    def __init__(self, key):
+        self.key = key
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= MULTIPART_CHUNK_BYTES:
+            self._flush()
+
+    def _flush(self):
+        if self.upload_id is None:
+            self.upload_id = s3.create_multipart_upload(Bucket=VAULT_BUCKET, Key=self.key)['UploadId']
+        part_number = len(self.parts) + 1
+        res = s3.upload_part(Bucket=VAULT_BUCKET, Key=self.key, UploadId=self.upload_id,
+                             PartNumber=part_number, Body=bytes(self.buffer))
+        self.parts.append({"PartNumber": part_number, "ETag": res['ETag']})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.upload_id is None:
+            s3.put_object(Bucket=VAULT_BUCKET, Key=self.key, Body=bytes(self.buffer))
+            return
+        if self.buffer:
+            self._flush()
+        s3.complete_multipart_upload(Bucket=VAULT_BUCKET, Key=self.key, UploadId=self.upload_id,
+                                     MultipartUpload={"Parts": self.parts})
+
+    def abort(self):
+        if self.upload_id is not None:
+            s3.abort_multipart_upload(Bucket=VAULT_BUCKET, Key=self.key, UploadId=self.upload_id)
@@ -0,0 +1,65 @@
+import os
+import threading
+import velocity_trace
+
+# Client factory for the ingestion Lambdas. Clients are built on first use and
+# memoized per (service, config), so a handler pays only for the services the
+# event actually needs. The local pipeline registers in-memory stand-ins with
+# override(), so it runs with no AWS at all. Every client comes back wrapped so
+# its calls show up on the invocation's trace span.
+
+try:
+    # Imported during init, where Lambda runs at full CPU; clients still wait for first use
+    import boto3
+except ImportError:
+    boto3 = None
+
+# Sized for the handlers' thread pools (botocore's default of 10 drops connections
+# under 16 concurrent uploads); keep-alive holds sockets open between warm invokes
+DEFAULT_CONFIG = {
+    "max_pool_connections": int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '50')),
+    "tcp_keepalive": True,
+}
+
+overrides = {}
+clients = {}
+lock = threading.Lock()
+
+def override(name, client):
+    overrides[name] = client
+
+class LazyClient:
+    def __init__(self, build):
+        self._build = build
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with lock:
+                if self._client is None:
+                    self._client = self._build()
+        return getattr(self._client, name)
+
+def client(name, **config):
+    return velocity_trace.Instrumented(LazyClient(lambda: _client(name, config)), name)
+
+def _client(name, config):
+    if name in overrides:
+        return overrides[name]
+    key = (name, repr(sorted(config.items())))
+    if key not in clients:
+        from botocore.config import Config
+        clients[key] = boto3.client(name, config=Config(**{**DEFAULT_CONFIG, **config}))
+    return clients[key]
+
+def pinecone_index():
+    return velocity_trace.Instrumented(LazyClient(_pinecone_index), 'pinecone')
+
+def _pinecone_index():
+    if 'pinecone' in overrides:
+        return overrides['pinecone']
+    from pinecone import Pinecone
+    pc = Pinecone(api_key=os.environ['PINECONE_API_KEY'])
+    # A known host skips the describe_index round trip on every cold start
+    host = os.environ.get('PINECONE_INDEX_HOST')
+    return pc.Index(host=host) if host else pc.Index(os.environ['PINECONE_INDEX_NAME'])
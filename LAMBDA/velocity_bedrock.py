@@ -0,0 +1,180 @@
+import json
+import os
+import random
+import threading
+import time
+import velocity_aws
+
+# Rate-limit-aware wrapper around the bedrock-runtime client shared by the worker,
+# vision and retriever Lambdas. An AIMD limiter adapts in-flight calls to the
+# throttle signal (halve on throttle, +1 per window of successes), an optional
+# token bucket caps requests per second, and throttled calls retry with full
+# jitter. client() builds it with botocore retries off so throttles reach us. As
+# botocore would have, transient server and connection errors retry with the same
+# backoff; they leave the concurrency limit alone, since they say nothing of quota.
+#
+# The embedding model lives here too: the worker's chunk vectors and the
+# retriever's question vectors must come from the same model and dimensions.
+
+try:
+    from botocore.exceptions import ConnectionError as BotoConnectionError, HTTPClientError
+    NETWORK_ERRORS = (BotoConnectionError, HTTPClientError, ConnectionError, TimeoutError)
+except ImportError:
+    NETWORK_ERRORS = (ConnectionError, TimeoutError)
+
+THROTTLE_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+                  'ModelNotReadyException'}
+TRANSIENT_CODES = {'InternalServerException', 'InternalFailure', 'ModelTimeoutException', 'RequestTimeout',
+                   'RequestTimeoutException'}
+
+EMBED_MODEL_ID = 'amazon.titan-embed-text-v2:0'
+EMBED_DIMENSIONS = 1024
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class AIMDLimiter:
+    def __init__(self, initial=8, minimum=1, maximum=64, backoff=0.5):
+        self.limit = float(initial)
+        self.minimum, self.maximum, self.backoff = minimum, maximum, backoff
+        self.inflight = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait()
+            self.inflight += 1
+
+    def release(self, throttled=False, latency=0.0):
+        with self.cond:
+            self.inflight -= 1
+            if throttled:
+                # One decrease per round trip, so a burst of throttles counts once
+                now = time.monotonic()
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self.last_decrease = now
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= int(self.limit):
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self.successes = 0
+            self.cond.notify_all()
+
+class BedrockClient:
+    def __init__(self, client, limiter=None, bucket=None, max_retries=6, base_delay=0.2, max_delay=10.0):
+        self.client = client
+        self.limiter = limiter or AIMDLimiter(
+            initial=int(os.environ.get('BEDROCK_CONCURRENCY', '8')),
+            maximum=int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '64')))
+        max_rps = float(os.environ.get('BEDROCK_MAX_RPS', '0'))
+        self.bucket = bucket or (TokenBucket(max_rps) if max_rps else None)
+        self.max_retries, self.base_delay, self.max_delay = max_retries, base_delay, max_delay
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.calls = self.throttles = self.transient = self.failures = 0
+        self.queue_wait = 0.0
+        self.latencies = []
+
+    def invoke_model(self, **kwargs):
+        return self.call('invoke_model', **kwargs)
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return self.call('invoke_model_with_response_stream', **kwargs)
+
+    def call(self, method, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            if self.bucket:
+                self.bucket.take()
+            self.limiter.acquire()
+            started = time.monotonic()
+            throttled = transient = False
+            try:
+                return getattr(self.client, method)(**kwargs)
+            except Exception as e:
+                throttled = error_code(e) in THROTTLE_CODES
+                transient = not throttled and is_transient(e)
+                if not (throttled or transient) or attempt == self.max_retries:
+                    with self.lock:
+                        self.failures += 1
+                    raise
+            finally:
+                latency = time.monotonic() - started
+                self.limiter.release(throttled, latency)
+                with self.lock:
+                    self.calls += 1
+                    self.throttles += throttled
+                    self.transient += transient
+                    self.queue_wait += started - queued
+                    self.latencies.append(latency)
+            # Full jitter: spreads retries from every concurrent caller
+            time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def stats(self, reset=False):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            out = {
+                "calls": self.calls, "throttles": self.throttles, "transient_errors": self.transient,
+                "failures": self.failures,
+                "throttle_rate": round(self.throttles / self.calls, 4) if self.calls else 0.0,
+                "queue_wait_s": round(self.queue_wait, 3),
+                "latency_p50_s": round(percentile(latencies, 50), 3),
+                "latency_p95_s": round(percentile(latencies, 95), 3),
+                "concurrency_limit": int(self.limiter.limit)
+            }
+            if reset:
+                self._reset()
+        return out
+
+def client():
+    # The wrapped bedrock-runtime client every Lambda uses; botocore retries stay off
+    return BedrockClient(velocity_aws.client('bedrock-runtime', retries={'total_max_attempts': 1},
+                                             max_pool_connections=64))
+
+def embed(bedrock, text):
+    res = bedrock.invoke_model(
+        body=json.dumps({"inputText": text, "dimensions": EMBED_DIMENSIONS, "normalize": True}),
+        modelId=EMBED_MODEL_ID, accept='application/json', contentType='application/json'
+    )
+    return json.loads(res.get('body').read()).get('embedding')
+
+def error_code(e):
+    # botocore ClientError shape; the local fakes raise the same
+    return getattr(e, 'response', {}).get('Error', {}).get('Code')
+
+def is_transient(e):
+    # 5xx responses and dropped or timed-out connections; 4xx other than throttles are final
+    if isinstance(e, NETWORK_ERRORS):
+        return True
+    if error_code(e) in TRANSIENT_CODES:
+        return True
+    return getattr(e, 'response', {}).get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
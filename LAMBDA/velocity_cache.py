@@ -0,0 +1,276 @@
+import hashlib
+import json
+import math
+import operator
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+
+# Shared content-addressed cache: in-process LRU in front of a persistent store.
+# Values are raw bytes, callers pick the encoding. The store is best-effort: a
+# failed read is a miss and a failed write is logged, never raised to the caller.
+
+def content_key(*parts):
+    text = " ".join(str(parts[-1]).split())
+    head = "\x00".join(str(p) for p in parts[:-1])
+    return hashlib.sha256(f"{head}\x00{text}".encode('utf-8')).hexdigest()
+
+# Every persistent store by name: its prefix under METADATA_BUCKET and its SQLite table
+STORES = {
+    "manifests": ('manifests', 'manifests'),
+    "embeddings": ('embed-cache', 'embeddings'),
+    "descriptions": ('vision-cache', 'descriptions'),
+    "answers": ('answer-cache', 'answers'),
+}
+
+def open_store(name, setting, s3, bucket):
+    # setting: 's3' in AWS, 'sqlite:<path>' for local runs, 'off' for none
+    if setting == 'off':
+        return None
+    prefix, table = STORES[name]
+    if setting.startswith('sqlite:'):
+        return SQLiteStore(setting[len('sqlite:'):], table=table)
+    if not bucket:
+        raise ValueError(f"the {name} store needs METADATA_BUCKET")
+    return S3Store(s3, bucket, prefix)
+
+class S3Store:
+    def __init__(self, s3, bucket, prefix):
+        self.s3, self.bucket, self.prefix = s3, bucket, prefix.rstrip('/')
+
+    def _key(self, key):
+        return f"{self.prefix}/{key[:2]}/{key}"
+
+    def get(self, key):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=self._key(key))['Body'].read()
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def put(self, key, value):
+        self.s3.put_object(Bucket=self.bucket, Key=self._key(key), Body=value)
+
+    def keys(self, prefix):
+        # Keys starting with prefix, in key order; they share prefix[:2] as their shard
+        base = f"{self.prefix}/{prefix[:2]}/"
+        out = []
+        for page in self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=base + prefix):
+            out.extend(obj['Key'][len(base):] for obj in page.get('Contents', []))
+        return out
+
+class SQLiteStore:
+    def __init__(self, path, table='cache'):
+        self.table = table
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # WAL: a commit per put without an fsync each time
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB)")
+        self.db.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, value):
+        with self.lock:
+            self.db.execute(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", (key, value))
+            self.db.commit()
+
+    def keys(self, prefix):
+        with self.lock:
+            rows = self.db.execute(f"SELECT key FROM {self.table} WHERE substr(key, 1, ?) = ? ORDER BY key",
+                                   (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+class Cache:
+    def __init__(self, store=None, max_items=4096):
+        self.store = store
+        self.max_items = max_items
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.errors = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                self.hits += 1
+                return self.lru[key]
+        value = self._stored(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._remember(key, value)
+        return value
+
+    def _stored(self, key):
+        if not self.store:
+            return None
+        try:
+            return self.store.get(key)
+        except Exception as e:
+            # Throttling, permissions or a locked file: the caller computes the value instead
+            print(f"Error: cache get {key}: {e}")
+            with self.lock:
+                self.errors += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self._remember(key, value)
+        if not self.store:
+            return
+        try:
+            self.store.put(key, value)
+        except Exception as e:
+            print(f"Error: cache put {key}: {e}")
+            with self.lock:
+                self.errors += 1
+
+    def _remember(self, key, value):
+        self.lru[key] = value
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_items:
+            self.lru.popitem(last=False)
+
+    def stats(self, reset=False):
+        with self.lock:
+            out = {"hits": self.hits, "misses": self.misses, "errors": self.errors}
+            if reset:
+                self.hits = self.misses = self.errors = 0
+        return out
+
+class SemanticCache:
+    # Answers keyed by question embedding within a scope (one user's subject). Near
+    # duplicates hit when cosine similarity clears the threshold; vectors must be
+    # normalized. Every answer is its own stored entry, written once under the scope's
+    # current generation, so concurrent retrievers never overwrite each other. Ingest
+    # bumps the generation and older entries are never listed again. A container
+    # re-lists at most every refresh_seconds and fetches only entries it has not seen;
+    # the newest max_entries live ones are kept. Stale objects are left to a lifecycle
+    # rule on the store's prefix.
+    #
+    #   entry   json length u32, dimensions u32, JSON {"value", "created"}, float32 vector
+    ENTRY = struct.Struct('<II')
+    # Dimensions compared before the rest may be skipped, see lookup()
+    HEAD_DIMENSIONS = 128
+
+    def __init__(self, store, threshold=0.92, ttl_seconds=86400, max_entries=256, refresh_seconds=5):
+        self.store = store
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.refresh_seconds = refresh_seconds
+        self.scopes = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _generation_key(self, scope):
+        return content_key('semantic-generation', scope)
+
+    def _prefix(self, scope, generation):
+        return f"{content_key('semantic-entries', scope)}/{generation}/"
+
+    def _load(self, scope):
+        now = time.time()
+        with self.lock:
+            state = self.scopes.get(scope)
+            if state and now - state['loaded'] < self.refresh_seconds:
+                return state
+        generation = (self.store.get(self._generation_key(scope)) or b"0").decode('utf-8')
+        known = state['entries'] if state and state['generation'] == generation else {}
+        prefix = self._prefix(scope, generation)
+        # Keys start with the creation time in ms, so key order is age order
+        oldest = f"{int((now - self.ttl_seconds) * 1000):013d}"
+        keys = [k for k in self.store.keys(prefix) if k[len(prefix):] >= oldest][-self.max_entries:]
+        entries = {}
+        for key in keys:
+            entry = known.get(key)
+            if entry is None:
+                raw = self.store.get(key)
+                entry = self._decode(raw) if raw else None
+            if entry is not None:
+                entries[key] = entry
+        state = {"loaded": now, "generation": generation, "entries": entries}
+        with self.lock:
+            self.scopes[scope] = state
+        return state
+
+    def _decode(self, raw):
+        length, dimensions = self.ENTRY.unpack_from(raw)
+        offset = self.ENTRY.size + length
+        meta = json.loads(raw[self.ENTRY.size:offset])
+        vector = array('f')
+        vector.frombytes(raw[offset:offset + dimensions * 4])
+        head = min(self.HEAD_DIMENSIONS, dimensions)
+        return {"value": meta['value'], "created": meta['created'], "vector": vector,
+                "tail_norm": math.sqrt(sum(x * x for x in vector[head:]))}
+
+    def lookup(self, scope, vector):
+        # (entry value, similarity) of the closest live entry, or (None, best similarity seen).
+        # Entries are compared on their first HEAD_DIMENSIONS first: with the tail
+        # norms (Cauchy-Schwarz) that bounds the full score, and an entry whose bound
+        # misses the threshold is skipped without reading the rest.
+        state = self._load(scope)
+        now = time.time()
+        head = self.HEAD_DIMENSIONS
+        query_head, query_tail = vector[:head], vector[head:]
+        query_tail_norm = math.sqrt(sum(x * x for x in query_tail))
+        best, best_score = None, 0.0
+        for entry in list(state['entries'].values()):
+            # Entries from another embedding size never compare
+            if now - entry['created'] > self.ttl_seconds or len(entry['vector']) != len(vector):
+                continue
+            stored = entry['vector']
+            score = sum(map(operator.mul, stored[:head], query_head))
+            if score + entry['tail_norm'] * query_tail_norm < max(self.threshold, best_score):
+                continue
+            score += sum(map(operator.mul, stored[head:], query_tail))
+            if score > best_score:
+                best, best_score = entry, score
+        with self.lock:
+            if best is not None and best_score >= self.threshold:
+                self.hits += 1
+                return best['value'], best_score
+            self.misses += 1
+        return None, best_score
+
+    def add(self, scope, vector, value):
+        state = self._load(scope)
+        now = time.time()
+        vector = array('f', vector)
+        meta = json.dumps({"value": value, "created": now}).encode('utf-8')
+        raw = self.ENTRY.pack(len(meta), len(vector)) + meta + vector.tobytes()
+        key = f"{self._prefix(scope, state['generation'])}{int(now * 1000):013d}-{uuid.uuid4().hex[:8]}"
+        self.store.put(key, raw)
+        head = min(self.HEAD_DIMENSIONS, len(vector))
+        entry = {"value": value, "created": now, "vector": vector,
+                 "tail_norm": math.sqrt(sum(x * x for x in vector[head:]))}
+        with self.lock:
+            entries = state['entries']
+            entries[key] = entry
+            while len(entries) > self.max_entries:
+                del entries[min(entries)]
+
+    def invalidate(self, scope):
+        self.store.put(self._generation_key(scope), uuid.uuid4().hex.encode('utf-8'))
+        with self.lock:
+            self.scopes.pop(scope, None)
+
+    def stats(self, reset=False):
+        with self.lock:
+            total = self.hits + self.misses
+            out = {"hits": self.hits, "misses": self.misses,
+                   "hit_rate": round(self.hits / total, 3) if total else 0.0}
+            if reset:
+                self.hits = self.misses = 0
+        return out
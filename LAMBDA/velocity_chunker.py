@@ -0,0 +1,150 @@
+import os
+import re
+
+# Token-budgeted chunking shared by every input type. Units (paragraphs, layout
+# blocks, CSV rows) are packed whole up to the budget; only units larger than the
+# budget are split. Titan v2 has no local tokenizer, ~4 chars per token is close.
+# Consecutive chunks share up to OVERLAP_TOKENS of whole units; each chunk records
+# how much of its start repeats the previous one, so assembly can keep it once.
+
+TARGET_TOKENS = int(os.environ.get('CHUNK_TARGET_TOKENS', '512'))
+OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', '64'))
+CHARS_PER_TOKEN = 4
+
+# Boilerplate and figures (handled by the cropper) stay out of the text chunks
+SKIP_LAYOUT = {'LAYOUT_HEADER', 'LAYOUT_FOOTER', 'LAYOUT_PAGE_NUMBER', 'LAYOUT_FIGURE'}
+HEADING_LAYOUT = {'LAYOUT_TITLE', 'LAYOUT_SECTION_HEADER'}
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+class Chunk(str):
+    # Chunk text; overlap counts the leading characters, joiner included, that end the previous chunk
+    def __new__(cls, text, overlap=0):
+        chunk = super().__new__(cls, text)
+        chunk.overlap = overlap
+        return chunk
+
+class Chunker:
+    def __init__(self, target_tokens=TARGET_TOKENS, overlap_tokens=OVERLAP_TOKENS, joiner="\n\n"):
+        self.target = target_tokens
+        self.overlap = overlap_tokens
+        self.joiner = joiner
+        self.units = []
+        self.tokens = 0
+        self.fresh = 0
+        # Leading units carried over from the previous chunk
+        self.carried = 0
+
+    def add(self, text, boundary=False):
+        # Returns the chunks completed by this unit; boundary=True starts a new chunk
+        out = []
+        if boundary:
+            out += self.finish()
+        for piece in split_oversized(text.strip(), self.target):
+            tokens = estimate_tokens(piece)
+            if self.units and self.tokens + tokens > self.target:
+                if self.fresh:
+                    out.append(self._emit())
+                if self.tokens + tokens > self.target:
+                    self.units, self.tokens, self.carried = [], 0, 0
+            self.units.append((piece, tokens))
+            self.tokens += tokens
+            self.fresh += tokens
+        return out
+
+    def finish(self):
+        out = [self._emit()] if self.fresh else []
+        self.units, self.tokens, self.carried = [], 0, 0
+        return out
+
+    def _emit(self):
+        texts = [text for text, _ in self.units]
+        chunk = Chunk(self.joiner.join(texts),
+                      len(self.joiner.join(texts[:self.carried]) + self.joiner) if self.carried else 0)
+        keep, kept = [], 0
+        for unit in reversed(self.units):
+            if kept + unit[1] > self.overlap:
+                break
+            keep.insert(0, unit)
+            kept += unit[1]
+        self.units, self.tokens, self.fresh, self.carried = keep, kept, 0, len(keep)
+        return chunk
+
+def pack(units, target_tokens=TARGET_TOKENS, overlap_tokens=OVERLAP_TOKENS, joiner="\n\n"):
+    chunker = Chunker(target_tokens, overlap_tokens, joiner)
+    for unit in units:
+        yield from chunker.add(unit)
+    yield from chunker.finish()
+
+def split_oversized(text, target_tokens):
+    if not text:
+        return []
+    if estimate_tokens(text) <= target_tokens:
+        return [text]
+    limit = target_tokens * CHARS_PER_TOKEN
+    pieces, current = [], ""
+    for sentence in re.split(r'(?<=[.!?])\s+', text):
+        while len(sentence) > limit:
+            cut = sentence.rfind(" ", 0, limit)
+            cut = cut if cut > 0 else limit
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + len(sentence) + 1 > limit:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+def stream_paragraphs(lines, max_chars=TARGET_TOKENS * CHARS_PER_TOKEN):
+    # Paragraphs from an iterable of lines; long blank-free runs are cut at max_chars
+    buffer, size = [], 0
+    for line in lines:
+        if not line.strip():
+            if buffer:
+                yield "".join(buffer)
+                buffer, size = [], 0
+            continue
+        buffer.append(line)
+        size += len(line)
+        if size >= max_chars:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+def csv_row_text(row):
+    return " | ".join([f"{col}: {val}" for col, val in row.items() if val])
+
+def textract_units(blocks):
+    # (text, is_heading) per LAYOUT_* block in reading order, LINEs when there is no layout
+    by_id = {b['Id']: b for b in blocks}
+    layouts = [b for b in blocks if b['BlockType'].startswith('LAYOUT_')]
+    if not layouts:
+        return [(b['Text'], False) for b in blocks if b['BlockType'] == 'LINE']
+    nested = {i for b in layouts for i in child_ids(b) if by_id.get(i, {}).get('BlockType', '').startswith('LAYOUT_')}
+    units = []
+    for b in layouts:
+        if b['Id'] in nested or b['BlockType'] in SKIP_LAYOUT:
+            continue
+        text = " ".join(layout_lines(b, by_id))
+        if text:
+            units.append((text, b['BlockType'] in HEADING_LAYOUT))
+    return units
+
+def child_ids(block):
+    return [i for rel in block.get('Relationships', []) if rel['Type'] == 'CHILD' for i in rel['Ids']]
+
+def layout_lines(block, by_id):
+    lines = []
+    for i in child_ids(block):
+        child = by_id.get(i)
+        if not child:
+            continue
+        if child['BlockType'] == 'LINE':
+            lines.append(child['Text'])
+        elif child['BlockType'].startswith('LAYOUT_'):
+            lines += layout_lines(child, by_id)
+    return lines
@@ -0,0 +1,154 @@
+import base64
+import hashlib
+import json
+import os
+import struct
+import threading
+import zlib
+import velocity_cache
+
+# Chunk message format shared by the producers (manager, vision) and the worker.
+# A v1 message is base64 over a binary record: fixed fields, the chunk hash as raw
+# bytes, zlib-compressed text and a 16-byte id standing in for the file's metadata.
+# The metadata itself is written once per distinct value as a header object in the
+# claim-check bucket and cached by the consumer, so messages no longer repeat it.
+# Headers live under HEADER_PREFIX, not claim-check/: a message can wait in the queue,
+# the DLQ or a scheduler deferral long after its claim check expired, and it cannot
+# be decoded without its header. Keep HEADER_PREFIX out of lifecycle expiry rules.
+# Bodies starting with '{' are the original JSON, which decode() still accepts.
+#
+#   record  version u8, flags u8, type length u8, header id 16s, part_num u32,
+#           total_parts u32, revision u32, type, [chunk hash 8s], [extra length u16,
+#           extra JSON], content
+
+VERSION = 1
+RECORD = struct.Struct('<BBB16sIII')
+EXTRA_LENGTH = struct.Struct('<H')
+NONE = 0xFFFFFFFF
+
+COMPRESSED = 1
+HASHED = 2
+EXTRA = 4
+NO_EMBED = 8
+
+# 'binary' sends v1 records, 'json' the original bodies; consumers read both
+CHUNK_CODEC = os.environ.get('CHUNK_CODEC', 'binary')
+COMPRESS_LEVEL = int(os.environ.get('CHUNK_COMPRESS_LEVEL', '6'))
+
+HEADER_PREFIX = os.environ.get('CHUNK_HEADER_PREFIX', 'message-headers')
+
+# Differs per message even within one file, so it travels with the message
+PER_MESSAGE_METADATA = ('parent_span',)
+FIELDS = ('type', 'content', 'part_num', 'total_parts', 'revision', 'chunk_hash', 'embed', 'metadata')
+
+class Encoder:
+    def __init__(self, s3, bucket, prefix=None):
+        self.s3, self.bucket, self.prefix = s3, bucket, (prefix or HEADER_PREFIX).rstrip('/')
+        self.published = set()
+        self.lock = threading.Lock()
+
+    def encode(self, body):
+        # Deletes and other content-less control messages stay JSON
+        if CHUNK_CODEC != 'binary' or 'content' not in body:
+            return json.dumps(body)
+        metadata = body['metadata']
+        extra = {k: v for k, v in body.items() if k not in FIELDS}
+        extra.update((k, metadata[k]) for k in PER_MESSAGE_METADATA if k in metadata)
+        header = {k: v for k, v in metadata.items() if k not in PER_MESSAGE_METADATA}
+
+        flags = 0 if body.get('embed', True) else NO_EMBED
+        chunk_hash = body.get('chunk_hash')
+        if chunk_hash and len(chunk_hash) == 16:
+            flags |= HASHED
+        elif chunk_hash:
+            extra['chunk_hash'] = chunk_hash
+        if extra:
+            flags |= EXTRA
+        content = (body['content'] or "").encode('utf-8')
+        compressed = zlib.compress(content, COMPRESS_LEVEL)
+        if len(compressed) < len(content):
+            content, flags = compressed, flags | COMPRESSED
+
+        kind = body['type'].encode('utf-8')
+        parts = [RECORD.pack(VERSION, flags, len(kind), self.header_id(header), none_to_max(body.get('part_num')),
+                             none_to_max(body.get('total_parts')), body.get('revision') or 0), kind]
+        if flags & HASHED:
+            parts.append(bytes.fromhex(chunk_hash))
+        if flags & EXTRA:
+            raw = json.dumps(extra, separators=(',', ':')).encode('utf-8')
+            parts += [EXTRA_LENGTH.pack(len(raw)), raw]
+        parts.append(content)
+        return base64.b64encode(b"".join(parts)).decode('ascii')
+
+    def header_id(self, header):
+        raw = json.dumps(header, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(raw).digest()[:16]
+        with self.lock:
+            if digest in self.published:
+                return digest
+        # Written before any message that names it can be sent
+        self.s3.put_object(Bucket=self.bucket, Key=header_key(self.prefix, digest), Body=raw,
+                           ContentType='application/json')
+        with self.lock:
+            self.published.add(digest)
+        return digest
+
+class Decoder:
+    def __init__(self, s3, bucket, prefix=None, max_headers=1024):
+        self.s3, self.bucket, self.prefix = s3, bucket, (prefix or HEADER_PREFIX).rstrip('/')
+        self.headers = velocity_cache.Cache(max_items=max_headers)
+
+    def decode(self, text):
+        # -> message body dict; v1 bodies also carry 'compressed' (zlib bytes of the content) when compressed
+        if text.startswith('{'):
+            return json.loads(text)
+        data = base64.b64decode(text)
+        version, flags, type_length, digest, part_num, total_parts, revision = RECORD.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f"unsupported chunk message version {version}")
+        offset = RECORD.size
+        body = {"type": data[offset:offset + type_length].decode('utf-8'),
+                "part_num": max_to_none(part_num), "total_parts": max_to_none(total_parts)}
+        offset += type_length
+        if revision:
+            body['revision'] = revision
+        if flags & HASHED:
+            body['chunk_hash'] = data[offset:offset + 8].hex()
+            offset += 8
+        if flags & NO_EMBED:
+            body['embed'] = False
+        extra = {}
+        if flags & EXTRA:
+            (length,) = EXTRA_LENGTH.unpack_from(data, offset)
+            extra = json.loads(data[offset + EXTRA_LENGTH.size:offset + EXTRA_LENGTH.size + length])
+            offset += EXTRA_LENGTH.size + length
+        content = data[offset:]
+        if flags & COMPRESSED:
+            body['compressed'] = content
+            content = zlib.decompress(content)
+        body['content'] = content.decode('utf-8') if 'content_ref' not in extra else None
+
+        metadata = dict(self.header(digest))
+        for key in PER_MESSAGE_METADATA:
+            if key in extra:
+                metadata[key] = extra.pop(key)
+        body.update(extra)
+        body['metadata'] = metadata
+        return body
+
+    def header(self, digest):
+        header = self.headers.get(digest)
+        if header is None:
+            raw = self.s3.get_object(Bucket=self.bucket, Key=header_key(self.prefix, digest))['Body'].read()
+            header = json.loads(raw)
+            self.headers.put(digest, header)
+        return header
+
+def header_key(prefix, digest):
+    return f"{prefix}/{digest.hex()}.json"
+
+def none_to_max(value):
+    return NONE if value is None else value
+
+def max_to_none(value):
+    return None if value == NONE else value
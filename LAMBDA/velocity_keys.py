@@ -0,0 +1,44 @@
+import os
+
+# Object layout of VAULT_BUCKET. The worker writes these keys, the retriever reads
+# them and admin deletes them, so every one of them is built here.
+#
+#   temp/{ingest_id}/part_{num:05}[-{hash}].txt.z     parts waiting for assembly
+#   vault/{user}/{subject}/{file_id}.txt              assembled text
+#   offsets/{user}/{subject}/{file_id}.json           byte range of every chunk
+#   lexical/{user}/{subject}/{file_id}.seg            BM25 segment
+
+# Everything derived per file, beside its vectors
+DERIVED = {"vault": 'txt', "offsets": 'json', "lexical": 'seg'}
+
+def subject_prefix(kind, meta):
+    return f"{kind}/{meta['user_id']}/{meta['subject_id']}/"
+
+def derived_key(kind, meta):
+    return f"{subject_prefix(kind, meta)}{meta['file_id']}.{DERIVED[kind]}"
+
+def vault_key(meta):
+    return derived_key('vault', meta)
+
+def offsets_key(meta):
+    return derived_key('offsets', meta)
+
+def lexical_key(meta):
+    return derived_key('lexical', meta)
+
+def file_id(kind, meta, key):
+    # Inverse of derived_key within one subject
+    return key[len(subject_prefix(kind, meta)):-len(DERIVED[kind]) - 1]
+
+def temp_prefix(ingest_id):
+    return f"temp/{ingest_id}/"
+
+def temp_part_key(ingest_id, part_num, chunk_hash=None):
+    suffix = f"-{chunk_hash}" if chunk_hash else ""
+    return f"{temp_prefix(ingest_id)}part_{part_num:05}{suffix}.txt.z"
+
+def chunk_suffix(temp_key):
+    # part_00012-<hash>.txt.z -> <hash>, part_00012.txt -> 12: the part after '#' in the vector id
+    name = os.path.basename(temp_key)[len('part_'):].split('.', 1)[0]
+    number, _, chunk_hash = name.partition('-')
+    return chunk_hash or str(int(number))
@@ -0,0 +1,210 @@
+import sqlite3
+import threading
+import time
+
+# Per-file completion ledger. Workers record each persisted part; the single call
+# that sees the count complete claims assembly. Each part is its own item, written
+# only if absent in the same transaction that bumps the file's counter, so SQS
+# redeliveries never double count and the file item stays small however many parts
+# there are. total_parts may be None on streamed inputs, where only the last part
+# knows the total.
+#
+# It also records which stages (embedded, upserted, persisted) each chunk has
+# finished, keyed by ingest, part and content hash, so a redelivered message
+# skips the work already done. Stage sets are written whole; a lost write only
+# means a stage runs again.
+#
+# Slot items count each file's records in flight for the scheduler's per-file cap.
+# A count lapses with its lease, so slots lost with a crashed worker come back.
+
+LEDGER_TTL_SECONDS = 7 * 24 * 3600
+# Part, stage and slot items share the table with the file items under their own key prefixes
+PART_PREFIX = 'part#'
+STAGE_PREFIX = 'stage#'
+SLOT_PREFIX = 'slots#'
+# Optimistic slot updates retried on a concurrent change before giving up
+SLOT_RETRIES = 5
+
+class DynamoLedger:
+    def __init__(self, dynamodb, table):
+        self.db, self.table = dynamodb, table
+
+    def mark_part(self, file_id, part_num, total_parts):
+        expires = {"N": str(int(time.time()) + LEDGER_TTL_SECONDS)}
+        update = "ADD parts_done :one SET expires_at = :e"
+        values = {":one": {"N": "1"}, ":e": expires}
+        if total_parts is not None:
+            update += ", total_parts = if_not_exists(total_parts, :t)"
+            values[":t"] = {"N": str(total_parts)}
+        try:
+            self.db.transact_write_items(TransactItems=[
+                {"Put": {"TableName": self.table,
+                         "Item": {"file_id": {"S": f"{PART_PREFIX}{file_id}#{part_num}"}, "expires_at": expires},
+                         "ConditionExpression": "attribute_not_exists(file_id)"}},
+                {"Update": {"TableName": self.table, "Key": {"file_id": {"S": file_id}},
+                            "UpdateExpression": update, "ExpressionAttributeValues": values}},
+            ])
+        except self.db.exceptions.TransactionCanceledException as e:
+            reasons = [r.get('Code') for r in e.response.get('CancellationReasons', [])]
+            if reasons[:1] != ['ConditionalCheckFailed']:
+                raise
+            # Redelivered part: already counted, but the set may have completed since
+        item = self.db.get_item(TableName=self.table, Key={"file_id": {"S": file_id}}, ConsistentRead=True,
+                                ProjectionExpression="parts_done, total_parts").get('Item', {})
+        if 'total_parts' not in item or int(item['parts_done']['N']) < int(item['total_parts']['N']):
+            return False
+        return self._claim(file_id)
+
+    def _claim(self, file_id):
+        try:
+            self.db.update_item(
+                TableName=self.table, Key={"file_id": {"S": file_id}},
+                UpdateExpression="SET assembled_at = :now",
+                ConditionExpression="attribute_not_exists(assembled_at)",
+                ExpressionAttributeValues={":now": {"N": str(int(time.time()))}}
+            )
+            return True
+        except self.db.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def release(self, file_id):
+        self.db.update_item(TableName=self.table, Key={"file_id": {"S": file_id}},
+                            UpdateExpression="REMOVE assembled_at")
+
+    def stages(self, keys):
+        keys, out = list(keys), {}
+        for i in range(0, len(keys), 100):
+            request = {self.table: {"Keys": [{"file_id": {"S": STAGE_PREFIX + key}} for key in keys[i:i + 100]],
+                                    "ProjectionExpression": "file_id, stages"}}
+            while request:
+                res = self.db.batch_get_item(RequestItems=request)
+                for item in res['Responses'].get(self.table, []):
+                    out[item['file_id']['S'][len(STAGE_PREFIX):]] = set(item['stages']['SS'])
+                request = res.get('UnprocessedKeys') or None
+                if request:
+                    time.sleep(0.05)
+        return out
+
+    def record_stages(self, stages):
+        expires = str(int(time.time()) + LEDGER_TTL_SECONDS)
+        items = [{"PutRequest": {"Item": {"file_id": {"S": STAGE_PREFIX + key}, "stages": {"SS": sorted(done)},
+                                          "expires_at": {"N": expires}}}}
+                 for key, done in stages.items() if done]
+        for i in range(0, len(items), 25):
+            request = {self.table: items[i:i + 25]}
+            while request:
+                request = self.db.batch_write_item(RequestItems=request).get('UnprocessedItems') or None
+                if request:
+                    time.sleep(0.05)
+
+    def acquire_slots(self, file_id, wanted, cap, lease_seconds):
+        # -> slots granted, up to wanted; conditional on the count read so concurrent workers never overshoot
+        key = {"file_id": {"S": SLOT_PREFIX + file_id}}
+        for _ in range(SLOT_RETRIES):
+            now = int(time.time())
+            item = self.db.get_item(TableName=self.table, Key=key, ConsistentRead=True).get('Item')
+            live = item is not None and int(item['lease_until']['N']) > now
+            held = int(item['in_flight']['N']) if live else 0
+            granted = min(wanted, cap - held)
+            if granted <= 0:
+                return 0
+            lease_until = item['lease_until']['N'] if live else str(now + lease_seconds)
+            values = {":n": {"N": str(held + granted)}, ":l": {"N": lease_until},
+                      ":e": {"N": str(now + LEDGER_TTL_SECONDS)}}
+            if item is None:
+                condition = "attribute_not_exists(file_id)"
+            else:
+                condition = "in_flight = :seen AND lease_until = :seen_lease"
+                values.update({":seen": item['in_flight'], ":seen_lease": item['lease_until']})
+            try:
+                self.db.update_item(TableName=self.table, Key=key, ConditionExpression=condition,
+                                    UpdateExpression="SET in_flight = :n, lease_until = :l, expires_at = :e",
+                                    ExpressionAttributeValues=values)
+                return granted
+            except self.db.exceptions.ConditionalCheckFailedException:
+                continue
+        return 0
+
+    def release_slots(self, file_id, count):
+        try:
+            self.db.update_item(TableName=self.table, Key={"file_id": {"S": SLOT_PREFIX + file_id}},
+                                UpdateExpression="ADD in_flight :d", ConditionExpression="in_flight >= :n",
+                                ExpressionAttributeValues={":d": {"N": str(-count)}, ":n": {"N": str(count)}})
+        except self.db.exceptions.ConditionalCheckFailedException:
+            pass  # the lease lapsed and the count started over
+
+class SQLiteLedger:
+    # Local stand-in; BEGIN IMMEDIATE serializes writers across processes too
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ledger_files (file_id TEXT PRIMARY KEY, total_parts INTEGER, assembled INTEGER DEFAULT 0)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ledger_parts (file_id TEXT, part_num INTEGER, PRIMARY KEY (file_id, part_num))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ledger_stages (key TEXT PRIMARY KEY, stages TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ledger_slots (file_id TEXT PRIMARY KEY, in_flight INTEGER, lease_until REAL)")
+
+    def mark_part(self, file_id, part_num, total_parts):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute("INSERT OR IGNORE INTO ledger_parts VALUES (?, ?)", (file_id, part_num))
+                self.db.execute(
+                    "INSERT INTO ledger_files (file_id, total_parts) VALUES (?, ?) ON CONFLICT(file_id) "
+                    "DO UPDATE SET total_parts = COALESCE(total_parts, excluded.total_parts)", (file_id, total_parts))
+                total, assembled = self.db.execute(
+                    "SELECT total_parts, assembled FROM ledger_files WHERE file_id = ?", (file_id,)).fetchone()
+                done = self.db.execute("SELECT COUNT(*) FROM ledger_parts WHERE file_id = ?", (file_id,)).fetchone()[0]
+                claimed = not assembled and total is not None and done >= total
+                if claimed:
+                    self.db.execute("UPDATE ledger_files SET assembled = 1 WHERE file_id = ?", (file_id,))
+                self.db.execute("COMMIT")
+                return claimed
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def release(self, file_id):
+        with self.lock:
+            self.db.execute("UPDATE ledger_files SET assembled = 0 WHERE file_id = ?", (file_id,))
+
+    def stages(self, keys):
+        keys, rows = list(keys), []
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows += self.db.execute(f"SELECT key, stages FROM ledger_stages WHERE key IN "
+                                        f"({','.join('?' * len(batch))})", batch).fetchall()
+        return {key: set(done.split(',')) for key, done in rows}
+
+    def record_stages(self, stages):
+        rows = [(key, ','.join(sorted(done))) for key, done in stages.items() if done]
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.executemany("INSERT OR REPLACE INTO ledger_stages VALUES (?, ?)", rows)
+            self.db.execute("COMMIT")
+
+    def acquire_slots(self, file_id, wanted, cap, lease_seconds):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self.db.execute("SELECT in_flight, lease_until FROM ledger_slots WHERE file_id = ?",
+                                      (file_id,)).fetchone()
+                live = row is not None and row[1] > now
+                held = row[0] if live else 0
+                granted = max(0, min(wanted, cap - held))
+                if granted:
+                    self.db.execute("INSERT OR REPLACE INTO ledger_slots VALUES (?, ?, ?)",
+                                    (file_id, held + granted, row[1] if live else now + lease_seconds))
+                self.db.execute("COMMIT")
+                return granted
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def release_slots(self, file_id, count):
+        with self.lock:
+            self.db.execute("UPDATE ledger_slots SET in_flight = in_flight - ? WHERE file_id = ? AND in_flight >= ?",
+                            (count, file_id, count))
@@ -0,0 +1,173 @@
+import json
+import math
+import mmap
+import re
+import struct
+from collections import Counter
+
+# BM25 inverted index for exact identifiers, codes and column names that dense
+# search misses. The worker writes one segment per assembled file; a subject's
+# index is the set of its segments, scored together with subject-wide statistics,
+# so concurrent ingests in one subject never rewrite a shared object. A segment
+# is a flat file read through mmap: the term dictionary is sorted fixed-width
+# records for binary search, so a query only touches the pages of its own terms.
+#
+# Layout (little endian): header, info JSON, doc table, term table, strings, postings
+#   doc    length u32, id offset u32, id length u16
+#   term   string offset u32, string length u16, df u32, postings offset u32
+#   post   doc index u32, term frequency u16
+
+MAGIC = b'VLX1'
+HEADER = struct.Struct('<4sIIIQIIII')
+DOC = struct.Struct('<IIH')
+TERM = struct.Struct('<IHII')
+POSTING = struct.Struct('<IH')
+
+K1 = 1.2
+B = 0.75
+MAX_TERM_BYTES = 64
+MAX_TF = 0xFFFF
+
+# Runs of letters and digits, kept whole across _ . - / so `order_id`, `SKU-1042`
+# and `v2.1` match exactly; the pieces are indexed too for partial matches
+TOKEN = re.compile(r"[^\W_]+(?:[_.\-/][^\W_]+)*")
+JOINER = re.compile(r"[_.\-/]")
+
+def tokenize(text):
+    for token in TOKEN.findall(text.lower()):
+        if len(token.encode('utf-8')) > MAX_TERM_BYTES:
+            continue
+        yield token
+        pieces = JOINER.split(token)
+        if len(pieces) > 1:
+            yield from pieces
+
+class SegmentBuilder:
+    # Keeps term counts, not text, so memory follows vocabulary rather than file size
+    def __init__(self, info=None):
+        self.info = info or {}
+        self.docs = []
+
+    def add(self, doc_id, text):
+        terms = Counter(tokenize(text))
+        self.docs.append((doc_id, sum(terms.values()), terms))
+
+    def to_bytes(self):
+        postings = {}
+        for index, (_, _, terms) in enumerate(self.docs):
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((index, min(tf, MAX_TF)))
+
+        strings = bytearray()
+        doc_table = bytearray()
+        for doc_id, length, _ in self.docs:
+            raw = doc_id.encode('utf-8')
+            doc_table += DOC.pack(length, len(strings), len(raw))
+            strings += raw
+        term_table = bytearray()
+        posting_data = bytearray()
+        for term in sorted(postings, key=lambda t: t.encode('utf-8')):
+            raw = term.encode('utf-8')
+            term_table += TERM.pack(len(strings), len(raw), len(postings[term]), len(posting_data))
+            strings += raw
+            for index, tf in postings[term]:
+                posting_data += POSTING.pack(index, tf)
+
+        info = json.dumps(self.info).encode('utf-8')
+        docs_offset = HEADER.size + len(info)
+        terms_offset = docs_offset + len(doc_table)
+        strings_offset = terms_offset + len(term_table)
+        postings_offset = strings_offset + len(strings)
+        header = HEADER.pack(MAGIC, len(info), len(self.docs), len(postings),
+                             sum(length for _, length, _ in self.docs),
+                             docs_offset, terms_offset, strings_offset, postings_offset)
+        return b"".join((header, info, doc_table, term_table, strings, posting_data))
+
+class Segment:
+    def __init__(self, buffer):
+        (magic, info_length, self.doc_count, self.term_count, self.total_length,
+         self.docs_offset, self.terms_offset, self.strings_offset, self.postings_offset) = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f"not a lexical segment: {magic!r}")
+        self.buffer = buffer
+        self.info = json.loads(bytes(buffer[HEADER.size:HEADER.size + info_length]))
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def _string(self, offset, length):
+        start = self.strings_offset + offset
+        return bytes(self.buffer[start:start + length])
+
+    def _term(self, i):
+        return TERM.unpack_from(self.buffer, self.terms_offset + i * TERM.size)
+
+    def lookup(self, term):
+        # Binary search over the sorted term records; (df, postings offset) or None
+        raw = term.encode('utf-8')
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            offset, length, df, postings = self._term(middle)
+            found = self._string(offset, length)
+            if found < raw:
+                low = middle + 1
+            elif found > raw:
+                high = middle
+            else:
+                return df, postings
+        return None
+
+    def postings(self, entry):
+        df, offset = entry
+        start = self.postings_offset + offset
+        return POSTING.iter_unpack(self.buffer[start:start + df * POSTING.size])
+
+    def doc(self, index):
+        length, offset, id_length = DOC.unpack_from(self.buffer, self.docs_offset + index * DOC.size)
+        return self._string(offset, id_length).decode('utf-8'), length
+
+def search(segments, query, top_k):
+    # BM25 over every segment as one index: N, average length and df are subject-wide
+    terms = set(tokenize(query))
+    doc_count = sum(s.doc_count for s in segments)
+    if not terms or not doc_count:
+        return []
+    average_length = sum(s.total_length for s in segments) / doc_count
+
+    entries = {}
+    df = Counter()
+    for i, segment in enumerate(segments):
+        for term in terms:
+            entry = segment.lookup(term)
+            if entry:
+                entries[(i, term)] = entry
+                df[term] += entry[0]
+
+    scores = Counter()
+    for (i, term), entry in entries.items():
+        idf = math.log(1 + (doc_count - df[term] + 0.5) / (df[term] + 0.5))
+        segment = segments[i]
+        for index, tf in segment.postings(entry):
+            _, length = segment.doc(index)
+            scores[(i, index)] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+
+    hits = []
+    for (i, index), score in scores.most_common(top_k):
+        doc_id, _ = segments[i].doc(index)
+        hits.append((score, segments[i], doc_id))
+    return hits
+
+def fuse(*rankings, k=60):
+    # Reciprocal rank fusion over ranked id lists; scores on different scales never mix
+    scores = Counter()
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] += 1 / (k + rank + 1)
+    return scores.most_common()
@@ -0,0 +1,198 @@
+import re
+import zlib
+
+# PDF page counting from a handful of S3 ranged GETs: linearization header, or
+# trailer -> xref (table or stream) -> catalog -> page tree /Count. Raises
+# PDFInfoError when the structure is not understood; callers fall back to a full open.
+
+HEAD_BYTES = 2048
+TAIL_BYTES = 4096
+READ_BYTES = 64 * 1024
+MAX_OBJECT_BYTES = 16 * 1024 * 1024
+
+class PDFInfoError(Exception):
+    pass
+
+class S3RangeReader:
+    def __init__(self, s3, bucket, key, size):
+        self.s3, self.bucket, self.key, self.size = s3, bucket, key, size
+        self.requests = 0
+
+    def read(self, start, length):
+        start = max(0, start)
+        end = min(self.size, start + length) - 1
+        if end < start:
+            return b""
+        self.requests += 1
+        return self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}")['Body'].read()
+
+def count_pages(reader):
+    try:
+        return _count_pages(reader)
+    except (AttributeError, IndexError, KeyError, ValueError) as e:
+        raise PDFInfoError(f"malformed PDF structure: {e!r}")
+
+def _count_pages(reader):
+    # Linearization dict carries /N, valid while /L still matches the file length
+    head = reader.read(0, HEAD_BYTES)
+    linearized = re.search(rb'/Linearized[^>]*', head)
+    if linearized:
+        pages = re.search(rb'/N\s+(\d+)', linearized.group(0))
+        length = re.search(rb'/L\s+(\d+)', linearized.group(0))
+        if pages and length and int(length.group(1)) == reader.size:
+            return int(pages.group(1))
+
+    tail = reader.read(reader.size - TAIL_BYTES, TAIL_BYTES)
+    startxref = re.findall(rb'startxref\s+(\d+)', tail)
+    if not startxref:
+        raise PDFInfoError("no startxref")
+    xref = XRef(reader, int(startxref[-1]))
+    catalog = xref.object(ref(xref.root, b'Root'))
+    pages = xref.object(ref(catalog, b'Pages'))
+    count = re.search(rb'/Count\s+(\d+)(\s+\d+\s+R)?', pages)
+    if not count:
+        raise PDFInfoError("page tree has no /Count")
+    if count.group(2):
+        return int(xref.object(int(count.group(1))).split(b'obj', 1)[-1].split()[0])
+    return int(count.group(1))
+
+def ref(data, name):
+    match = re.search(rb'/' + name + rb'\s+(\d+)\s+\d+\s+R', data)
+    if not match:
+        raise PDFInfoError(f"no /{name.decode()} reference")
+    return int(match.group(1))
+
+class XRef:
+    def __init__(self, reader, offset):
+        self.reader = reader
+        self.entries = {}
+        self.root = None
+        seen = set()
+        # Newest section first; /Prev chains to older incremental updates
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            offset = self._load(offset)
+        if self.root is None:
+            raise PDFInfoError("no trailer /Root")
+
+    def _load(self, offset):
+        data = self.reader.read(offset, READ_BYTES)
+        if data.lstrip().startswith(b'xref'):
+            while b'trailer' not in data or b'>>' not in data.split(b'trailer', 1)[1]:
+                more = self.reader.read(offset + len(data), READ_BYTES)
+                if not more or len(data) > MAX_OBJECT_BYTES:
+                    raise PDFInfoError("unterminated xref table")
+                data += more
+            table, trailer = data.split(b'trailer', 1)
+            # Hybrid files list their compressed objects in a separate xref stream
+            hybrid = re.search(rb'/XRefStm\s+(\d+)', trailer)
+            if hybrid:
+                for num, entry in self._parse_stream(read_object(self.reader, int(hybrid.group(1))))[1].items():
+                    self.entries.setdefault(num, entry)
+            self._parse_table(table.split()[1:])
+        else:
+            trailer, entries = self._parse_stream(read_object(self.reader, offset))
+            for num, entry in entries.items():
+                self.entries.setdefault(num, entry)
+        if self.root is None and re.search(rb'/Root\s+\d+', trailer):
+            self.root = trailer
+        prev = re.search(rb'/Prev\s+(\d+)', trailer)
+        return int(prev.group(1)) if prev else None
+
+    def _parse_table(self, tokens):
+        i = 0
+        while i + 1 < len(tokens):
+            start, count = int(tokens[i]), int(tokens[i + 1])
+            i += 2
+            for n in range(count):
+                offset, _, kind = tokens[i:i + 3]
+                if kind == b'n':
+                    self.entries.setdefault(start + n, (1, int(offset), 0))
+                i += 3
+
+    def _parse_stream(self, obj):
+        head = obj.split(b'stream', 1)[0]
+        widths = [int(w) for w in re.search(rb'/W\s*\[\s*([\d\s]+)\]', head).group(1).split()]
+        size = int(re.search(rb'/Size\s+(\d+)', head).group(1))
+        index = re.search(rb'/Index\s*\[\s*([\d\s]+)\]', head)
+        ranges = [int(v) for v in index.group(1).split()] if index else [0, size]
+        data = stream_data(obj)
+        columns = re.search(rb'/Columns\s+(\d+)', head)
+        if re.search(rb'/Predictor\s+1\d', head):
+            data = png_unpredict(data, int(columns.group(1)) if columns else sum(widths))
+
+        entries, row_size, pos = {}, sum(widths), 0
+        for start, count in zip(ranges[0::2], ranges[1::2]):
+            for n in range(count):
+                row = data[pos:pos + row_size]
+                pos += row_size
+                fields, at = [], 0
+                for w in widths:
+                    fields.append(int.from_bytes(row[at:at + w], 'big') if w else None)
+                    at += w
+                kind = 1 if fields[0] is None else fields[0]
+                if kind in (1, 2):
+                    entries[start + n] = (kind, fields[1], fields[2] or 0)
+        return head, entries
+
+    def object(self, num):
+        entry = self.entries.get(num)
+        if entry is None:
+            raise PDFInfoError(f"object {num} not in xref")
+        kind, where, index = entry
+        if kind == 1:
+            return read_object(self.reader, where)
+        # Compressed object: lives inside object stream `where`
+        objstm = read_object(self.reader, self.entries[where][1])
+        head = objstm.split(b'stream', 1)[0]
+        first = int(re.search(rb'/First\s+(\d+)', head).group(1))
+        data = stream_data(objstm)
+        pairs = [int(v) for v in data[:first].split()]
+        offsets = pairs[1::2]
+        start = first + offsets[index]
+        end = first + offsets[index + 1] if index + 1 < len(offsets) else len(data)
+        return data[start:end]
+
+def read_object(reader, offset):
+    data = b""
+    while b'endobj' not in data:
+        more = reader.read(offset + len(data), READ_BYTES)
+        if not more or len(data) > MAX_OBJECT_BYTES:
+            raise PDFInfoError(f"unterminated object at {offset}")
+        data += more
+    return data[:data.index(b'endobj')]
+
+def stream_data(obj):
+    head, _, body = obj.partition(b'stream')
+    body = body[2:] if body.startswith(b'\r\n') else body[1:] if body[:1] in (b'\r', b'\n') else body
+    if b'/FlateDecode' not in head:
+        if b'/Filter' in head:
+            raise PDFInfoError("unsupported stream filter")
+        return body.rsplit(b'endstream', 1)[0]
+    try:
+        # decompressobj stops at the end of the zlib stream, so /Length is not needed
+        return zlib.decompressobj().decompress(body)
+    except zlib.error as e:
+        raise PDFInfoError(f"bad stream: {e}")
+
+def png_unpredict(data, columns):
+    out, prev = bytearray(), bytearray(columns)
+    for pos in range(0, len(data), columns + 1):
+        kind, row = data[pos], bytearray(data[pos + 1:pos + 1 + columns])
+        for i in range(len(row)):
+            left = row[i - 1] if i else 0
+            up = prev[i]
+            upleft = prev[i - 1] if i else 0
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xFF
+            elif kind == 4:
+                p = left + up - upleft
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - upleft)
+                row[i] = (row[i] + (left if pa <= pb and pa <= pc else up if pb <= pc else upleft)) & 0xFF
+        out += row
+        prev = row
+    return bytes(out)
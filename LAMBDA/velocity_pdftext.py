@@ -0,0 +1,131 @@
+import itertools
+import multiprocessing
+import os
+
+# Local PDF analysis with PyMuPDF for born-digital pages. Pages come back as
+# Textract-shaped LAYOUT blocks (LINE, LAYOUT_TEXT, LAYOUT_SECTION_HEADER,
+# LAYOUT_FIGURE, normalized bounding boxes), so the manager chunks them and the
+# cropper crops their figures exactly as it does Textract output. A page with
+# almost no text layer under a page-sized image is a scan and is left to Textract.
+#
+# Pages are split into contiguous ranges across processes. Lambda has no /dev/shm,
+# so multiprocessing.Pool, Queue and ProcessPoolExecutor fail there; plain
+# Process + Pipe works.
+
+# A section header's largest span is this much above the page's median font size
+HEADER_SCALE = 1.2
+# Scan detection: less text than this under images covering this share of the page
+MIN_TEXT_CHARS = int(os.environ.get('PDF_MIN_TEXT_CHARS', '50'))
+SCAN_IMAGE_COVERAGE = float(os.environ.get('PDF_SCAN_IMAGE_COVERAGE', '0.5'))
+# Text layers without a usable ToUnicode map decode to U+FFFD; past this share OCR does better
+MAX_UNMAPPED_SHARE = 0.2
+# Fewer pages per process than this is not worth a fork
+MIN_PAGES_PER_WORKER = int(os.environ.get('PDF_MIN_PAGES_PER_WORKER', '8'))
+
+def page_blocks(page):
+    # Textract-shaped blocks of one fitz page, PAGE first
+    width, height = page.rect.width, page.rect.height
+    page_num = page.number + 1
+    counter = itertools.count()
+
+    def block(kind, bbox, **extra):
+        x0, y0, x1, y1 = bbox
+        return {"Id": f"p{page_num}-{next(counter)}", "BlockType": kind, "Page": page_num,
+                "Geometry": {"BoundingBox": {"Left": max(0.0, x0 / width), "Top": max(0.0, y0 / height),
+                                             "Width": (x1 - x0) / width, "Height": (y1 - y0) / height}},
+                **extra}
+
+    content = page.get_text('dict')['blocks']
+    sizes = sorted(span['size'] for b in content if b['type'] == 0
+                   for line in b['lines'] for span in line['spans'] if span['text'].strip())
+    median = sizes[len(sizes) // 2] if sizes else 0
+
+    lines, layouts = [], []
+    for b in content:
+        if b['type'] == 1:
+            layouts.append(block('LAYOUT_FIGURE', b['bbox']))
+            continue
+        children, largest = [], 0
+        for line in b['lines']:
+            text = "".join(span['text'] for span in line['spans']).strip()
+            if not text:
+                continue
+            largest = max([largest] + [span['size'] for span in line['spans']])
+            lines.append(block('LINE', line['bbox'], Text=text, Confidence=99.0))
+            children.append(lines[-1]['Id'])
+        if children:
+            kind = 'LAYOUT_SECTION_HEADER' if median and largest >= median * HEADER_SCALE else 'LAYOUT_TEXT'
+            layouts.append(block(kind, b['bbox'], Relationships=[{"Type": "CHILD", "Ids": children}]))
+    page_block = block('PAGE', (0, 0, width, height),
+                       Relationships=[{"Type": "CHILD", "Ids": [b['Id'] for b in layouts]}])
+    return [page_block] + lines + layouts
+
+def is_born_digital(blocks):
+    page = blocks[0]['Geometry']['BoundingBox']
+    text = "".join(b['Text'] for b in blocks if b['BlockType'] == 'LINE')
+    if text and text.count('�') / len(text) > MAX_UNMAPPED_SHARE:
+        return False
+    if len(text) >= MIN_TEXT_CHARS:
+        return True
+    covered = sum(b['Geometry']['BoundingBox']['Width'] * b['Geometry']['BoundingBox']['Height']
+                  for b in blocks if b['BlockType'] == 'LAYOUT_FIGURE')
+    return covered < SCAN_IMAGE_COVERAGE * page['Width'] * page['Height']
+
+def extract(path, start, stop):
+    # [{"page", "digital", "blocks"}] for pages start..stop-1 (0-based)
+    import fitz
+    doc = fitz.open(path)
+    try:
+        out = []
+        for number in range(start, min(stop, len(doc))):
+            blocks = page_blocks(doc[number])
+            out.append({"page": number + 1, "digital": is_born_digital(blocks), "blocks": blocks})
+        return out
+    finally:
+        doc.close()
+
+def _extract_child(path, start, stop, conn):
+    try:
+        conn.send((True, extract(path, start, stop)))
+    except Exception as e:
+        conn.send((False, f"pages {start + 1}-{stop}: {e!r}"))
+    finally:
+        conn.close()
+
+def page_ranges(page_count, workers):
+    workers = max(1, min(workers, page_count // MIN_PAGES_PER_WORKER))
+    size, extra = divmod(page_count, workers)
+    ranges, start = [], 0
+    for i in range(workers):
+        stop = start + size + (i < extra)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+def extract_parallel(path, page_count, workers=None):
+    # Yields page results in page order; the first range streams while later ones still run
+    ranges = page_ranges(page_count, workers or os.cpu_count() or 1)
+    if len(ranges) == 1:
+        yield from extract(path, 0, page_count)
+        return
+    context = multiprocessing.get_context('fork')
+    running = []
+    try:
+        for start, stop in ranges:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_extract_child, args=(path, start, stop, sender), daemon=True)
+            process.start()
+            sender.close()
+            running.append((process, receiver))
+        for process, receiver in running:
+            ok, result = receiver.recv()
+            if not ok:
+                raise RuntimeError(f"PDF extraction failed for {result}")
+            yield from result
+    finally:
+        for process, receiver in running:
+            receiver.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
@@ -0,0 +1,104 @@
+import os
+import velocity_sqs
+
+# Ingestion scheduling on top of the worker queue fan-out.
+#
+# Fair queuing: every message carries its user_id as MessageGroupId. On a standard
+# queue this turns on SQS fair queuing, which holds back the groups with the most
+# messages in flight, so one user's 5,000-page archive no longer delays everyone
+# else's uploads. Ordering and throughput stay those of a standard queue.
+#
+# Priority lane: small files, by page count for PDFs and by size for CSV and text,
+# go to WORKER_PRIORITY_SQS_URL whole when it is set; everything else goes to
+# WORKER_SQS_URL. The producer routes each file before its first part, so a bulk
+# file never takes priority capacity. Both queues feed the worker; capping the
+# bulk event source's MaximumConcurrency below the function's concurrency keeps
+# room for the priority lane while bulk work still saturates the rest.
+#
+# In-flight cap: with FILE_INFLIGHT_CAP set, the worker leases slots per file_id in
+# the ledger before embedding and sends the records over the cap back to the bulk
+# queue with a delay. Slots lapse after FILE_SLOT_LEASE_SECONDS, so a worker that
+# dies holding them only narrows its file's window until then. A ledger error
+# admits the batch uncapped rather than failing it.
+
+SMALL_FILE_PAGES = int(os.environ.get('SMALL_FILE_PAGES', '20'))
+SMALL_FILE_BYTES = int(os.environ.get('SMALL_FILE_BYTES', str(256 * 1024)))
+# 'off' sends without a MessageGroupId
+FAIR_QUEUING = os.environ.get('FAIR_QUEUING', 'on') != 'off'
+# 0 leaves files uncapped
+FILE_INFLIGHT_CAP = int(os.environ.get('FILE_INFLIGHT_CAP', '0'))
+FILE_SLOT_LEASE_SECONDS = int(os.environ.get('FILE_SLOT_LEASE_SECONDS', '900'))
+DEFER_SECONDS = int(os.environ.get('DEFER_SECONDS', '30'))
+
+class Scheduler:
+    # Drop-in for BatchSender on the producer side
+    def __init__(self, sqs, queue_url, s3, claim_bucket, priority_url=None):
+        self.bulk = velocity_sqs.BatchSender(sqs, queue_url, s3, claim_bucket)
+        self.priority = velocity_sqs.BatchSender(sqs, priority_url, s3, claim_bucket) if priority_url else None
+        # Lane of each routed file; its parts and control messages such as deletes follow it
+        self.lanes = {}
+
+    def route(self, file_id, pages=None, size=None):
+        # Before a file's first part; a file of unknown size stays in bulk
+        if pages is not None:
+            small = int(pages) <= SMALL_FILE_PAGES
+        else:
+            small = size is not None and int(size) <= SMALL_FILE_BYTES
+        self.lanes[file_id] = self.priority if self.priority and small else self.bulk
+
+    def send(self, body):
+        meta = body['metadata']
+        self.lanes.get(meta['file_id'], self.bulk).send(body, group=group_id(meta))
+
+    def lane(self, file_id):
+        # Where the file's messages go
+        return 'priority' if self.priority and self.lanes.get(file_id) is self.priority else 'bulk'
+
+    def flush(self):
+        if self.priority:
+            self.priority.flush()
+        self.bulk.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+def group_id(meta):
+    return meta['user_id'] if FAIR_QUEUING else None
+
+def admit(ledger, chunks):
+    # -> (admitted chunks, chunks over their file's cap, {file_id: slots held})
+    if not FILE_INFLIGHT_CAP:
+        return chunks, [], {}
+    by_file = {}
+    for chunk in chunks:
+        by_file.setdefault(chunk['file_id'], []).append(chunk)
+    admitted, deferred, held = [], [], {}
+    for file_id, group in by_file.items():
+        try:
+            granted = ledger.acquire_slots(file_id, len(group), FILE_INFLIGHT_CAP, FILE_SLOT_LEASE_SECONDS)
+        except Exception as e:
+            # Like a failed stage lookup: the cap is a fairness aid, not worth failing the batch for
+            print(f"Error: slot lease for {file_id}: {e}")
+            admitted += group
+            continue
+        admitted += group[:granted]
+        deferred += group[granted:]
+        if granted:
+            held[file_id] = granted
+    return admitted, deferred, held
+
+def defer(sqs, queue_url, chunk):
+    # The original body goes back unchanged; the receive count starts over, so
+    # waiting for a slot never counts toward the dead-letter redrive
+    entry = {"QueueUrl": queue_url, "MessageBody": chunk['raw'], "DelaySeconds": DEFER_SECONDS}
+    group = group_id(chunk['meta'])
+    if group:
+        entry['MessageGroupId'] = group
+    sqs.send_message(**entry)
+
+def release(ledger, held):
+    for file_id, count in held.items():
+        ledger.release_slots(file_id, count)
@@ -0,0 +1,78 @@
+import os
+import random
+import time
+import uuid
+import velocity_codec
+
+# Buffered SQS producer shared by the manager and vision Lambdas. Messages go out
+# through send_message_batch (10 entries, size-capped) in the velocity_codec format;
+# contents too large for SQS even then are written to S3 and replaced by a
+# content_ref pointer (claim check).
+
+SQS_MAX_BATCH = 10
+SQS_MAX_BYTES = int(os.environ.get('SQS_MAX_BYTES', str(256 * 1024)))
+CLAIM_CHECK_BYTES = int(os.environ.get('CLAIM_CHECK_BYTES', str(200 * 1024)))
+SEND_RETRIES = 5
+
+class BatchSender:
+    def __init__(self, sqs, queue_url, s3, claim_bucket, claim_prefix='claim-check'):
+        self.sqs, self.queue_url = sqs, queue_url
+        self.s3, self.claim_bucket, self.claim_prefix = s3, claim_bucket, claim_prefix
+        self.codec = velocity_codec.Encoder(s3, claim_bucket)
+        self.entries = []
+        self.bytes = 0
+        self.sent = self.api_calls = self.claim_checks = 0
+
+    def send(self, body, group=None):
+        # group becomes the MessageGroupId, which fair-queues a standard queue
+        text = self.codec.encode(body)
+        if len(text.encode('utf-8')) > CLAIM_CHECK_BYTES:
+            text = self.codec.encode(self._claim_check(body))
+        size = len(text.encode('utf-8'))
+        if len(self.entries) >= SQS_MAX_BATCH or self.bytes + size > SQS_MAX_BYTES:
+            self.flush()
+        entry = {"Id": str(len(self.entries)), "MessageBody": text}
+        if group:
+            entry['MessageGroupId'] = group
+        self.entries.append(entry)
+        self.bytes += size
+
+    def _claim_check(self, body):
+        key = f"{self.claim_prefix}/{uuid.uuid4().hex}.txt"
+        self.s3.put_object(Bucket=self.claim_bucket, Key=key, Body=body['content'].encode('utf-8'))
+        self.claim_checks += 1
+        return {**body, "content": None, "content_ref": {"bucket": self.claim_bucket, "key": key}}
+
+    def flush(self):
+        # Retries only the entries SQS rejected, with jittered backoff
+        entries = self.entries
+        self.entries, self.bytes = [], 0
+        for attempt in range(SEND_RETRIES):
+            if not entries:
+                return
+            res = self.sqs.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            self.api_calls += 1
+            self.sent += len(res.get('Successful', []))
+            failed = res.get('Failed', [])
+            sender_faults = [f for f in failed if f.get('SenderFault')]
+            if sender_faults:
+                raise RuntimeError(f"SQS rejected messages: {sender_faults}")
+            failed_ids = {f['Id'] for f in failed}
+            entries = [e for e in entries if e['Id'] in failed_ids]
+            if entries:
+                time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        if entries:
+            raise RuntimeError(f"SQS send failed for {len(entries)} messages after {SEND_RETRIES} attempts")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+def load_content(s3, body):
+    # Consumer side of the claim check
+    ref = body.get('content_ref')
+    if ref:
+        return s3.get_object(Bucket=ref['bucket'], Key=ref['key'])['Body'].read().decode('utf-8')
+    return body['content']
@@ -0,0 +1,164 @@
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+# Structured spans for the ingestion Lambdas, one JSON log line each:
+#   {"span": {"name", "trace_id", "span_id", "parent_id", "file_id", "part_num", "start", "duration_ms", ...}}
+# trace_id and parent_span travel in the metadata passport next to user_id/subject_id/
+# file_id (S3 object metadata, invoke payloads, SQS bodies), so each hop links to the
+# span that sent it. Calls through velocity_aws clients are timed per operation and
+# reported on the invocation span. VELOCITY_TRACE=0 turns emission off.
+
+ENABLED = os.environ.get('VELOCITY_TRACE', '1') != '0'
+
+# Passport fields that only serve tracing; kept out of vector metadata
+TRACE_FIELDS = ('trace_id', 'parent_span')
+
+# Helpers that return objects rather than doing a request
+UNTIMED = {'get_paginator', 'get_waiter', 'can_paginate', 'generate_presigned_url'}
+
+def new_id():
+    return uuid.uuid4().hex[:16]
+
+class Span:
+    def __init__(self, name, meta=None, parent_id=None, **fields):
+        self.fields = {"name": name, "span_id": new_id(), "trace_id": None, "parent_id": parent_id,
+                       "file_id": None, **fields}
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.done = False
+        if meta is not None:
+            self.bind(meta)
+
+    def bind(self, meta):
+        # Adopts the passport's trace (minting one for fresh uploads) and writes it back
+        meta.setdefault('trace_id', uuid.uuid4().hex)
+        self.fields.update(trace_id=meta['trace_id'], file_id=meta.get('file_id'))
+        if self.fields['parent_id'] is None:
+            self.fields['parent_id'] = meta.get('parent_span')
+        return self
+
+    def carry(self, meta):
+        # Passport for the next hop: same trace, this span as parent
+        return {**meta, "trace_id": self.fields['trace_id'] or meta.get('trace_id') or uuid.uuid4().hex,
+                "parent_span": self.fields['span_id']}
+
+    @property
+    def span_id(self):
+        return self.fields['span_id']
+
+    def set(self, **fields):
+        self.fields.update(fields)
+        return self
+
+    def add(self, key, value):
+        self.fields[key] = self.fields.get(key, 0) + value
+
+    def end(self, error=None):
+        if self.done:
+            return
+        self.done = True
+        self.fields.update(start=round(self.start, 6), duration_ms=ms_since(self.started))
+        if error is not None:
+            self.fields['error'] = repr(error)[:300]
+        if ENABLED:
+            print(json.dumps({"span": self.fields}, default=str))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+
+def ms_since(started):
+    return round((time.perf_counter() - started) * 1000, 3)
+
+class CallStats:
+    # Per-operation count, latency and payload bytes for the running invocation
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = {}
+
+    def record(self, op, seconds, nbytes):
+        with self.lock:
+            stats = self.ops.setdefault(op, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, "bytes": 0})
+            stats['calls'] += 1
+            stats['total_ms'] += seconds * 1000
+            stats['max_ms'] = max(stats['max_ms'], seconds * 1000)
+            stats['bytes'] += nbytes
+
+    def drain(self):
+        with self.lock:
+            ops, self.ops = self.ops, {}
+        return {op: {k: round(v, 3) if isinstance(v, float) else v for k, v in s.items()} for op, s in ops.items()}
+
+external = CallStats()
+
+class Instrumented:
+    # Transparent client proxy timing every request method
+    def __init__(self, client, service):
+        self._client, self._service = client, service
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or name in UNTIMED or isinstance(attr, type) or not callable(attr):
+            return attr
+        op = f"{self._service}.{name}"
+
+        @functools.wraps(attr)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            result = None
+            try:
+                result = attr(*args, **kwargs)
+                return result
+            finally:
+                external.record(op, time.perf_counter() - started, payload_bytes(kwargs, result))
+        return timed
+
+def payload_bytes(kwargs, result):
+    size = 0
+    for key in ('Body', 'Payload', 'MessageBody'):
+        value = kwargs.get(key)
+        if isinstance(value, (bytes, bytearray, str)):
+            size += len(value)
+    for entry in kwargs.get('Entries') or []:
+        size += len(entry.get('MessageBody', ''))
+    if isinstance(result, dict) and isinstance(result.get('ContentLength'), int) and 'Body' in result:
+        size += result['ContentLength']
+    return size
+
+_current = None
+_cold = True
+
+def current():
+    # The running invocation's span; handlers bind it to the document they work on
+    return _current or Span('unbound')
+
+def handler(stage):
+    # Wraps a lambda_handler in an invocation span carrying the external call breakdown
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(event, context):
+            global _current, _cold
+            external.drain()
+            span = _current = Span(stage, cold_start=_cold, records=len(event.get('Records', [])) or None)
+            _cold = False
+            error = None
+            try:
+                return fn(event, context)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                span.set(external=external.drain())
+                span.end(error)
+                _current = None
+        return run
+    return wrap
+
+def strip(meta):
+    return {k: v for k, v in meta.items() if k not in TRACE_FIELDS}
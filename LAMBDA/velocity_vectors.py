@@ -0,0 +1,72 @@
+import os
+
+# Layout of the vector index. Vectors live in one namespace per subject ('subject'),
+# per user ('user') or all in the default namespace ('off', the original layout),
+# so a query scans only its own tenant and a subject is deleted with one call.
+# Ids are {file_id}#{suffix}, which lets one file's vectors be listed by prefix.
+
+VECTOR_NAMESPACES = os.environ.get('VECTOR_NAMESPACES', 'subject')
+
+# Pinecone request caps: ids per delete, and vectors per fetch to keep responses small
+DELETE_BATCH_SIZE = 1000
+FETCH_BATCH_SIZE = 100
+
+def namespace(meta, mode=None):
+    mode = mode or VECTOR_NAMESPACES
+    if mode == 'subject':
+        return f"{meta['user_id']}/{meta['subject_id']}"
+    if mode == 'user':
+        return meta['user_id']
+    return ''
+
+def query_filter(meta, mode=None):
+    # Whatever the namespace does not already scope
+    mode = mode or VECTOR_NAMESPACES
+    if mode == 'subject':
+        return None
+    if mode == 'user':
+        return {"subject_id": {"$eq": meta['subject_id']}}
+    return {"user_id": {"$eq": meta['user_id']}, "subject_id": {"$eq": meta['subject_id']}}
+
+def file_prefix(file_id):
+    return f"{file_id}#"
+
+def list_ids(index, prefix, namespace):
+    # Listing by id prefix needs a serverless index
+    for page in index.list(prefix=prefix, namespace=namespace):
+        yield from page
+
+def delete_ids(index, ids, namespace):
+    ids = list(ids)
+    for i in range(0, len(ids), DELETE_BATCH_SIZE):
+        index.delete(ids=ids[i:i + DELETE_BATCH_SIZE], namespace=namespace)
+    return len(ids)
+
+def delete_file(index, meta, mode=None):
+    ns = namespace(meta, mode)
+    return delete_ids(index, list_ids(index, file_prefix(meta['file_id']), ns), ns)
+
+def delete_subject(index, meta, mode=None):
+    mode = mode or VECTOR_NAMESPACES
+    ns = namespace(meta, mode)
+    if mode == 'subject':
+        index.delete(delete_all=True, namespace=ns)
+    else:
+        # Shared namespace: delete by metadata, which only pod-based indexes support
+        index.delete(filter=query_filter(meta, mode), namespace=ns)
+
+def move_file(index, meta, source, target):
+    # Copies one file's vectors between namespaces as stored, then drops the originals
+    ids = list(list_ids(index, file_prefix(meta['file_id']), source))
+    for i in range(0, len(ids), FETCH_BATCH_SIZE):
+        fetched = field(index.fetch(ids=ids[i:i + FETCH_BATCH_SIZE], namespace=source), 'vectors')
+        vectors = [{"id": field(v, 'id'), "values": list(field(v, 'values')), "metadata": field(v, 'metadata') or {}}
+                   for v in fetched.values()]
+        if vectors:
+            index.upsert(vectors=vectors, namespace=target)
+    delete_ids(index, ids, source)
+    return len(ids)
+
+def field(obj, name):
+    # Responses are dicts locally and response objects from the Pinecone client
+    return obj[name] if isinstance(obj, dict) else getattr(obj, name)